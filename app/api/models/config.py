@@ -0,0 +1,14 @@
+"""
+Pydantic models for the client configuration endpoint
+"""
+from pydantic import BaseModel, Field
+from typing import List
+
+
+class ClientConfigResponse(BaseModel):
+    """What the browser needs to prepare uploads"""
+    input_size: List[int] = Field(..., description="Model input [height, width] in pixels")
+    max_side: int = Field(..., description="Downscale images so the longest side is at most this before upload")
+    formats: List[str] = Field(..., description="Accepted upload MIME types, preferred encoding first")
+    quality: float = Field(..., ge=0.0, le=1.0, description="Encoder quality for JPEG/WebP")
+    max_file_size: int = Field(..., description="Largest accepted upload in bytes")
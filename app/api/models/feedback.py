@@ -0,0 +1,39 @@
+"""
+Pydantic models for farmer feedback and active-learning samples
+"""
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+
+class FeedbackRequest(BaseModel):
+    """A farmer's correction of a prediction"""
+    image_hash: str = Field(..., pattern="^[0-9a-f]{64}$", description="image_hash from the prediction response")
+    label: str = Field(..., max_length=100, description="Correct class key or Vietnamese class name")
+    comment: Optional[str] = Field(None, max_length=500)
+    crop: Optional[str] = Field(None, max_length=64)
+    region: Optional[str] = Field(None, max_length=64)
+
+
+class FeedbackResponse(BaseModel):
+    """Response model for the feedback endpoint"""
+    success: bool = True
+    image_hash: str
+    class_index: str = Field(..., description="Class key the label was resolved to")
+    queued: bool = Field(..., description="False when the log buffer was full and the row was dropped")
+
+
+class FeedbackSample(BaseModel):
+    """An uncertain prediction worth labeling"""
+    image_hash: str
+    image_url: Optional[str] = None
+    model_version: Optional[str] = None
+    class_index: str = Field(..., description="Predicted class key")
+    confidence: float = Field(..., description="Top-1 probability 0-1")
+    uncertainty: float
+    timestamp: float
+
+
+class FeedbackSamplesResponse(BaseModel):
+    """Response model for the labeling sampler"""
+    strategy: str
+    samples: List[FeedbackSample]
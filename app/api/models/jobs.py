@@ -0,0 +1,36 @@
+"""
+Pydantic models for async prediction jobs
+"""
+from pydantic import BaseModel, Field
+from typing import List, Optional, Union
+
+from app.api.models.prediction import PredictionResponse, TiledPredictionResponse
+
+
+class JobSubmitResponse(BaseModel):
+    """Response model for a queued job"""
+    id: str
+    status: str
+    kind: str = Field(..., description="'predict' or 'tiles'")
+    priority: str
+    total: int = Field(..., description="Number of images")
+    status_url: str
+    events_url: str = Field(..., description="Server-sent events stream with progress and the final result")
+
+
+class JobStatusResponse(BaseModel):
+    """Status, progress and results of a job"""
+    id: str
+    kind: str
+    status: str = Field(..., description="queued, running, done, failed or cancelled")
+    priority: str
+    total: int
+    done: int
+    progress: float = Field(..., ge=0.0, le=1.0)
+    attempts: int = Field(..., description="Times a worker claimed the job (more than 1 after a crash)")
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    results: List[Union[TiledPredictionResponse, PredictionResponse]] = Field(
+        default_factory=list, description="One prediction per finished image, in upload order")
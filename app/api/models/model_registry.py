@@ -0,0 +1,39 @@
+"""
+Pydantic models for model registry administration
+"""
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+
+
+class ModelVersionInfo(BaseModel):
+    """A loaded model version"""
+    name: str
+    path: Optional[str] = None
+    has_model: bool
+    warm: bool
+    warmup_seconds: Optional[float] = None
+    loaded_at: float
+
+
+class ShadowStats(BaseModel):
+    """Agreement between the active and shadow versions"""
+    compared: int
+    agreed: int
+    mean_abs_diff: float
+
+
+class ModelRegistryResponse(BaseModel):
+    """Response model for the registry status endpoint"""
+    active: Optional[ModelVersionInfo] = None
+    shadow: Optional[ModelVersionInfo] = None
+    student: Optional[ModelVersionInfo] = None
+    versions: List[str]
+    loading: Dict[str, str]
+    shadow_stats: ShadowStats
+
+
+class ModelActionResponse(BaseModel):
+    """Response model for activate/shadow/student requests"""
+    success: bool = True
+    version: Optional[str] = None
+    status: str
@@ -2,7 +2,7 @@
 Pydantic models for prediction requests and responses
 """
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 
 class WebcamPredictRequest(BaseModel):
@@ -26,6 +26,16 @@ class TreatmentInfo(BaseModel):
     severity: str
 
 
+class Explanation(BaseModel):
+    """Rules masks for highlighting affected regions, run-length encoded"""
+    height: int = Field(..., description="Mask height in pixels")
+    width: int = Field(..., description="Mask width in pixels")
+    box: List[float] = Field(..., description="Region of the image the masks cover [left, top, right, bottom], 0-1")
+    encoding: str = Field("rle", description="Row-major run lengths, background run first")
+    layers: Dict[str, List[int]] = Field(..., description="Run lengths per mask layer")
+    coverage: Dict[str, float] = Field(..., description="Fraction of pixels in each layer")
+
+
 class PredictionResponse(BaseModel):
     """Response model for prediction endpoints"""
     success: bool = True
@@ -34,11 +44,39 @@ class PredictionResponse(BaseModel):
     all_predictions: List[PredictionItem]
     treatment: TreatmentInfo
     image_url: str
+    model_version: Optional[str] = Field(None, description="Model version that served this prediction")
+    explanation: Optional[Explanation] = Field(None, description="Mask overlay, only when requested with ?explain=true")
+    image_hash: Optional[str] = Field(None, description="SHA-256 of the image, used to send feedback")
+    
+    class Config:
+        populate_by_name = True
+
+
+class TileItem(BaseModel):
+    """Prediction for one tile of a tiled image"""
+    row: int
+    col: int
+    x: int = Field(..., description="Left edge in original image pixels")
+    y: int = Field(..., description="Top edge in original image pixels")
+    class_: str = Field(..., alias="class", description="Top disease class name in Vietnamese")
+    class_index: str = Field(..., description="Top disease class key")
+    confidence: float = Field(..., ge=0.0, le=100.0, description="Confidence score 0-100")
+    leaf_fraction: float = Field(..., description="Fraction of the tile covered by leaf")
     
     class Config:
         populate_by_name = True
 
 
+class TiledPredictionResponse(PredictionResponse):
+    """Response model for tiled prediction of high-resolution images"""
+    image_size: List[int] = Field(..., description="Original image [width, height]")
+    tile_size: List[int] = Field(..., description="Tile [height, width] in original image pixels")
+    grid: List[int] = Field(..., description="Tile grid [rows, cols]")
+    heatmap: List[List[float]] = Field(..., description="Disease probability (0-1) per tile, rows x cols")
+    affected_fraction: float = Field(..., description="Fraction of leaf tiles whose top class is a disease")
+    tiles: List[TileItem]
+
+
 class ErrorResponse(BaseModel):
     """Error response model"""
     error: str
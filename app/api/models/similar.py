@@ -0,0 +1,24 @@
+"""
+Pydantic models for similar past case lookups
+"""
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+
+class SimilarCase(BaseModel):
+    """A previously scored image close to the query image"""
+    image_url: Optional[str] = None
+    similarity: float = Field(..., description="Cosine similarity -1..1")
+    class_: str = Field(..., alias="class", description="Disease class name in Vietnamese")
+    class_index: str
+    confidence: float = Field(..., ge=0.0, le=100.0)
+    model_version: Optional[str] = None
+
+    class Config:
+        populate_by_name = True
+
+
+class SimilarCasesResponse(BaseModel):
+    """Response model for the similar cases endpoint"""
+    index: str = Field(..., description="Index searched: 'deep' or 'thumb'")
+    cases: List[SimilarCase]
@@ -0,0 +1,19 @@
+"""
+Pydantic models for the treatment database endpoint
+"""
+from pydantic import BaseModel, Field
+from typing import List
+
+from app.api.models.prediction import TreatmentInfo
+
+
+class ClassTreatment(BaseModel):
+    """Label and treatment for one class, as shown with a prediction"""
+    key: str = Field(..., description="Disease class key")
+    label: str = Field(..., description="Class name shown to the user")
+    treatment: TreatmentInfo
+
+
+class TreatmentsResponse(BaseModel):
+    """All classes in score order, for on-device diagnosis"""
+    classes: List[ClassTreatment]
@@ -0,0 +1,65 @@
+"""
+Fast JSON responses for prediction results
+
+Prediction responses are built from data the app produced itself, so they
+are created with ``model_construct`` (no validation) and returned as a
+ready-made response, which also skips FastAPI's second validation pass
+against ``response_model`` (still used for the OpenAPI schema). Bodies are
+encoded with orjson when it is installed, and the treatment part, which
+only depends on the predicted class, is encoded once per class and spliced
+in as bytes.
+"""
+
+import json
+from functools import lru_cache
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content):
+    """Encode to JSON bytes (same output as Starlette's JSONResponse, faster with orjson)"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON response whose content is either pre-encoded bytes or plain data"""
+    media_type = "application/json"
+
+    def render(self, content):
+        return content if isinstance(content, bytes) else dumps(content)
+
+
+@lru_cache(maxsize=256)
+def treatment_info(disease_name):
+    """TreatmentInfo for a class name; the treatment database is static"""
+    from app.api.models.prediction import TreatmentInfo
+    from app.core.data.treatment_data import get_treatment_info
+    return TreatmentInfo.model_construct(**get_treatment_info(disease_name))
+
+
+@lru_cache(maxsize=256)
+def treatment_fragment(disease_name):
+    """Encoded JSON of ``treatment_info(disease_name)``"""
+    return dumps(treatment_info(disease_name).model_dump())
+
+
+def prediction_response(result):
+    """
+    Encode a PredictionResponse or TiledPredictionResponse built from trusted data
+
+    Args:
+        result: Response model whose treatment is ``treatment_info`` of the top class
+
+    Returns:
+        FastJSONResponse
+    """
+    body = dumps(result.model_dump(by_alias=True, exclude={"treatment"}))
+    fragment = treatment_fragment(result.top_prediction.class_)
+    return FastJSONResponse(body[:-1] + b',"treatment":' + fragment + b"}")
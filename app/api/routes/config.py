@@ -0,0 +1,36 @@
+"""
+Client configuration: model input size and upload formats for browser-side resizing
+"""
+from fastapi import APIRouter
+
+from app.config import settings
+from app.api.models.config import ClientConfigResponse
+
+router = APIRouter()
+
+
+def upload_formats():
+    """Accepted upload MIME types, most compact encoding first"""
+    from PIL import features
+    formats = ["image/jpeg", "image/png"]
+    if "webp" in settings.ALLOWED_EXTENSIONS and features.check("webp"):
+        formats.insert(0, "image/webp")
+    return formats
+
+
+@router.get("/config", response_model=ClientConfigResponse)
+async def client_config():
+    """
+    Upload parameters for the frontend
+    
+    The browser downscales images to ``max_side`` and re-encodes them in the
+    first of ``formats`` it can produce, so full-resolution photos never
+    cross slow mobile links.
+    """
+    return ClientConfigResponse(
+        input_size=list(settings.IMG_SIZE),
+        max_side=settings.CLIENT_MAX_SIDE,
+        formats=upload_formats(),
+        quality=settings.CLIENT_IMAGE_QUALITY,
+        max_file_size=settings.MAX_FILE_SIZE
+    )
@@ -0,0 +1,66 @@
+"""
+Farmer feedback and active-learning sample selection
+"""
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from typing import Optional
+
+from app.api.models.feedback import FeedbackRequest, FeedbackResponse, FeedbackSamplesResponse, FeedbackSample
+from app.api.models.prediction import ErrorResponse
+from app.api.routes.models import check_admin_token
+
+router = APIRouter()
+
+
+@router.post("/feedback", response_model=FeedbackResponse, responses={400: {"model": ErrorResponse}, 409: {"model": ErrorResponse}})
+async def submit_feedback(data: FeedbackRequest):
+    """
+    Record the correct disease for a previous prediction
+
+    - **image_hash**: ``image_hash`` returned with the prediction
+    - **label**: Correct class (key such as ``benh_dom_la`` or the Vietnamese name)
+    """
+    from app.core import feedback
+    from app.core.ml.model_handler import class_key
+
+    if not feedback.is_enabled():
+        raise HTTPException(status_code=409, detail="Feedback is disabled")
+    key = class_key(data.label)
+    if key is None:
+        raise HTTPException(status_code=400, detail=f"Unknown disease class: {data.label}")
+
+    queued = feedback.record_correction(data.image_hash, key, data.comment, data.crop, data.region)
+    return FeedbackResponse(image_hash=data.image_hash, class_index=key, queued=queued)
+
+
+@router.get("/feedback/samples", response_model=FeedbackSamplesResponse, responses={403: {"model": ErrorResponse}})
+async def feedback_samples(
+    k: int = Query(20, ge=1, le=500),
+    strategy: str = Query("margin", pattern="^(margin|entropy|least_confidence)$"),
+    version: Optional[str] = Query(None, max_length=100, description="Only predictions served by this version"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Most uncertain uncorrected predictions, for labeling (needs X-Admin-Token)
+
+    - **k**: Number of samples
+    - **strategy**: margin (top-1 minus top-2), entropy or least_confidence
+    """
+    check_admin_token(x_admin_token)
+    from app.core import feedback
+
+    # Reads every prediction and correction part file, so keep it off the event loop
+    uncertain = await run_in_threadpool(feedback.uncertain_samples, k, strategy, version)
+    samples = [
+        FeedbackSample(
+            image_hash=s["image_hash"],
+            image_url=f"/static/uploads/{s['image']}" if s["image"] else None,
+            model_version=s["version"] or None,
+            class_index=s["class_index"],
+            confidence=s["confidence"],
+            uncertainty=s["uncertainty"],
+            timestamp=s["timestamp"]
+        )
+        for s in uncertain
+    ]
+    return FeedbackSamplesResponse(strategy=strategy, samples=samples)
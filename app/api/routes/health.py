@@ -2,8 +2,10 @@
 Health check endpoint for monitoring
 """
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from datetime import datetime
+from typing import Optional
 import sys
 import platform
 
@@ -17,6 +19,16 @@ class HealthResponse(BaseModel):
     version: str
     python_version: str
     platform: str
+    ready: bool = False
+    warmup_seconds: Optional[float] = None
+    memory: Optional[dict] = None  # RSS per component and the memory budget, in MB
+
+
+class ReadinessResponse(BaseModel):
+    """Readiness check response model"""
+    ready: bool
+    warmup_seconds: Optional[float] = None
+    error: Optional[str] = None
 
 
 @router.get("/health", response_model=HealthResponse)
@@ -25,10 +37,33 @@ async def health_check():
     Health check endpoint for Render monitoring
     Returns 200 OK if service is running
     """
+    from app.core import memory
+    from app.core.ml.warmup import state
     return HealthResponse(
         status="healthy",
         timestamp=datetime.now().isoformat(),
         version="2.0.0",
         python_version=f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}",
-        platform=platform.system()
+        platform=platform.system(),
+        ready=state["ready"],
+        warmup_seconds=state["duration"],
+        memory=memory.report()
+    )
+
+
+@router.get("/health/ready", response_model=ReadinessResponse, responses={503: {"model": ReadinessResponse}})
+async def readiness_check():
+    """
+    Readiness probe
+    Returns 503 until the model is loaded and warm-up has finished, and
+    for good if loading failed (``error`` says why)
+    """
+    from app.core.ml.warmup import state
+    body = ReadinessResponse(
+        ready=state["ready"],
+        warmup_seconds=state["duration"],
+        error=state["error"]
     )
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content=body.model_dump())
+    return body
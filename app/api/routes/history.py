@@ -3,6 +3,7 @@ History routes for managing prediction history
 """
 from fastapi import APIRouter, Request
 from app.api.models.history import HistoryResponse, HistoryItem, ClearHistoryResponse
+from app.core.sessions import load_session
 
 router = APIRouter()
 
@@ -10,12 +11,14 @@ router = APIRouter()
 @router.get("/history", response_model=HistoryResponse)
 async def get_history(request: Request):
     """Get prediction history from session"""
-    history = request.session.get("history", [])
+    session = await load_session(request)
+    history = session.get("history", [])
     return HistoryResponse(history=history)
 
 
 @router.post("/clear-history", response_model=ClearHistoryResponse)
 async def clear_history(request: Request):
     """Clear all prediction history"""
-    request.session["history"] = []
+    session = await load_session(request)
+    session["history"] = []
     return ClearHistoryResponse(success=True)
@@ -0,0 +1,235 @@
+"""
+Async prediction jobs with polling and server-sent events
+"""
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+import asyncio
+import json
+import uuid
+
+from app.config import settings
+from app.core import jobs, uploads
+from app.utils.clients import client_id
+from app.utils.hashing import content_hash
+from app.api.models.jobs import JobSubmitResponse, JobStatusResponse
+from app.api.models.prediction import ErrorResponse
+from app.api.routes.predict import allowed_file, secure_filename, build_prediction_response, build_tiled_response
+
+router = APIRouter()
+
+PRIORITY_NAMES = {value: name for name, value in jobs.PRIORITIES.items()}
+EVENT_POLL_INTERVAL = 0.5
+EVENT_KEEPALIVE = 15.0
+
+
+def run_predict_job(job, report):
+    """Score each uploaded image with ``get_predictions``"""
+    from app.core.ml.model_handler import get_predictions
+
+    params = job["params"]
+    results = []
+    for image in params["images"]:
+        image_path = uploads.local_path(image["file"])
+        explanation = None
+        if params["explain"]:
+            predictions, explanation = get_predictions(
+                str(image_path), top_k=3, tta_views=params["tta"], explain=True, crop=params["crop"],
+                region=params["region"], priority=params["priority"], image_hash=image["hash"]
+            )
+        else:
+            predictions = get_predictions(
+                str(image_path), top_k=3, tta_views=params["tta"], crop=params["crop"],
+                region=params["region"], priority=params["priority"], image_hash=image["hash"]
+            )
+        response = build_prediction_response(predictions, image["file"], explanation, image["hash"])
+        results.append(response.model_dump(mode="json", by_alias=True))
+        report(len(results), results)
+    return results
+
+
+def run_tiles_job(job, report):
+    """Tiled prediction for each uploaded image"""
+    from app.core.ml.tiling import predict_tiles
+
+    params = job["params"]
+    results = []
+    for image in params["images"]:
+        result = predict_tiles(str(uploads.local_path(image["file"])), overlap=params["overlap"])
+        response = build_tiled_response(result, image["file"], image["hash"])
+        results.append(response.model_dump(mode="json", by_alias=True))
+        report(len(results), results)
+    return results
+
+
+jobs.register_handler("predict", run_predict_job)
+jobs.register_handler("tiles", run_tiles_job)
+
+
+def job_status(job):
+    return JobStatusResponse(
+        id=job["id"],
+        kind=job["kind"],
+        status=job["status"],
+        priority=PRIORITY_NAMES.get(job["priority"], "normal"),
+        total=job["total"],
+        done=job["done"],
+        progress=job["done"] / job["total"] if job["total"] else 1.0,
+        attempts=job["attempts"],
+        created_at=job["created_at"],
+        started_at=job["started_at"],
+        finished_at=job["finished_at"],
+        error=job["error"],
+        results=job["results"]
+    )
+
+
+async def get_job_or_404(job_id):
+    job = await run_in_threadpool(jobs.get_store().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/jobs", response_model=JobSubmitResponse, status_code=202,
+             responses={400: {"model": ErrorResponse}, 409: {"model": ErrorResponse}, 429: {"model": ErrorResponse}})
+async def submit_job(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    mode: str = Query("predict", pattern="^(predict|tiles)$", description="'predict' per image or 'tiles' for canopy images"),
+    tta: int = Query(0, ge=0, le=settings.TTA_MAX_VIEWS, description="Test-time augmentation views (0 = off)"),
+    explain: bool = Query(False, description="Include the rules masks as a highlight overlay"),
+    crop: Optional[str] = Query(None, max_length=64, description="Crop type, selects calibrated priors"),
+    region: Optional[str] = Query(None, max_length=64, description="Growing region, selects calibrated priors"),
+    overlap: float = Query(settings.TILE_OVERLAP, ge=0.0, le=0.75, description="Tile overlap fraction (tiles mode)"),
+    priority: str = Query("normal", pattern="^(high|normal|low)$", description="Queue priority")
+):
+    """
+    Queue images for prediction and return immediately with a job ID
+    
+    Poll ``GET /api/jobs/{id}`` or follow ``GET /api/jobs/{id}/events``.
+    
+    - **files**: Image files (PNG, JPG, JPEG), up to JOB_MAX_FILES
+    - **mode**: predict or tiles
+    - **priority**: high/normal/low queue order (low may also use the student model)
+    """
+    if not jobs.is_enabled():
+        raise HTTPException(status_code=409, detail="Jobs are disabled")
+    if len(files) > settings.JOB_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {settings.JOB_MAX_FILES} images per job")
+    
+    client = client_id(request.scope)
+    store = jobs.get_store()
+    if await run_in_threadpool(store.unfinished, client) >= settings.JOB_CLIENT_MAX_QUEUED:
+        raise HTTPException(status_code=429, detail="Too many unfinished jobs, wait for some to complete")
+    
+    from app.core.ml.preprocessing import validate_image
+    from app.core.ml.tiling import check_canopy
+    
+    saved, hashes = [], []
+    try:
+        for file in files:
+            if not file.filename or not allowed_file(file.filename):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid file type. Only {', '.join(settings.ALLOWED_EXTENSIONS)} allowed"
+                )
+            unique_filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+            contents = await file.read()
+            image_path = uploads.save(unique_filename, contents)
+            saved.append(image_path)
+            if not validate_image(str(image_path)):
+                raise HTTPException(status_code=400, detail=f"Invalid image file: {file.filename}")
+            if mode == "tiles":
+                try:
+                    check_canopy(str(image_path))
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=f"{file.filename}: {e}")
+            hashes.append(content_hash(contents))
+    except HTTPException:
+        # Clean up this job's files on error
+        for path in saved:
+            uploads.delete(path.name)
+        raise
+    
+    params = {
+        "images": [{"file": path.name, "hash": image_hash} for path, image_hash in zip(saved, hashes)],
+        "tta": tta,
+        "explain": explain,
+        "crop": crop,
+        "region": region,
+        "overlap": overlap,
+        "priority": priority
+    }
+    job = await run_in_threadpool(jobs.submit, client, mode, params, len(saved), priority)
+    print(f"📥 Job {job['id']} queued: {mode}, {len(saved)} images, {priority} priority")
+    
+    return JobSubmitResponse(
+        id=job["id"],
+        status=job["status"],
+        kind=mode,
+        priority=priority,
+        total=len(saved),
+        status_url=f"/api/jobs/{job['id']}",
+        events_url=f"/api/jobs/{job['id']}/events"
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse, responses={404: {"model": ErrorResponse}})
+async def get_job(job_id: str):
+    """Status, progress and (partial) results of a job"""
+    return job_status(await get_job_or_404(job_id))
+
+
+@router.get("/jobs/{job_id}/events", responses={404: {"model": ErrorResponse}})
+async def job_events(request: Request, job_id: str):
+    """
+    Server-sent events for a job
+    
+    ``progress`` events carry status and counts; the stream ends with one
+    ``done``, ``failed`` or ``cancelled`` event holding the full job status.
+    """
+    job = await get_job_or_404(job_id)
+    store = jobs.get_store()
+    
+    async def stream():
+        current = job
+        last = None
+        last_sent = asyncio.get_running_loop().time()
+        while True:
+            if current is None:
+                yield "event: failed\ndata: {\"error\": \"Job not found\"}\n\n"
+                return
+            if current["status"] in jobs.FINISHED:
+                payload = job_status(current).model_dump_json(by_alias=True)
+                yield f"event: {current['status']}\ndata: {payload}\n\n"
+                return
+            
+            state = (current["status"], current["done"])
+            now = asyncio.get_running_loop().time()
+            if state != last:
+                data = {"id": job_id, "status": current["status"], "done": current["done"], "total": current["total"]}
+                yield f"event: progress\ndata: {json.dumps(data)}\n\n"
+                last, last_sent = state, now
+            elif now - last_sent >= EVENT_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                last_sent = now
+            
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+            current = await run_in_threadpool(store.get, job_id)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.delete("/jobs/{job_id}", response_model=JobStatusResponse,
+               responses={404: {"model": ErrorResponse}, 409: {"model": ErrorResponse}})
+async def cancel_job(job_id: str):
+    """Cancel a job that has not started yet"""
+    await get_job_or_404(job_id)
+    if not await run_in_threadpool(jobs.get_store().cancel, job_id):
+        raise HTTPException(status_code=409, detail="Only queued jobs can be cancelled")
+    return job_status(await get_job_or_404(job_id))
@@ -0,0 +1,37 @@
+"""
+Metrics endpoint for monitoring inference behaviour
+"""
+from fastapi import APIRouter
+from pydantic import BaseModel
+from typing import Dict
+
+router = APIRouter()
+
+
+class TimingStats(BaseModel):
+    """Latency summary for one timed operation"""
+    count: int
+    mean_ms: float
+    max_ms: float
+
+
+class MetricsResponse(BaseModel):
+    """Metrics response model"""
+    counters: Dict[str, float]
+    timings: Dict[str, TimingStats]
+    cascade_exit_rates: Dict[str, float]
+    admission: Dict[str, float]
+
+
+@router.get("/metrics", response_model=MetricsResponse)
+async def get_metrics():
+    """Return in-process counters, latency summaries, cascade exit rates and the admission limit"""
+    from app.core import metrics, admission
+    from app.core.ml import cascade
+    snapshot = metrics.snapshot()
+    return MetricsResponse(
+        counters=snapshot["counters"],
+        timings=snapshot["timings"],
+        cascade_exit_rates=cascade.exit_rates(),
+        admission=admission.status()
+    )
@@ -0,0 +1,98 @@
+"""
+Model registry administration routes
+"""
+from fastapi import APIRouter, Header, HTTPException
+from typing import Optional
+import hmac
+
+from app.config import settings
+from app.api.models.model_registry import ModelRegistryResponse, ModelActionResponse
+from app.api.models.prediction import ErrorResponse
+
+router = APIRouter()
+
+
+def check_admin_token(token: Optional[str]):
+    """Reject the request unless it carries the configured admin token (always, when none is set)"""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin routes are disabled (ADMIN_TOKEN is not set)")
+    if token is None or not hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@router.get("/models", response_model=ModelRegistryResponse)
+async def get_models():
+    """List model versions and show which ones are active, shadowing and serving as student"""
+    from app.core.ml.model_registry import get_registry
+    return ModelRegistryResponse(**get_registry().status())
+
+
+@router.post("/models/{version}/activate", response_model=ModelActionResponse, status_code=202,
+             responses={403: {"model": ErrorResponse}, 404: {"model": ErrorResponse}})
+async def activate_model(version: str, x_admin_token: Optional[str] = Header(None)):
+    """
+    Warm a model version in the background and swap it in once ready
+
+    - **version**: Version name from models/manifest.json
+    """
+    check_admin_token(x_admin_token)
+    from app.core.ml.model_registry import get_registry
+    try:
+        get_registry().activate(version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return ModelActionResponse(version=version, status="loading")
+
+
+@router.post("/models/{version}/shadow", response_model=ModelActionResponse, status_code=202,
+             responses={403: {"model": ErrorResponse}, 404: {"model": ErrorResponse}})
+async def shadow_model(version: str, x_admin_token: Optional[str] = Header(None)):
+    """
+    Score every request with a second version in the background for comparison
+
+    - **version**: Version name from models/manifest.json
+    """
+    check_admin_token(x_admin_token)
+    from app.core.ml.model_registry import get_registry
+    try:
+        get_registry().set_shadow(version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return ModelActionResponse(version=version, status="loading")
+
+
+@router.delete("/models/shadow", response_model=ModelActionResponse,
+               responses={403: {"model": ErrorResponse}})
+async def stop_shadow(x_admin_token: Optional[str] = Header(None)):
+    """Stop shadow scoring"""
+    check_admin_token(x_admin_token)
+    from app.core.ml.model_registry import get_registry
+    get_registry().set_shadow(None)
+    return ModelActionResponse(status="stopped")
+
+
+@router.post("/models/{version}/student", response_model=ModelActionResponse, status_code=202,
+             responses={403: {"model": ErrorResponse}, 404: {"model": ErrorResponse}})
+async def student_model(version: str, x_admin_token: Optional[str] = Header(None)):
+    """
+    Serve low-priority requests with a cheaper (distilled) version
+
+    - **version**: Version name from models/manifest.json
+    """
+    check_admin_token(x_admin_token)
+    from app.core.ml.model_registry import get_registry
+    try:
+        get_registry().set_student(version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return ModelActionResponse(version=version, status="loading")
+
+
+@router.delete("/models/student", response_model=ModelActionResponse,
+               responses={403: {"model": ErrorResponse}})
+async def stop_student(x_admin_token: Optional[str] = Header(None)):
+    """Send every request to the active version again"""
+    check_admin_token(x_admin_token)
+    from app.core.ml.model_registry import get_registry
+    get_registry().set_student(None)
+    return ModelActionResponse(status="stopped")
@@ -6,12 +6,37 @@ from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
 from app.config import settings
+from app.core.assets import asset, cached_page, content_version
 
 router = APIRouter()
 templates = Jinja2Templates(directory=str(settings.TEMPLATES_DIR))
 
+# Static files the service worker caches for offline use
+SHELL_ASSETS = (
+    "css/style.css",
+    "js/libs/chart.min.js",
+    "js/rules.js",
+    "js/offline.js",
+    "js/main.js",
+    "js/chart_handler.js",
+    "manifest.webmanifest",
+    "icons/icon-192.png",
+    "icons/icon-512.png"
+)
+
 
 @router.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    """Render homepage with plant disease detection UI"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    """Serve homepage with plant disease detection UI (rendered once, revalidated by ETag)"""
+    return cached_page(templates, "index.html").response(request.scope)
+
+
+@router.get("/sw.js", include_in_schema=False)
+async def service_worker(request: Request):
+    """Service worker, served from the root so its scope covers the whole app"""
+    page = cached_page(
+        templates, "sw.js", media_type="application/javascript",
+        shell=["/"] + [asset(path) for path in SHELL_ASSETS],
+        version=content_version(SHELL_ASSETS)
+    )
+    return page.response(request.scope)
@@ -1,21 +1,31 @@
 """
 Prediction routes for plant disease detection
 """
-from fastapi import APIRouter, UploadFile, File, HTTPException, Request
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Query
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime
 import uuid
 import base64
 import os
 from pathlib import Path
+from typing import Optional
+
+import numpy as np
 
 from app.config import settings
+from app.core import uploads
+from app.core.sessions import load_session
+from app.utils.hashing import content_hash
 from app.api.models.prediction import (
     WebcamPredictRequest,
     PredictionResponse,
     PredictionItem,
-    TreatmentInfo,
+    Explanation,
+    TiledPredictionResponse,
+    TileItem,
     ErrorResponse
 )
+from app.api.responses import prediction_response, treatment_info
 
 router = APIRouter()
 
@@ -36,12 +46,90 @@ def secure_filename(filename: str) -> str:
     return filename
 
 
+def build_prediction_response(predictions, unique_filename, explanation=None, image_hash=None):
+    """
+    PredictionResponse for ``get_predictions`` output on a stored upload
+    
+    Built without validation: every field comes from the app itself.
+    """
+    return PredictionResponse.model_construct(
+        success=True,
+        timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        top_prediction=PredictionItem.model_construct(**predictions[0]),
+        all_predictions=[PredictionItem.model_construct(**p) for p in predictions],
+        treatment=treatment_info(predictions[0]['class']),
+        image_url=f"/static/uploads/{unique_filename}",
+        model_version=predictions[0].get('model_version'),
+        explanation=Explanation.model_construct(**explanation) if explanation else None,
+        image_hash=image_hash
+    )
+
+
+def build_tiled_response(result, unique_filename, image_hash=None):
+    """TiledPredictionResponse for ``tiling.predict_tiles`` output on a stored upload, built without validation"""
+    from app.core.ml.model_handler import probs_to_predictions, scores_to_dict, DISEASE_KEYS
+    
+    version = result["version"]
+    predictions = probs_to_predictions(scores_to_dict(result["image_scores"]), 3, version)
+    
+    scores = result["scores"]
+    leaf_fraction = result["leaf_fraction"]
+    rows, cols = scores.shape[:2]
+    healthy = DISEASE_KEYS.index('khoe_manh')
+    top = scores.argmax(axis=2)
+    
+    tiles = []
+    for row in range(rows):
+        for col in range(cols):
+            tile_top = probs_to_predictions(scores_to_dict(scores[row, col]), 1, version)[0]
+            tiles.append(TileItem.model_construct(
+                row=row,
+                col=col,
+                x=int(result["xs"][col]),
+                y=int(result["ys"][row]),
+                leaf_fraction=float(leaf_fraction[row, col]),
+                **{k: tile_top[k] for k in ('class', 'class_index', 'confidence')}
+            ))
+    
+    leafy = leaf_fraction >= settings.ROI_MIN_FRACTION
+    affected = float((top[leafy] != healthy).mean()) if leafy.any() else 0.0
+    
+    return TiledPredictionResponse.model_construct(
+        success=True,
+        timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        top_prediction=PredictionItem.model_construct(**predictions[0]),
+        all_predictions=[PredictionItem.model_construct(**p) for p in predictions],
+        treatment=treatment_info(predictions[0]['class']),
+        image_url=f"/static/uploads/{unique_filename}",
+        model_version=version,
+        image_hash=image_hash,
+        image_size=list(result["image_size"]),
+        tile_size=list(result["tile_size"]),
+        grid=[rows, cols],
+        heatmap=np.round(1.0 - scores[..., healthy], 4).tolist(),
+        affected_fraction=affected,
+        tiles=tiles
+    )
+
+
 @router.post("/predict/upload", response_model=PredictionResponse, responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
-async def predict_upload(request: Request, file: UploadFile = File(...)):
+async def predict_upload(
+    request: Request,
+    file: UploadFile = File(...),
+    tta: int = Query(0, ge=0, le=settings.TTA_MAX_VIEWS, description="Test-time augmentation views (0 = off)"),
+    explain: bool = Query(False, description="Include the rules masks as a highlight overlay"),
+    crop: Optional[str] = Query(None, max_length=64, description="Crop type, selects calibrated priors"),
+    region: Optional[str] = Query(None, max_length=64, description="Growing region, selects calibrated priors"),
+    priority: str = Query("normal", pattern="^(high|normal|low)$", description="Low priority may be served by the distilled student model")
+):
     """
     Handle file upload prediction
     
     - **file**: Image file (PNG, JPG, JPEG) - max 16MB
+    - **tta**: Optional number of augmented views for hard cases, scored as one batch
+    - **explain**: Return the color/spot masks used by the rules for highlighting
+    - **crop** / **region**: Optional context for calibrated confidence
+    - **priority**: high/normal/low; low-priority requests may use the cheaper student model
     """
     temp_file = None
     
@@ -59,12 +147,10 @@ async def predict_upload(request: Request, file: UploadFile = File(...)):
         # Save file with unique name
         filename = secure_filename(file.filename)
         unique_filename = f"{uuid.uuid4().hex}_{filename}"
-        image_path = settings.UPLOAD_FOLDER / unique_filename
         
-        # Write file
+        # Write file (published to the shared upload store)
         contents = await file.read()
-        with open(image_path, 'wb') as f:
-            f.write(contents)
+        image_path = uploads.save(unique_filename, contents)
         
         temp_file = image_path
         
@@ -73,14 +159,26 @@ async def predict_upload(request: Request, file: UploadFile = File(...)):
         if not validate_image(str(image_path)):
             raise HTTPException(status_code=400, detail="Invalid image file")
         
+        # Feedback for this prediction refers to it by content hash
+        image_hash = content_hash(contents)
+        
         # Get predictions
-        from app.core.ml.model_handler import get_predictions
-        from app.core.data.treatment_data import get_treatment_info
+        from app.core.ml.model_handler import get_predictions_async
         
         try:
             print(f"🔍 Starting prediction for: {image_path}")
-            predictions = get_predictions(str(image_path), top_k=3)
-            print(f"✅ Prediction successful: {predictions[0]['disease']}")
+            explanation = None
+            if explain:
+                predictions, explanation = await get_predictions_async(
+                    str(image_path), top_k=3, tta_views=tta, explain=True, crop=crop, region=region,
+                    priority=priority, image_hash=image_hash
+                )
+            else:
+                predictions = await get_predictions_async(
+                    str(image_path), top_k=3, tta_views=tta, crop=crop, region=region, priority=priority,
+                    image_hash=image_hash
+                )
+            print(f"✅ Prediction successful: {predictions[0]['class']}")
         except Exception as pred_error:
             import traceback
             error_details = traceback.format_exc()
@@ -91,21 +189,11 @@ async def predict_upload(request: Request, file: UploadFile = File(...)):
                 detail=f"Prediction failed: {str(pred_error)}"
             )
         
-        # Get treatment info for top prediction
-        top_class = predictions[0]['class']
-        treatment = get_treatment_info(top_class)
-        
-        # Build response
-        result = PredictionResponse(
-            success=True,
-            timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            top_prediction=PredictionItem(**predictions[0]),
-            all_predictions=[PredictionItem(**p) for p in predictions],
-            treatment=TreatmentInfo(**treatment),
-            image_url=f"/static/uploads/{unique_filename}"
-        )
+        # Build response (with treatment info for the top prediction)
+        result = build_prediction_response(predictions, unique_filename, explanation, image_hash)
         
         # Add to session history
+        await load_session(request)
         if "history" not in request.session:
             request.session["history"] = []
         
@@ -119,18 +207,18 @@ async def predict_upload(request: Request, file: UploadFile = File(...)):
         request.session["history"].insert(0, history_entry)
         request.session["history"] = request.session["history"][:10]  # Keep last 10
         
-        return result
+        return prediction_response(result)
         
     except HTTPException:
         # Clean up temp file on error
-        if temp_file and temp_file.exists():
-            temp_file.unlink()
+        if temp_file:
+            uploads.delete(temp_file.name)
         raise
     
     except Exception as e:
         # Clean up temp file on error
-        if temp_file and temp_file.exists():
-            temp_file.unlink()
+        if temp_file:
+            uploads.delete(temp_file.name)
         
         # Log the full error for debugging
         import traceback
@@ -140,12 +228,104 @@ async def predict_upload(request: Request, file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 
+@router.post("/predict/tiles", response_model=TiledPredictionResponse, responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
+async def predict_tiles(
+    request: Request,
+    file: UploadFile = File(...),
+    overlap: float = Query(settings.TILE_OVERLAP, ge=0.0, le=0.75, description="Fraction of a tile shared with its neighbour")
+):
+    """
+    Tiled prediction for high-resolution canopy and drone images
+    
+    The image is cut into overlapping model-sized tiles that are scored in
+    batches. Returns a per-tile disease heatmap plus an image-level result.
+    
+    - **file**: Image file (PNG, JPG, JPEG) - max 16MB
+    - **overlap**: Tile overlap fraction
+    """
+    temp_file = None
+    
+    try:
+        if not file.filename:
+            raise HTTPException(status_code=400, detail="No file selected")
+        
+        if not allowed_file(file.filename):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid file type. Only {', '.join(settings.ALLOWED_EXTENSIONS)} allowed"
+            )
+        
+        filename = secure_filename(file.filename)
+        unique_filename = f"{uuid.uuid4().hex}_{filename}"
+        
+        contents = await file.read()
+        image_path = uploads.save(unique_filename, contents)
+        
+        temp_file = image_path
+        
+        from app.core.ml.preprocessing import validate_image
+        if not validate_image(str(image_path)):
+            raise HTTPException(status_code=400, detail="Invalid image file")
+        
+        from app.core.ml.tiling import predict_tiles as score_tiles
+        
+        print(f"🔍 Starting tiled prediction for: {image_path}")
+        try:
+            # Hundreds of tiles: score them off the event loop
+            result = await run_in_threadpool(score_tiles, str(image_path), overlap=overlap)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        response = build_tiled_response(result, unique_filename, content_hash(contents))
+        print(f"✅ Tiled prediction successful: {response.top_prediction.class_} ({response.grid[0]}x{response.grid[1]} tiles)")
+        
+        await load_session(request)
+        if "history" not in request.session:
+            request.session["history"] = []
+        
+        request.session["history"].insert(0, {
+            "timestamp": response.timestamp,
+            "disease": response.top_prediction.class_,
+            "confidence": response.top_prediction.confidence,
+            "image_url": response.image_url
+        })
+        request.session["history"] = request.session["history"][:10]
+        
+        return prediction_response(response)
+        
+    except HTTPException:
+        if temp_file:
+            uploads.delete(temp_file.name)
+        raise
+    
+    except Exception as e:
+        if temp_file:
+            uploads.delete(temp_file.name)
+        
+        import traceback
+        print(f"❌ Tiled prediction error: {str(e)}")
+        print(traceback.format_exc())
+        
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+
 @router.post("/predict/webcam", response_model=PredictionResponse, responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
-async def predict_webcam(request: Request, data: WebcamPredictRequest):
+async def predict_webcam(
+    request: Request,
+    data: WebcamPredictRequest,
+    tta: int = Query(0, ge=0, le=settings.TTA_MAX_VIEWS, description="Test-time augmentation views (0 = off)"),
+    explain: bool = Query(False, description="Include the rules masks as a highlight overlay"),
+    crop: Optional[str] = Query(None, max_length=64, description="Crop type, selects calibrated priors"),
+    region: Optional[str] = Query(None, max_length=64, description="Growing region, selects calibrated priors"),
+    priority: str = Query("normal", pattern="^(high|normal|low)$", description="Low priority may be served by the distilled student model")
+):
     """
     Handle webcam base64 image prediction
     
     - **image**: Base64 encoded image data (with or without data URL prefix)
+    - **tta**: Optional number of augmented views for hard cases, scored as one batch
+    - **explain**: Return the color/spot masks used by the rules for highlighting
+    - **crop** / **region**: Optional context for calibrated confidence
+    - **priority**: high/normal/low; low-priority requests may use the cheaper student model
     """
     temp_file = None
     
@@ -153,9 +333,14 @@ async def predict_webcam(request: Request, data: WebcamPredictRequest):
         # Decode base64
         image_data = data.image
         
-        # Remove data URL prefix if present
+        # Remove data URL prefix if present (the browser may send WebP)
+        extension = "jpg"
         if 'base64,' in image_data:
-            image_data = image_data.split('base64,')[1]
+            header, image_data = image_data.split('base64,', 1)
+            if header.startswith('data:image/webp'):
+                extension = "webp"
+            elif header.startswith('data:image/png'):
+                extension = "png"
         
         # Decode
         try:
@@ -164,11 +349,8 @@ async def predict_webcam(request: Request, data: WebcamPredictRequest):
             raise HTTPException(status_code=400, detail=f"Invalid base64 data: {str(e)}")
         
         # Save to file
-        unique_filename = f"{uuid.uuid4().hex}_webcam.jpg"
-        image_path = settings.UPLOAD_FOLDER / unique_filename
-        
-        with open(image_path, 'wb') as f:
-            f.write(image_bytes)
+        unique_filename = f"{uuid.uuid4().hex}_webcam.{extension}"
+        image_path = uploads.save(unique_filename, image_bytes)
         
         temp_file = image_path
         
@@ -177,14 +359,26 @@ async def predict_webcam(request: Request, data: WebcamPredictRequest):
         if not validate_image(str(image_path)):
             raise HTTPException(status_code=400, detail="Invalid image file")
         
+        # Feedback for this prediction refers to it by content hash
+        image_hash = content_hash(image_bytes)
+        
         # Get predictions
-        from app.core.ml.model_handler import get_predictions
-        from app.core.data.treatment_data import get_treatment_info
+        from app.core.ml.model_handler import get_predictions_async
         
         try:
             print(f"🔍 Starting webcam prediction for: {image_path}")
-            predictions = get_predictions(str(image_path), top_k=3)
-            print(f"✅ Prediction successful: {predictions[0]['disease']}")
+            explanation = None
+            if explain:
+                predictions, explanation = await get_predictions_async(
+                    str(image_path), top_k=3, tta_views=tta, explain=True, crop=crop, region=region,
+                    priority=priority, image_hash=image_hash
+                )
+            else:
+                predictions = await get_predictions_async(
+                    str(image_path), top_k=3, tta_views=tta, crop=crop, region=region, priority=priority,
+                    image_hash=image_hash
+                )
+            print(f"✅ Prediction successful: {predictions[0]['class']}")
         except Exception as pred_error:
             import traceback
             error_details = traceback.format_exc()
@@ -195,21 +389,11 @@ async def predict_webcam(request: Request, data: WebcamPredictRequest):
                 detail=f"Prediction failed: {str(pred_error)}"
             )
         
-        # Get treatment info for top prediction
-        top_class = predictions[0]['class']
-        treatment = get_treatment_info(top_class)
-        
-        # Build response
-        result = PredictionResponse(
-            success=True,
-            timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            top_prediction=PredictionItem(**predictions[0]),
-            all_predictions=[PredictionItem(**p) for p in predictions],
-            treatment=TreatmentInfo(**treatment),
-            image_url=f"/static/uploads/{unique_filename}"
-        )
+        # Build response (with treatment info for the top prediction)
+        result = build_prediction_response(predictions, unique_filename, explanation, image_hash)
         
         # Add to session history
+        await load_session(request)
         if "history" not in request.session:
             request.session["history"] = []
         
@@ -223,17 +407,17 @@ async def predict_webcam(request: Request, data: WebcamPredictRequest):
         request.session["history"].insert(0, history_entry)
         request.session["history"] = request.session["history"][:10]  # Keep last 10
         
-        return result
+        return prediction_response(result)
         
     except HTTPException:
         # Clean up temp file on error
-        if temp_file and temp_file.exists():
-            temp_file.unlink()
+        if temp_file:
+            uploads.delete(temp_file.name)
         raise
     
     except Exception as e:
         # Clean up temp file on error
-        if temp_file and temp_file.exists():
-            temp_file.unlink()
+        if temp_file:
+            uploads.delete(temp_file.name)
         
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
@@ -0,0 +1,67 @@
+"""
+Similar past cases lookup for agronomists
+"""
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from io import BytesIO
+
+from app.config import settings
+from app.api.models.similar import SimilarCasesResponse, SimilarCase
+from app.api.models.prediction import ErrorResponse
+
+router = APIRouter()
+
+
+@router.post("/similar", response_model=SimilarCasesResponse, responses={400: {"model": ErrorResponse}, 409: {"model": ErrorResponse}})
+async def similar_cases(file: UploadFile = File(...), k: int = Query(5, ge=1, le=50)):
+    """
+    Find the most similar previously scored images
+
+    - **file**: Image file (PNG, JPG, JPEG)
+    - **k**: Number of cases to return
+    """
+    from app.core.ml import embedding_index
+    from app.core.ml.model_handler import get_active_version, CLASS_INDICES, DISEASE_KEYS
+    from app.core.ml.preprocessing import preprocess_image
+
+    if not embedding_index.is_enabled():
+        raise HTTPException(status_code=409, detail="Embedding index is disabled")
+
+    def search(contents):
+        """Decode, embed and search (blocking: runs in the thread pool)"""
+        try:
+            img_array = preprocess_image(BytesIO(contents), target_size=settings.IMG_SIZE, crop_leaf=settings.ROI_CROP_ENABLED)
+        except Exception:
+            return None, None
+
+        descriptor = embedding_index.image_descriptor(img_array)
+        version = get_active_version()
+        embedding = None
+        if version.model is not None:
+            embeddings, _ = version.predict_features(img_array)
+            if embeddings is not None:
+                embedding = embeddings[0]
+
+        results = embedding_index.similar_cases(
+            descriptor, embedding, version.name if embedding is not None else None, k=k)
+        return results, embedding is not None
+
+    results, deep = await run_in_threadpool(search, await file.read())
+    if results is None:
+        raise HTTPException(status_code=400, detail="Invalid image file")
+
+    cases = []
+    for result in results:
+        best = int(result["scores"].argmax())
+        class_key = DISEASE_KEYS[best]
+        ref = result["ref"] or {}
+        cases.append(SimilarCase(
+            image_url=f"/static/uploads/{ref['image']}" if ref.get("image") else None,
+            similarity=result["similarity"],
+            class_=CLASS_INDICES.get(class_key, class_key),
+            class_index=class_key,
+            confidence=min(100.0, float(result["scores"][best] * 100)),
+            model_version=ref.get("version")
+        ))
+
+    return SimilarCasesResponse(index="deep" if deep else "thumb", cases=cases)
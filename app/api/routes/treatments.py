@@ -0,0 +1,31 @@
+"""
+Treatment database for offline use by the PWA
+"""
+from fastapi import APIRouter, Request
+
+from app.api.models.treatments import TreatmentsResponse
+from app.api.responses import dumps, treatment_info
+from app.core.assets import cached_document
+
+router = APIRouter()
+
+
+def build_treatments():
+    """Encoded TreatmentsResponse with the labels and treatments the API would return per class"""
+    from app.core.ml.model_handler import CLASS_INDICES, DISEASE_KEYS
+    classes = []
+    for key in DISEASE_KEYS:
+        label = CLASS_INDICES.get(key, key)
+        classes.append({"key": key, "label": label, "treatment": treatment_info(label).model_dump()})
+    return dumps({"classes": classes})
+
+
+@router.get("/treatments", response_model=TreatmentsResponse)
+async def get_treatments(request: Request):
+    """
+    Label and treatment for every class, in the score order of the rules
+    
+    Cached by the service worker so on-device predictions can show
+    treatment advice offline. Revalidated with its ETag.
+    """
+    return cached_document("treatments", build_treatments).response(request.scope)
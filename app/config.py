@@ -27,13 +27,26 @@ class Settings(BaseSettings):
     HOST: str = "0.0.0.0"
     PORT: int = int(os.getenv("PORT", "8000"))  # Render uses PORT env var
     
+    # Production server (gunicorn.conf.py, python run.py --prod)
+    WEB_WORKERS: int = 0  # worker processes, 0 = one per CPU
+    WEB_PRELOAD: bool = True  # import the app once in the master, shared copy-on-write by workers
+    WEB_PRELOAD_MODEL: bool = False  # also load the active model in the master (NumPy/rules backends only)
+    WEB_TIMEOUT: int = 120  # seconds before a silent worker is restarted
+    WEB_MAX_REQUESTS: int = 0  # recycle a worker after this many requests (0 = never)
+    WEB_FORWARDED_ALLOW_IPS: str = "127.0.0.1"  # proxies trusted for X-Forwarded-For (comma-separated IPs/CIDRs)
+    
+    @property
+    def WEB_WORKER_COUNT(self) -> int:
+        """Number of worker processes to start"""
+        return self.WEB_WORKERS if self.WEB_WORKERS > 0 else (os.cpu_count() or 1)
+    
     # File upload settings - hardcoded, not from env
     MAX_FILE_SIZE: int = 16 * 1024 * 1024  # 16MB
     
     @property
     def ALLOWED_EXTENSIONS(self):
         """Get allowed extensions as set"""
-        return {"png", "jpg", "jpeg"}
+        return {"png", "jpg", "jpeg", "webp"}
     
     @property
     def CORS_ORIGINS(self):
@@ -42,9 +55,10 @@ class Settings(BaseSettings):
     
     # Paths
     BASE_DIR: Path = Path(__file__).parent.parent
-    UPLOAD_FOLDER: Path = BASE_DIR / "static" / "uploads"
+    UPLOAD_FOLDER: Path = BASE_DIR / "static" / "uploads"  # served as /static/uploads
     MODEL_PATH: Path = BASE_DIR / "models" / "disease_model.h5"
     CLASS_INDICES_PATH: Path = BASE_DIR / "models" / "class_indices.json"
+    MODEL_MANIFEST_PATH: Path = BASE_DIR / "models" / "manifest.json"
     STATIC_DIR: Path = BASE_DIR / "static"
     TEMPLATES_DIR: Path = BASE_DIR / "templates"
     
@@ -57,8 +71,144 @@ class Settings(BaseSettings):
         """Return image size as tuple"""
         return (self.IMG_HEIGHT, self.IMG_WIDTH)
     
+    # Browser-side downscaling before upload (advertised by /api/config)
+    CLIENT_RESIZE_SCALE: float = 2.0  # longest side sent = scale x model input (headroom for ROI crop)
+    CLIENT_IMAGE_QUALITY: float = 0.85  # JPEG/WebP encoder quality 0-1
+    
+    @property
+    def CLIENT_MAX_SIDE(self) -> int:
+        """Longest image side the browser uploads"""
+        return round(max(self.IMG_SIZE) * self.CLIENT_RESIZE_SCALE)
+    
+    # Uploaded images (local folder, or also published to Redis for other nodes)
+    UPLOAD_BACKEND: str = "local"  # "local" or "redis" (needs REDIS_URL)
+    UPLOAD_TTL: int = 86400  # seconds an upload stays fetchable from Redis
+    
     # Session settings
     SESSION_MAX_AGE: int = 86400  # 24 hours in seconds
+    SESSION_BACKEND: str = "memory"  # memory, sqlite or redis (server-side), cookie (signed cookie)
+    SESSION_DB_PATH: Path = BASE_DIR / "data" / "sessions.sqlite3"
+    SESSION_MAX_ENTRIES: int = 10000  # memory backend LRU size
+    
+    # Out-of-process inference server (shared memory ring buffer)
+    INFERENCE_SERVER_ENABLED: bool = False
+    INFERENCE_SHM_NAME: str = "plant_disease_inference"
+    INFERENCE_SLOTS: int = 32
+    INFERENCE_MAX_BATCH: int = 16
+    INFERENCE_BATCH_WAIT_MS: float = 2.0
+    INFERENCE_TIMEOUT: float = 10.0
+    
+    # Model registry
+    MODEL_MANIFEST_POLL_INTERVAL: float = 2.0  # seconds between manifest checks
+    ADMIN_TOKEN: Optional[str] = None  # required in X-Admin-Token for admin routes (disabled while unset)
+    STUDENT_PRIORITIES: str = "low"  # request priorities served by the distilled student version
+    
+    @property
+    def STUDENT_PRIORITY_LEVELS(self) -> tuple:
+        """Return student priorities as a tuple"""
+        return tuple(p.strip() for p in self.STUDENT_PRIORITIES.split(",") if p.strip())
+    
+    # Startup warm-up (graph tracing + synthetic batches)
+    WARMUP_ENABLED: bool = True
+    WARMUP_BATCHES: str = "1,4,16"  # comma-separated batch sizes to trace and run
+    
+    @property
+    def WARMUP_BATCH_SIZES(self) -> tuple:
+        """Return warm-up batch sizes as a sorted tuple"""
+        sizes = {int(x) for x in self.WARMUP_BATCHES.split(",") if x.strip()}
+        return tuple(sorted(sizes)) or (1,)
+    
+    # TensorFlow runtime (0 = TensorFlow default)
+    TF_INTRA_OP_THREADS: int = 0
+    TF_INTER_OP_THREADS: int = 0
+    TENSOR_POOL_SIZE: int = 4  # pooled input buffers kept per batch shape
+    
+    # Embedding index (near-duplicate answers and similar past cases)
+    EMBEDDING_INDEX_ENABLED: bool = False
+    EMBEDDING_INDEX_DIR: Path = BASE_DIR / "data" / "index"
+    EMBEDDING_DUPLICATE_SIMILARITY: float = 0.995  # cosine similarity to reuse a neighbour's scores
+    EMBEDDING_IVF_MIN_TRAIN: int = 2048  # exact search below this many vectors
+    EMBEDDING_IVF_NPROBE: int = 8
+    EMBEDDING_FLUSH_EVERY: int = 32
+    
+    # Test-time augmentation (per request via ?tta=<views>)
+    TTA_MAX_VIEWS: int = 10
+    
+    # Confidence-gated cascade (tune with calibrate_cascade.py)
+    CASCADE_ENABLED: bool = False
+    CASCADE_THUMB_SIZE: int = 56  # stage 1 input side, 224 / 4
+    CASCADE_MARGIN: float = 0.15  # top-1 minus top-2 score needed to exit at stage 1
+    
+    # Leaf region-of-interest crop before scoring
+    ROI_CROP_ENABLED: bool = False
+    ROI_THUMB_SIZE: int = 128  # segmentation thumbnail, longest side
+    ROI_EXG_THRESHOLD: float = 0.05  # excess-green index counted as leaf
+    ROI_MIN_FRACTION: float = 0.02  # smaller leaf areas fall back to the full frame
+    ROI_PADDING: float = 0.1  # margin around the leaf box
+    
+    # Tiled inference for canopy / drone images (/api/predict/tiles)
+    TILE_OVERLAP: float = 0.25  # fraction of a tile shared with its neighbour
+    TILE_MAX_SIDE: int = 2048  # images are reduced to this longest side before tiling
+    TILE_MAX_PIXELS: int = 40_000_000  # images that would decode to more pixels are rejected (400); MEMORY_LIMIT_MB lowers it
+    TILE_BATCH_SIZE: int = 16  # tiles per scoring call, keep in WARMUP_BATCHES
+    
+    # Score calibration per crop/region (fit with fit_calibration.py; no file = off)
+    CALIBRATION_ENABLED: bool = True
+    CALIBRATION_PATH: Path = BASE_DIR / "models" / "calibration.npz"
+    
+    # Active-learning feedback log (POST /api/feedback, uncertainty sampling)
+    FEEDBACK_ENABLED: bool = True
+    FEEDBACK_DIR: Path = BASE_DIR / "data" / "feedback"
+    FEEDBACK_LOG_CONFIDENCE: float = 0.8  # log predictions whose top-1 probability is below this (1.0 = all)
+    FEEDBACK_FLUSH_ROWS: int = 256  # rows buffered before the writer is woken
+    FEEDBACK_FLUSH_INTERVAL: float = 5.0  # seconds between background flushes
+    FEEDBACK_MAX_PENDING: int = 10000  # buffered rows beyond this are dropped, never blocking
+    
+    # Async prediction jobs (/api/jobs)
+    JOBS_ENABLED: bool = True
+    JOB_BACKEND: str = "sqlite"  # "sqlite" or "redis" (needs REDIS_URL and the redis package)
+    JOB_DB_PATH: Path = BASE_DIR / "data" / "jobs.sqlite3"
+    JOB_WORKERS: int = 2  # worker threads per process
+    JOB_POLL_INTERVAL: float = 1.0  # seconds between queue checks when idle
+    JOB_MAX_FILES: int = 50  # images per job
+    JOB_CLIENT_CONCURRENCY: int = 1  # running jobs per client
+    JOB_CLIENT_MAX_QUEUED: int = 20  # unfinished jobs per client before 429
+    JOB_STALE_SECONDS: float = 300.0  # running jobs without progress for this long are requeued
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RESULT_TTL: int = 86400  # finished jobs are deleted after this many seconds
+    
+    # Memory budget mode (0 = off): caps workers, batches and caches to fit, and keeps
+    # scoring on the NumPy rules when the Keras backend would not fit (see app/core/memory.py)
+    MEMORY_LIMIT_MB: int = 0  # instance memory, e.g. 512 on Render's free plan
+    MEMORY_HEADROOM: float = 0.15  # fraction kept free for Pillow decode buffers and fragmentation
+    MEMORY_KERAS_IMPORT_MB: int = 550  # RSS of importing TensorFlow/Keras (python -m app.core.memory)
+    
+    # Compress API responses at least this large (bytes)
+    GZIP_MIN_SIZE: int = 1000
+    
+    # Share one computation between concurrent requests for the same image
+    SINGLE_FLIGHT_ENABLED: bool = True
+    
+    # Admission control for upload/inference routes (429 rate limit, 503 overload)
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_RATE: float = 2.0  # requests/s per session or API key
+    ADMISSION_BURST: int = 10
+    ADMISSION_IP_RATE: float = 10.0  # requests/s per IP (shared by clients behind one NAT)
+    ADMISSION_IP_BURST: int = 30
+    ADMISSION_LATENCY_TARGET_MS: float = 2000.0  # inference latency the concurrency limit adapts to
+    ADMISSION_INITIAL_CONCURRENCY: int = 4
+    ADMISSION_MIN_CONCURRENCY: int = 1
+    ADMISSION_MAX_CONCURRENCY: int = 32
+    ADMISSION_MAX_CLIENTS: int = 10000  # token buckets kept in memory
+    API_KEYS: str = ""  # comma-separated X-API-Key values that identify a client (others count as their IP)
+    
+    @property
+    def API_KEY_LIST(self) -> tuple:
+        """Return accepted API keys as a tuple"""
+        return tuple(k.strip() for k in self.API_KEYS.split(",") if k.strip())
+    
+    # Redis (optional job, session and upload backend)
+    REDIS_URL: Optional[str] = None
         
     def get_env_info(self) -> dict:
         """Get current environment info for debugging"""
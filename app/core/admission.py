@@ -0,0 +1,195 @@
+"""
+Admission control - per-client token buckets and an adaptive concurrency limit
+
+``AdmissionMiddleware`` is a pure ASGI middleware, so it decides from the
+request line and headers alone: a rejected request is answered before its
+body (the image) is read, let alone decoded.
+
+- Rate limits: every session or API key (from ``API_KEYS``) has a token
+  bucket (``ADMISSION_RATE`` requests/s, ``ADMISSION_BURST`` burst), and
+  requests without a known API key also draw from a per-IP bucket with a
+  higher rate.
+  An empty bucket answers 429 with ``Retry-After``.
+- Concurrency: inference routes share an AIMD limit on requests in flight.
+  Each completion within ``ADMISSION_LATENCY_TARGET_MS`` grows the limit by
+  1/limit (about +1 per round of requests); a slower one multiplies it by
+  ``BACKOFF`` (at most once per target interval). Over the limit answers 503.
+"""
+
+import json
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app.config import settings
+from app.core import metrics
+from app.core.sessions import LazySession
+from app.utils.clients import client_id
+
+# POST routes that cost an upload and/or inference
+RATE_LIMITED_PREFIXES = ("/api/predict", "/api/jobs", "/api/similar", "/api/feedback")
+INFERENCE_PREFIXES = ("/api/predict", "/api/similar")
+BACKOFF = 0.9
+
+
+class TokenBuckets:
+    """Token buckets keyed by client, least recently used ones evicted"""
+
+    def __init__(self, max_clients):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, keys, now=None):
+        """
+        Take one token from every ``(key, rate, burst)`` bucket, or from none
+
+        Returns:
+            float: 0 when admitted, else seconds until all buckets have a token
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            levels = []
+            for key, rate, burst in keys:
+                tokens, last = self._buckets.get(key, (burst, now))
+                levels.append(min(burst, tokens + (now - last) * rate))
+            wait = max((1.0 - level) / rate for level, (_, rate, _) in zip(levels, keys))
+            admitted = wait <= 0
+            for level, (key, _, _) in zip(levels, keys):
+                self._buckets[key] = (level - 1.0 if admitted else level, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return 0.0 if admitted else wait
+
+
+class AIMDLimiter:
+    """Concurrency limit adapted to observed latency"""
+
+    def __init__(self, initial, minimum, maximum, target_seconds):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target_seconds
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            utilized = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if latency > self.target:
+                if now - self._last_decrease >= self.target:
+                    self.limit = max(self.minimum, self.limit * BACKOFF)
+                    self._last_decrease = now
+            elif utilized:
+                # Grow only when the limit was actually reached
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def status(self):
+        with self._lock:
+            return {"limit": round(self.limit, 2), "in_flight": self.in_flight}
+
+
+_buckets = None
+_limiter = None
+
+
+def get_buckets():
+    global _buckets
+    if _buckets is None:
+        _buckets = TokenBuckets(settings.ADMISSION_MAX_CLIENTS)
+    return _buckets
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        _limiter = AIMDLimiter(settings.ADMISSION_INITIAL_CONCURRENCY, settings.ADMISSION_MIN_CONCURRENCY,
+                               settings.ADMISSION_MAX_CONCURRENCY, settings.ADMISSION_LATENCY_TARGET_MS / 1000)
+    return _limiter
+
+
+def status():
+    """Current concurrency limit and requests in flight"""
+    return get_limiter().status()
+
+
+def bucket_keys(scope):
+    """Buckets a request draws from: known API key, or IP plus the session when it has one"""
+    identity = client_id(scope)
+    if identity.startswith("key:"):
+        return [(identity, settings.ADMISSION_RATE, settings.ADMISSION_BURST)]
+
+    keys = [(identity, settings.ADMISSION_IP_RATE, settings.ADMISSION_IP_BURST)]
+    session = scope.get("session")
+    if isinstance(session, LazySession):
+        # Server-side sessions: the cookie ID, without loading the session
+        if session.id:
+            keys.append((f"session:{session.id}", settings.ADMISSION_RATE, settings.ADMISSION_BURST))
+    elif session is not None:
+        sid = session.get("sid")
+        if sid:
+            keys.append((f"session:{sid}", settings.ADMISSION_RATE, settings.ADMISSION_BURST))
+        else:
+            # Identifies the session from its next request on
+            session["sid"] = uuid.uuid4().hex
+    return keys
+
+
+async def reject(send, status_code, message, retry_after):
+    body = json.dumps({"error": message}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode())
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """Shed load on upload/inference routes before reading the request body"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not settings.ADMISSION_ENABLED or scope["method"] != "POST"
+                or not scope["path"].startswith(RATE_LIMITED_PREFIXES)):
+            return await self.app(scope, receive, send)
+
+        wait = get_buckets().take(bucket_keys(scope))
+        if wait > 0:
+            metrics.inc("admission.rejected.rate")
+            return await reject(send, 429, "Too many requests, slow down", wait)
+
+        if not scope["path"].startswith(INFERENCE_PREFIXES):
+            metrics.inc("admission.admitted")
+            return await self.app(scope, receive, send)
+
+        limiter = get_limiter()
+        if not limiter.acquire():
+            metrics.inc("admission.rejected.concurrency")
+            return await reject(send, 503, "Server busy, try again shortly", 1)
+
+        metrics.inc("admission.admitted")
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.perf_counter() - start)
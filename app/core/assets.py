@@ -0,0 +1,184 @@
+"""
+Static asset serving - fingerprinted URLs, pre-compressed variants and a cached homepage
+
+``build_assets.py`` copies static files to ``static/dist`` under content-hashed
+names (``css/style.3f9a0c1e2b.css``) with ``.br``/``.gz`` variants and a
+``manifest.json``. Templates link assets through ``asset(path)``, which falls
+back to the plain ``/static`` URL when the build has not been run.
+
+``PrecompressedStaticFiles`` serves the smallest variant the client accepts.
+Fingerprinted files and uploads (unique names) are cached as immutable, and
+everything else is revalidated with its ETag. ``UploadFiles`` serves
+``UPLOAD_FOLDER`` and pulls uploads made on another node from the shared
+upload store.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+from fastapi.staticfiles import StaticFiles
+
+from app.config import settings
+
+DIST_DIR = "dist"
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# Content-Encoding per variant suffix, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# API documents served as ``CachedPage`` (already compressed)
+PRECOMPRESSED_API_PATHS = {"/api/treatments"}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+@lru_cache(maxsize=1)
+def load_manifest():
+    """``{source path: fingerprinted path}`` from the last build, empty without one"""
+    path = settings.STATIC_DIR / DIST_DIR / "manifest.json"
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def asset(path):
+    """URL for a static file, fingerprinted when the asset build has run"""
+    hashed = load_manifest().get(path)
+    return f"/static/{DIST_DIR}/{hashed}" if hashed else f"/static/{path}"
+
+
+def accepted_encodings(scope):
+    for name, value in scope.get("headers") or ():
+        if name == b"accept-encoding":
+            return {part.split(";")[0].strip() for part in value.decode("latin-1").split(",")}
+    return set()
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that prefers ``.br``/``.gz`` siblings and sets Cache-Control"""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        full_path = str(full_path)
+        relative = os.path.relpath(full_path, os.path.realpath(self.directory))
+        immutable = relative.startswith((DIST_DIR + os.sep, "uploads" + os.sep))
+
+        encoding = None
+        has_variants = False
+        if immutable:
+            accepted = accepted_encodings(scope)
+            for name, suffix in ENCODINGS:
+                if os.path.exists(full_path + suffix):
+                    has_variants = True
+                    if name in accepted:
+                        encoding = name
+                        full_path += suffix
+                        stat_result = os.stat(full_path)
+                        break
+
+        # The variant keeps the original media type: mimetypes maps "x.css.br" to text/css
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = IMMUTABLE if immutable else REVALIDATE
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if has_variants:
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+class UploadFiles(StaticFiles):
+    """Uploaded images (``/static/uploads``), immutable under their unique names"""
+
+    async def get_response(self, path, scope):
+        from app.core import uploads
+        if uploads.is_shared():
+            await run_in_threadpool(uploads.local_path, path)
+        response = await super().get_response(path, scope)
+        if response.status_code == 200:
+            response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+
+def compress(data):
+    """Pre-compressed variants of ``data``: {Content-Encoding: bytes}"""
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return variants
+
+
+class CachedPage:
+    """A page or document rendered once, with its ETag and compressed variants"""
+
+    def __init__(self, body, media_type="text/html"):
+        self.body = body
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:20] + '"'
+        self.variants = compress(body)
+
+    def response(self, scope, status_code=200):
+        headers = {"ETag": self.etag, "Cache-Control": REVALIDATE, "Vary": "Accept-Encoding"}
+        for name, value in scope.get("headers") or ():
+            if name == b"if-none-match" and self.etag in value.decode("latin-1"):
+                return Response(status_code=304, headers=headers)
+
+        accepted = accepted_encodings(scope)
+        for name, _ in ENCODINGS:
+            if name in accepted and name in self.variants:
+                headers["Content-Encoding"] = name
+                return Response(self.variants[name], status_code, headers, media_type=self.media_type)
+        return Response(self.body, status_code, headers, media_type=self.media_type)
+
+
+_pages = {}
+
+
+def cached_page(templates, name, media_type="text/html", **context):
+    """Render a template once per process; ``context`` must not vary between requests"""
+    page = _pages.get(name)
+    if page is None:
+        body = templates.env.get_template(name).render(asset=asset, **context).encode("utf-8")
+        page = _pages[name] = CachedPage(body, media_type)
+    return page
+
+
+def cached_document(name, build, media_type="application/json"):
+    """Cache ``build()`` bytes once per process, like ``cached_page``"""
+    page = _pages.get(name)
+    if page is None:
+        page = _pages[name] = CachedPage(build(), media_type)
+    return page
+
+
+def content_version(paths):
+    """Short hash over static files' contents, changes whenever one of them does"""
+    digest = hashlib.sha256()
+    for path in paths:
+        full_path = settings.STATIC_DIR / path
+        if full_path.exists():
+            digest.update(full_path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+class APIGZipMiddleware:
+    """gzip for dynamic /api responses; static files and pages come pre-compressed"""
+
+    def __init__(self, app, minimum_size=1000):
+        from starlette.middleware.gzip import GZipMiddleware
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        # Server-sent events must reach the client unbuffered
+        path = scope.get("path", "")
+        if (scope["type"] == "http" and path.startswith("/api/") and not path.endswith("/events")
+                and path not in PRECOMPRESSED_API_PATHS):
+            return await self.gzip(scope, receive, send)
+        await self.app(scope, receive, send)
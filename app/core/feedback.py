@@ -0,0 +1,272 @@
+"""
+Active-learning feedback log - predictions, farmer corrections and an uncertainty sampler
+
+Two append-only columnar logs live in ``FEEDBACK_DIR``:
+
+- ``predictions``: image hash, stored upload name, full score vector, serving
+  version and crop/region for predictions below ``FEEDBACK_LOG_CONFIDENCE``
+- ``corrections``: the label a farmer says is right for an image hash
+
+Recording only appends a row to an in-memory buffer; a background thread
+flushes the buffer as one part file per batch (Parquet when pyarrow is
+installed, otherwise ``.npz``), so request handling never waits for disk.
+When the buffer is full new rows are dropped and counted rather than
+blocking. ``uncertain_samples`` ranks the logged, not yet corrected images
+by how unsure the model was, for labeling.
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.config import settings
+from app.core import metrics
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+STRATEGIES = ("margin", "entropy", "least_confidence")
+
+
+class FeedbackLog:
+    """Buffered append-only columnar log with a background writer"""
+
+    def __init__(self, directory, kind, flush_rows, flush_interval, max_pending):
+        self.directory = Path(directory)
+        self.kind = kind
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._rows = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._writer = None
+        self._sequence = 0
+
+    def append(self, row):
+        """Queue one row (a dict of scalars/arrays); never blocks on I/O"""
+        with self._lock:
+            if len(self._rows) >= self.max_pending:
+                metrics.inc(f"feedback.{self.kind}.dropped")
+                return False
+            self._rows.append(row)
+            pending = len(self._rows)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name=f"feedback-{self.kind}", daemon=True)
+                self._writer.start()
+        if pending >= self.flush_rows:
+            self._wake.set()
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Feedback log '{self.kind}' flush failed: {e}")
+
+    def flush(self):
+        """Write buffered rows as one new part file"""
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return None
+
+        columns = {name: np.asarray([row[name] for row in rows]) for name in rows[0]}
+        with self._write_lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._sequence += 1
+            # The pid keeps part names unique when several workers share the directory
+            stem = f"{self.kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._sequence:05d}"
+            if HAS_ARROW:
+                path = self.directory / f"{stem}.parquet"
+                pq.write_table(to_arrow(columns), path)
+            else:
+                path = self.directory / f"{stem}.npz"
+                np.savez(path, **columns)
+        metrics.inc(f"feedback.{self.kind}.rows", len(rows))
+        return path
+
+    def read(self):
+        """
+        All flushed rows
+
+        Returns:
+            dict: Column name -> array (2-D for vector columns), empty when nothing was written
+        """
+        parts = []
+        for path in sorted(self.directory.glob(f"{self.kind}-*")):
+            if path.suffix == ".parquet" and HAS_ARROW:
+                parts.append(from_arrow(pq.read_table(path)))
+            elif path.suffix == ".npz":
+                with np.load(path) as data:
+                    parts.append({name: data[name] for name in data.files})
+        if not parts:
+            return {}
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def to_arrow(columns):
+    """Arrow table from NumPy columns, vector columns as fixed-size lists"""
+    arrays = {}
+    for name, values in columns.items():
+        if values.ndim == 2:
+            arrays[name] = pa.FixedSizeListArray.from_arrays(pa.array(values.ravel()), values.shape[1])
+        else:
+            arrays[name] = pa.array(values.tolist() if values.dtype.kind == "U" else values)
+    return pa.table(arrays)
+
+
+def from_arrow(table):
+    columns = {}
+    for name in table.column_names:
+        column = table.column(name).combine_chunks()
+        if pa.types.is_fixed_size_list(column.type):
+            columns[name] = column.flatten().to_numpy().reshape(len(column), column.type.list_size)
+        elif pa.types.is_string(column.type):
+            columns[name] = np.asarray(column.to_pylist(), dtype=str)
+        else:
+            columns[name] = column.to_numpy()
+    return columns
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def get_log(kind):
+    with _logs_lock:
+        log = _logs.get(kind)
+        if log is None:
+            log = FeedbackLog(settings.FEEDBACK_DIR, kind, settings.FEEDBACK_FLUSH_ROWS,
+                              settings.FEEDBACK_FLUSH_INTERVAL, settings.FEEDBACK_MAX_PENDING)
+            _logs[kind] = log
+    return log
+
+
+def flush_all():
+    """Write every buffered row (called on shutdown)"""
+    for log in list(_logs.values()):
+        log.flush()
+
+
+def is_enabled():
+    return settings.FEEDBACK_ENABLED
+
+
+def record_prediction(image_hash, scores, version, image=None, crop=None, region=None):
+    """
+    Log a prediction's full score vector when its top-1 confidence is low enough
+
+    Args:
+        image_hash: SHA-256 of the uploaded bytes
+        scores: (NUM_CLASSES,) probabilities in DISEASE_KEYS order
+        version: Serving model version
+        image: Stored upload file name, for fetching the image to label
+        crop, region: Request context
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    confidence = float(scores.max())
+    if confidence >= settings.FEEDBACK_LOG_CONFIDENCE:
+        return False
+    return get_log("predictions").append({
+        "timestamp": time.time(),
+        "image_hash": image_hash,
+        "image": image or "",
+        "version": version or "",
+        "crop": crop or "",
+        "region": region or "",
+        "confidence": confidence,
+        "scores": scores
+    })
+
+
+def record_correction(image_hash, label, comment=None, crop=None, region=None):
+    """Log a farmer's correction (``label`` is a class key)"""
+    return get_log("corrections").append({
+        "timestamp": time.time(),
+        "image_hash": image_hash,
+        "label": label,
+        "comment": comment or "",
+        "crop": crop or "",
+        "region": region or ""
+    })
+
+
+def uncertainty(scores, strategy="margin"):
+    """
+    Uncertainty of each score row, higher is less certain
+
+    - ``margin``: 1 - (top-1 - top-2)
+    - ``entropy``: entropy normalized to [0, 1]
+    - ``least_confidence``: 1 - top-1
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if strategy == "margin":
+        top2 = np.partition(scores, -2, axis=1)[:, -2:]
+        return 1.0 - (top2[:, 1] - top2[:, 0])
+    if strategy == "entropy":
+        p = np.clip(scores, 1e-12, 1.0)
+        return -(p * np.log(p)).sum(axis=1) / np.log(scores.shape[1])
+    if strategy == "least_confidence":
+        return 1.0 - scores.max(axis=1)
+    raise ValueError(f"Unknown strategy '{strategy}', expected one of {', '.join(STRATEGIES)}")
+
+
+def uncertain_samples(k=20, strategy="margin", version=None):
+    """
+    Most uncertain logged images that have no correction yet
+
+    Each image hash counts once (its latest prediction).
+
+    Returns:
+        list: Dicts with image_hash, image, version, class_index, confidence,
+        uncertainty and timestamp, most uncertain first
+    """
+    from app.core.ml.model_handler import DISEASE_KEYS
+
+    predictions = get_log("predictions").read()
+    if not predictions:
+        return []
+    corrections = get_log("corrections").read()
+
+    keep = np.ones(len(predictions["image_hash"]), dtype=bool)
+    if version:
+        keep &= predictions["version"] == version
+    if corrections:
+        keep &= ~np.isin(predictions["image_hash"], corrections["image_hash"])
+
+    # Latest row per image: first occurrence in the reversed order
+    order = np.flatnonzero(keep)[::-1]
+    _, first = np.unique(predictions["image_hash"][order], return_index=True)
+    rows = order[first]
+    if len(rows) == 0:
+        return []
+
+    scores = predictions["scores"][rows]
+    ranked = np.argsort(-uncertainty(scores, strategy), kind="stable")[:k]
+    values = uncertainty(scores[ranked], strategy)
+
+    samples = []
+    for rank, value in zip(ranked, values):
+        row = rows[rank]
+        samples.append({
+            "image_hash": str(predictions["image_hash"][row]),
+            "image": str(predictions["image"][row]),
+            "version": str(predictions["version"][row]),
+            "class_index": DISEASE_KEYS[int(np.argmax(scores[rank]))],
+            "confidence": float(predictions["confidence"][row]),
+            "uncertainty": float(value),
+            "timestamp": float(predictions["timestamp"][row])
+        })
+    return samples
@@ -0,0 +1,472 @@
+"""
+Async job queue - durable queue, local worker pool and crash recovery
+
+Slow work (batches of images, TTA, tiling) is queued instead of holding an
+HTTP connection open. Jobs live in a durable store, SQLite by default or
+Redis with ``JOB_BACKEND=redis``, so every app process can submit and every
+process's worker threads can claim them:
+
+- claiming picks the highest priority, oldest queued job whose client has
+  fewer than ``JOB_CLIENT_CONCURRENCY`` jobs running, atomically
+- progress updates double as heartbeats; running jobs without one for
+  ``JOB_STALE_SECONDS`` (a crashed or killed worker) are requeued, up to
+  ``JOB_MAX_ATTEMPTS`` claims
+- progress, finish and fail carry the claim's ``attempts`` value, so a lost
+  worker reporting late cannot touch a job that was requeued or reclaimed
+- finished jobs are purged after ``JOB_RESULT_TTL``
+
+What a job does is registered per kind with ``register_handler``; handlers
+receive the job and a ``report(done, results)`` callback and return the
+result list.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+from app.config import settings
+from app.core import metrics
+
+PRIORITIES = {"low": 0, "normal": 1, "high": 2}
+FINISHED = ("done", "failed", "cancelled")
+MAINTENANCE_INTERVAL = 30.0
+
+
+def new_job(client, kind, params, total, priority="normal"):
+    """Job record ready for ``submit``"""
+    return {
+        "id": uuid.uuid4().hex,
+        "client": client,
+        "kind": kind,
+        "priority": PRIORITIES.get(priority, PRIORITIES["normal"]),
+        "status": "queued",
+        "params": params,
+        "total": total,
+        "done": 0,
+        "results": [],
+        "error": None,
+        "attempts": 0,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "heartbeat": None
+    }
+
+
+# === SQLite store ===
+
+class SQLiteJobStore:
+    """Jobs in one SQLite table; claims run in ``BEGIN IMMEDIATE`` transactions"""
+
+    COLUMNS = ("id", "client", "kind", "priority", "status", "params", "total", "done", "results",
+               "error", "attempts", "created_at", "started_at", "finished_at", "heartbeat")
+
+    def __init__(self, path):
+        self.path = str(path)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY, client TEXT, kind TEXT, priority INTEGER, status TEXT,
+                    params TEXT, total INTEGER, done INTEGER, results TEXT, error TEXT,
+                    attempts INTEGER, created_at REAL, started_at REAL, finished_at REAL, heartbeat REAL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_client ON jobs (client, status)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _row(self, row):
+        job = dict(zip(self.COLUMNS, row))
+        job["params"] = json.loads(job["params"])
+        job["results"] = json.loads(job["results"])
+        return job
+
+    def submit(self, job):
+        record = dict(job, params=json.dumps(job["params"]), results=json.dumps(job["results"]))
+        with closing(self._connect()) as conn:
+            conn.execute(f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                         [record[c] for c in self.COLUMNS])
+
+    def claim(self, client_limit):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("""
+                    SELECT id FROM jobs WHERE status = 'queued' AND client NOT IN (
+                        SELECT client FROM jobs WHERE status = 'running' GROUP BY client HAVING COUNT(*) >= ?
+                    ) ORDER BY priority DESC, created_at LIMIT 1""", (client_limit,)).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute("""UPDATE jobs SET status = 'running', started_at = ?, heartbeat = ?,
+                                attempts = attempts + 1 WHERE id = ?""", (now, now, row[0]))
+                job = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", row).fetchone()
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self._row(job)
+
+    def progress(self, job_id, attempt, done, results):
+        with closing(self._connect()) as conn:
+            conn.execute("""UPDATE jobs SET done = ?, results = ?, heartbeat = ?
+                            WHERE id = ? AND status = 'running' AND attempts = ?""",
+                         (done, json.dumps(results), time.time(), job_id, attempt))
+
+    def finish(self, job_id, attempt, results):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("""UPDATE jobs SET status = 'done', done = total, results = ?, finished_at = ?, heartbeat = ?
+                            WHERE id = ? AND status = 'running' AND attempts = ?""",
+                         (json.dumps(results), now, now, job_id, attempt))
+
+    def fail(self, job_id, attempt, error):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("""UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, heartbeat = ?
+                            WHERE id = ? AND status = 'running' AND attempts = ?""",
+                         (error, now, now, job_id, attempt))
+
+    def cancel(self, job_id):
+        with closing(self._connect()) as conn:
+            cursor = conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                                  (time.time(), job_id))
+            return cursor.rowcount == 1
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def unfinished(self, client):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE client = ? AND status IN ('queued', 'running')",
+                                (client,)).fetchone()[0]
+
+    def recover(self, stale_seconds, max_attempts):
+        cutoff = time.time() - stale_seconds
+        with closing(self._connect()) as conn:
+            failed = conn.execute("""UPDATE jobs SET status = 'failed', error = 'worker lost too many times',
+                                     finished_at = ? WHERE status = 'running' AND heartbeat < ? AND attempts >= ?""",
+                                  (time.time(), cutoff, max_attempts)).rowcount
+            requeued = conn.execute("""UPDATE jobs SET status = 'queued', started_at = NULL, heartbeat = NULL
+                                       WHERE status = 'running' AND heartbeat < ?""", (cutoff,)).rowcount
+        return requeued, failed
+
+    def purge(self, ttl):
+        with closing(self._connect()) as conn:
+            return conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < ?",
+                                (time.time() - ttl,)).rowcount
+
+
+# === Redis store ===
+
+CLAIM_SCRIPT = """
+local ids = redis.call('ZRANGE', KEYS[1], 0, 199)
+for _, id in ipairs(ids) do
+    local key = ARGV[3] .. id
+    local client = redis.call('HGET', key, 'client')
+    local running = tonumber(redis.call('HGET', KEYS[2], client) or '0')
+    if running < tonumber(ARGV[1]) then
+        redis.call('ZREM', KEYS[1], id)
+        redis.call('HINCRBY', KEYS[2], client, 1)
+        redis.call('SADD', KEYS[3], id)
+        redis.call('HSET', key, 'status', 'running', 'started_at', ARGV[2], 'heartbeat', ARGV[2])
+        redis.call('HINCRBY', key, 'attempts', 1)
+        return id
+    end
+end
+return false
+"""
+
+# Ends a job only if it is still running under the caller's claim: after
+# recover() has requeued it (or another worker reclaimed it), a late
+# finish/fail from the lost worker changes nothing
+END_SCRIPT = """
+if redis.call('HGET', KEYS[3], 'attempts') ~= ARGV[3] then
+    return 0
+end
+if redis.call('SREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+local client = redis.call('HGET', KEYS[3], 'client')
+redis.call('HINCRBY', KEYS[2], client, -1)
+redis.call('HSET', KEYS[3], unpack(ARGV, 4))
+redis.call('ZADD', KEYS[4], ARGV[2], ARGV[1])
+return 1
+"""
+
+PROGRESS_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'status') ~= 'running' or redis.call('HGET', KEYS[1], 'attempts') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+return 1
+"""
+
+
+class RedisJobStore:
+    """
+    Jobs as Redis hashes; a sorted set orders the queue by (priority, age)
+
+    Claiming and ending run as Lua scripts so the running set and the
+    per-client running count change together.
+    """
+
+    def __init__(self, url, prefix="plant_jobs:"):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.queue_key = prefix + "queue"
+        self.running_key = prefix + "running"
+        self.counts_key = prefix + "running_count"
+        self.finished_key = prefix + "finished"
+        self._claim = self.redis.register_script(CLAIM_SCRIPT)
+        self._end_script = self.redis.register_script(END_SCRIPT)
+        self._progress_script = self.redis.register_script(PROGRESS_SCRIPT)
+
+    def _key(self, job_id):
+        return self.prefix + "job:" + job_id
+
+    @staticmethod
+    def _score(job):
+        # Higher priority first, then oldest first
+        return -job["priority"] * 1e10 + job["created_at"]
+
+    def _encode(self, fields):
+        return {k: json.dumps(v) if k in ("params", "results") else ("" if v is None else v)
+                for k, v in fields.items()}
+
+    def _decode(self, data):
+        if not data:
+            return None
+        job = {}
+        for key in SQLiteJobStore.COLUMNS:
+            value = data.get(key, "")
+            if key in ("params", "results"):
+                job[key] = json.loads(value) if value else ([] if key == "results" else {})
+            elif key in ("priority", "total", "done", "attempts"):
+                job[key] = int(value or 0)
+            elif key in ("created_at", "started_at", "finished_at", "heartbeat"):
+                job[key] = float(value) if value else None
+            else:
+                job[key] = value or None
+        return job
+
+    def submit(self, job):
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(job["id"]), mapping=self._encode(job))
+        pipe.zadd(self.queue_key, {job["id"]: self._score(job)})
+        pipe.execute()
+
+    def claim(self, client_limit):
+        job_id = self._claim(keys=[self.queue_key, self.counts_key, self.running_key],
+                             args=[client_limit, time.time(), self.prefix + "job:"])
+        return self.get(job_id) if job_id else None
+
+    def progress(self, job_id, attempt, done, results):
+        mapping = self._encode({"done": done, "results": results, "heartbeat": time.time()})
+        self._progress_script(keys=[self._key(job_id)],
+                              args=[attempt] + [item for pair in mapping.items() for item in pair])
+
+    def _end(self, job_id, attempt, fields):
+        now = time.time()
+        mapping = self._encode(dict(fields, finished_at=now, heartbeat=now))
+        args = [job_id, now, attempt] + [item for pair in mapping.items() for item in pair]
+        self._end_script(keys=[self.running_key, self.counts_key, self._key(job_id), self.finished_key], args=args)
+
+    def finish(self, job_id, attempt, results):
+        total = self.redis.hget(self._key(job_id), "total")
+        self._end(job_id, attempt, {"status": "done", "results": results, "done": int(total or 0)})
+
+    def fail(self, job_id, attempt, error):
+        self._end(job_id, attempt, {"status": "failed", "error": error})
+
+    def cancel(self, job_id):
+        if not self.redis.zrem(self.queue_key, job_id):
+            return False
+        now = time.time()
+        self.redis.hset(self._key(job_id), mapping={"status": "cancelled", "finished_at": now})
+        self.redis.zadd(self.finished_key, {job_id: now})
+        return True
+
+    def get(self, job_id):
+        return self._decode(self.redis.hgetall(self._key(job_id)))
+
+    def unfinished(self, client):
+        ids = self.redis.zrange(self.queue_key, 0, -1) + list(self.redis.smembers(self.running_key))
+        pipe = self.redis.pipeline()
+        for job_id in ids:
+            pipe.hget(self._key(job_id), "client")
+        return sum(1 for owner in pipe.execute() if owner == client)
+
+    def recover(self, stale_seconds, max_attempts):
+        cutoff = time.time() - stale_seconds
+        requeued = failed = 0
+        for job_id in self.redis.smembers(self.running_key):
+            job = self.get(job_id)
+            if job is None or (job["heartbeat"] or 0) >= cutoff:
+                continue
+            if not self.redis.srem(self.running_key, job_id):
+                continue  # another process recovered it
+            self.redis.hincrby(self.counts_key, job["client"], -1)
+            if job["attempts"] >= max_attempts:
+                now = time.time()
+                self.redis.hset(self._key(job_id), mapping={"status": "failed", "finished_at": now,
+                                                            "error": "worker lost too many times"})
+                self.redis.zadd(self.finished_key, {job_id: now})
+                failed += 1
+            else:
+                self.redis.hset(self._key(job_id), mapping={"status": "queued", "started_at": "", "heartbeat": ""})
+                self.redis.zadd(self.queue_key, {job_id: self._score(job)})
+                requeued += 1
+        return requeued, failed
+
+    def purge(self, ttl):
+        ids = self.redis.zrangebyscore(self.finished_key, 0, time.time() - ttl)
+        if ids:
+            self.redis.delete(*[self._key(job_id) for job_id in ids])
+            self.redis.zrem(self.finished_key, *ids)
+        return len(ids)
+
+
+# === Workers ===
+
+_handlers = {}
+_store = None
+_store_lock = threading.Lock()
+
+
+def register_handler(kind, handler):
+    """Register ``handler(job, report) -> results`` for a job kind"""
+    _handlers[kind] = handler
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if settings.JOB_BACKEND == "redis":
+                if not settings.REDIS_URL:
+                    raise RuntimeError("JOB_BACKEND=redis needs REDIS_URL")
+                _store = RedisJobStore(settings.REDIS_URL)
+            else:
+                settings.JOB_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+                _store = SQLiteJobStore(settings.JOB_DB_PATH)
+        return _store
+
+
+class WorkerPool:
+    """Threads that claim and run jobs; also requeue stale jobs periodically"""
+
+    def __init__(self, store, count):
+        self.store = store
+        self.count = count
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_maintenance = 0.0
+        self._maintenance_lock = threading.Lock()
+
+    def start(self):
+        self.maintain(force=True)
+        for i in range(self.count):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"🧵 Job workers started: {self.count} ({settings.JOB_BACKEND})")
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def notify(self):
+        self._wake.set()
+
+    def maintain(self, force=False):
+        """Requeue jobs of lost workers and purge old results, at most every MAINTENANCE_INTERVAL"""
+        with self._maintenance_lock:
+            now = time.time()
+            if not force and now - self._last_maintenance < MAINTENANCE_INTERVAL:
+                return
+            self._last_maintenance = now
+        requeued, failed = self.store.recover(settings.JOB_STALE_SECONDS, settings.JOB_MAX_ATTEMPTS)
+        if requeued or failed:
+            print(f"♻️  Recovered jobs: {requeued} requeued, {failed} failed")
+            metrics.inc("jobs.recovered", requeued)
+        self.store.purge(settings.JOB_RESULT_TTL)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.maintain()
+                job = self.store.claim(settings.JOB_CLIENT_CONCURRENCY)
+            except Exception as e:
+                print(f"⚠️  Job queue error: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(settings.JOB_POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        handler = _handlers.get(job["kind"])
+        start = time.perf_counter()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for job kind '{job['kind']}'")
+
+            def report(done, results):
+                self.store.progress(job["id"], job["attempts"], done, results)
+
+            results = handler(job, report)
+            self.store.finish(job["id"], job["attempts"], results)
+            metrics.inc("jobs.done")
+        except Exception as e:
+            print(f"❌ Job {job['id']} failed: {e}")
+            self.store.fail(job["id"], job["attempts"], str(e))
+            metrics.inc("jobs.failed")
+        finally:
+            metrics.observe(f"jobs.{job['kind']}", time.perf_counter() - start)
+
+
+_pool = None
+
+
+def start_workers():
+    """Start this process's worker threads (idempotent)"""
+    global _pool
+    if _pool is None:
+        _pool = WorkerPool(get_store(), settings.JOB_WORKERS)
+        _pool.start()
+    return _pool
+
+
+def stop_workers():
+    global _pool
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
+
+
+def submit(client, kind, params, total, priority="normal"):
+    """Queue a job and wake a local worker; returns the job record"""
+    job = new_job(client, kind, params, total, priority)
+    get_store().submit(job)
+    metrics.inc("jobs.submitted")
+    if _pool is not None:
+        _pool.notify()
+    return job
+
+
+def is_enabled():
+    return settings.JOBS_ENABLED
@@ -0,0 +1,339 @@
+"""
+Memory accounting and budget mode
+
+Reports the process RSS split into the components that grow it: imports
+(interpreter, NumPy, Pillow and TensorFlow, whose share is listed on its
+own), loaded model versions, caches and the batches being scored right now. ``/api/health`` shows the report.
+
+With ``MEMORY_LIMIT_MB`` set (the instance's memory, e.g. 512), the budget
+is computed once per process from the estimates below and applied to the
+settings before anything reads them:
+
+- the Keras backend is only imported when it fits next to one image in
+  flight, otherwise scoring stays on the NumPy rules in ``model_handler``
+- workers are capped so each keeps its fixed cost plus one image
+- batch sizes, concurrency, job threads and warm-up batches are capped to
+  the images a worker's share can hold
+- the session, rate-limit and feedback caches get ``CACHE_SHARE`` of it
+- ``TILE_MAX_PIXELS`` is capped so a canopy image decoded for tiling fits
+  in the rest of the share
+
+Calibrate ``MEMORY_KERAS_IMPORT_MB`` on the target machine with
+``python -m app.core.memory``.
+"""
+
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from app.config import settings
+
+MB = 1024 * 1024
+
+# Estimates (measured on MobileNetV2 at 224x224, CPU TensorFlow 2.18)
+APP_BASE_MB = 120  # interpreter, FastAPI, NumPy, Pillow, job threads (~120 MB after the first request)
+RULES_IMAGE_FACTOR = 4  # float32 copies of an input image alive while the rules score it
+KERAS_IMAGE_FACTOR = 30  # network activations per image relative to its float32 input (~17 MB)
+MODEL_FILE_FACTOR = 1.5  # RSS of a loaded model relative to its file size
+CACHE_SHARE = 0.1  # part of a worker's share left to caches
+SESSION_ENTRY_BYTES = 4096
+ADMISSION_BUCKET_BYTES = 256
+FEEDBACK_ROW_BYTES = 1024
+CANOPY_BYTES_PER_PIXEL = 10  # tiling decode: RGBA frame, its RGB conversion and the resized copy
+
+try:
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+_lock = threading.Lock()
+_components = {}  # name -> bytes attributed when measured
+_in_flight = {"batches": 0, "bytes": 0, "peak_bytes": 0}
+_budget = None
+_budget_done = False
+
+
+# === Process memory ===
+
+def peak_rss_bytes():
+    """Peak RSS of this process (0 where ``resource`` is unavailable)"""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def rss_bytes():
+    """Current RSS of this process (the peak where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return peak_rss_bytes()
+
+
+def container_limit_bytes():
+    """cgroup memory limit of the container, None when unlimited or unknown"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path, "r") as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+        return None
+    return None
+
+
+@contextmanager
+def measure(component):
+    """Attribute the RSS growth of the block to ``component`` (replacing an earlier measurement)"""
+    before = rss_bytes()
+    try:
+        yield
+    finally:
+        grown = max(0, rss_bytes() - before)
+        with _lock:
+            _components[component] = grown
+
+
+def record_imports():
+    """Attribute the RSS so far to imports (call before loading models; first call wins)"""
+    with _lock:
+        _components.setdefault("imports", rss_bytes())
+
+
+@contextmanager
+def in_flight(batch):
+    """Count ``batch`` (a NumPy array) as being scored for the duration of the block"""
+    size = batch.nbytes
+    with _lock:
+        _in_flight["batches"] += 1
+        _in_flight["bytes"] += size
+        _in_flight["peak_bytes"] = max(_in_flight["peak_bytes"], _in_flight["bytes"])
+    try:
+        yield
+    finally:
+        with _lock:
+            _in_flight["batches"] -= 1
+            _in_flight["bytes"] -= size
+
+
+# === Budget ===
+
+def image_mb(keras):
+    """Estimated peak memory of scoring one image"""
+    height, width = settings.IMG_SIZE
+    factor = KERAS_IMAGE_FACTOR if keras else RULES_IMAGE_FACTOR
+    return height * width * 3 * 4 * factor / MB
+
+
+def model_files():
+    """Artifacts of the active, shadow and student versions (from the manifest, else MODEL_PATH)"""
+    path = Path(settings.MODEL_MANIFEST_PATH)
+    if not path.exists():
+        return [Path(settings.MODEL_PATH)]
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    files = []
+    for role in ("active", "shadow", "student"):
+        entry = manifest.get("versions", {}).get(manifest.get(role) or "")
+        if entry is not None:
+            file = Path(entry.get("path", settings.MODEL_PATH))
+            files.append(file if file.is_absolute() else path.parent / file)
+    return files
+
+
+def model_mb(files=None):
+    """Estimated RSS of the loaded models"""
+    files = model_files() if files is None else files
+    return sum(f.stat().st_size for f in files if f.exists()) * MODEL_FILE_FACTOR / MB
+
+
+def compute_budget():
+    """Backend, worker count and per-worker image capacity for ``MEMORY_LIMIT_MB``, None when off"""
+    limit = settings.MEMORY_LIMIT_MB
+    if limit <= 0:
+        return None
+    usable = limit * (1.0 - settings.MEMORY_HEADROOM)
+
+    keras_mb = settings.MEMORY_KERAS_IMPORT_MB + model_mb()
+    keras = (not settings.INFERENCE_SERVER_ENABLED
+             and APP_BASE_MB + keras_mb + image_mb(True) <= usable)
+    worker_mb = APP_BASE_MB + (keras_mb if keras else 0)
+    per_image = image_mb(keras)
+
+    workers = max(1, min(settings.WEB_WORKER_COUNT, int(usable // (worker_mb + per_image))))
+    share = usable / workers - worker_mb
+    cache_mb = max(share * CACHE_SHARE, 1.0)
+    images = max(1, int((share - cache_mb) // per_image))
+    height, width = settings.IMG_SIZE
+    tile_pixels = max(height * width, int((share - cache_mb) * MB // CANOPY_BYTES_PER_PIXEL))
+    return {
+        "limit_mb": limit,
+        "usable_mb": round(usable, 1),
+        "backend": "keras" if keras else "numpy",
+        "worker_mb": round(worker_mb, 1),
+        "image_mb": round(per_image, 2),
+        "workers": workers,
+        "images_per_worker": images,
+        "cache_mb": round(cache_mb, 1),
+        "tile_pixels": tile_pixels
+    }
+
+
+def apply_budget(budget):
+    """Lower the settings the budget caps; returns {name: [old, new]} for the ones changed"""
+    images = budget["images_per_worker"]
+    cache_bytes = budget["cache_mb"] * MB
+    caps = {
+        "WEB_WORKERS": budget["workers"],
+        "INFERENCE_MAX_BATCH": images,
+        "TILE_BATCH_SIZE": images,
+        "TILE_MAX_PIXELS": budget["tile_pixels"],
+        "TTA_MAX_VIEWS": images,
+        "JOB_WORKERS": images,
+        "ADMISSION_MAX_CONCURRENCY": max(images, settings.ADMISSION_MIN_CONCURRENCY),
+        "ADMISSION_INITIAL_CONCURRENCY": max(images, settings.ADMISSION_MIN_CONCURRENCY),
+        "SESSION_MAX_ENTRIES": max(100, int(cache_bytes * 0.5 // SESSION_ENTRY_BYTES)),
+        "FEEDBACK_MAX_PENDING": max(100, int(cache_bytes * 0.4 // FEEDBACK_ROW_BYTES)),
+        "ADMISSION_MAX_CLIENTS": max(100, int(cache_bytes * 0.1 // ADMISSION_BUCKET_BYTES))
+    }
+    changed = {}
+    for name, cap in caps.items():
+        current = settings.WEB_WORKER_COUNT if name == "WEB_WORKERS" else getattr(settings, name)
+        if cap < current:
+            setattr(settings, name, cap)
+            changed[name] = [current, cap]
+
+    sizes = [b for b in settings.WARMUP_BATCH_SIZES if b <= images] or [1]
+    if tuple(sizes) != settings.WARMUP_BATCH_SIZES:
+        changed["WARMUP_BATCHES"] = [settings.WARMUP_BATCHES, ",".join(map(str, sizes))]
+        settings.WARMUP_BATCHES = changed["WARMUP_BATCHES"][1]
+
+    # Pooled input buffers per shape: as many full batches as fit
+    pool_size = max(1, images // max(sizes))
+    if pool_size < settings.TENSOR_POOL_SIZE:
+        changed["TENSOR_POOL_SIZE"] = [settings.TENSOR_POOL_SIZE, pool_size]
+        settings.TENSOR_POOL_SIZE = pool_size
+    return changed
+
+
+def get_budget():
+    """The process budget, computed and applied to the settings on first call (None when off)"""
+    global _budget, _budget_done
+    with _lock:
+        if not _budget_done:
+            budget = compute_budget()
+            if budget is not None:
+                budget["caps"] = apply_budget(budget)
+                print(f"🧮 Memory budget {budget['limit_mb']} MB: {budget['backend']} backend, "
+                      f"{budget['workers']} worker(s), {budget['images_per_worker']} image(s) in flight per worker")
+                for name, (old, new) in budget["caps"].items():
+                    print(f"   {name}: {old} -> {new}")
+            _budget, _budget_done = budget, True
+    return _budget
+
+
+def keras_allowed():
+    """Check if the budget leaves room to import the Keras backend"""
+    budget = get_budget()
+    return budget is None or budget["backend"] == "keras"
+
+
+def model_fits(path):
+    """Check if loading the model at ``path`` now stays within this worker's share"""
+    budget = get_budget()
+    if budget is None:
+        return True
+    share = budget["usable_mb"] / budget["workers"]
+    return rss_bytes() / MB + model_mb([Path(path)]) + image_mb(True) <= share
+
+
+# === Report ===
+
+def cache_bytes():
+    """Estimated size of each in-process cache that exists in this process"""
+    caches = {}
+    modules = sys.modules
+    if "app.core.ml.fast_path" in modules:
+        caches["tensor_pool"] = modules["app.core.ml.fast_path"].pool.nbytes()
+    if "app.core.ml.embedding_index" in modules:
+        total = 0
+        for index in list(modules["app.core.ml.embedding_index"]._indexes.values()):
+            # Read without the index lock (it is held across disk flushes); _grow
+            # sets the memmaps to None while it replaces them
+            vectors, scores = index.vectors, index.scores
+            if vectors is not None and scores is not None:
+                total += vectors.nbytes + scores.nbytes
+        caches["embedding_index"] = total
+    if "app.core.sessions" in modules:
+        store = modules["app.core.sessions"]._store
+        entries = getattr(store, "_entries", None)
+        if entries is not None:
+            caches["sessions"] = sum(len(raw) + 200 for raw, _ in list(entries.values()))
+    if "app.core.admission" in modules:
+        buckets = modules["app.core.admission"]._buckets
+        if buckets is not None:
+            caches["rate_limits"] = len(buckets._buckets) * ADMISSION_BUCKET_BYTES
+    if "app.core.feedback" in modules:
+        logs = list(modules["app.core.feedback"]._logs.values())
+        caches["feedback_pending"] = sum(len(log._rows) for log in logs) * FEEDBACK_ROW_BYTES
+    if "app.core.assets" in modules:
+        pages = list(modules["app.core.assets"]._pages.values())
+        caches["pages"] = sum(len(p.body) + sum(map(len, p.variants.values())) for p in pages)
+    return caches
+
+
+def report():
+    """Memory report for the health endpoint (sizes in MB)"""
+    rss = rss_bytes()
+    caches = cache_bytes()
+    with _lock:
+        components = dict(_components)
+        flight = dict(_in_flight)
+
+    models = {name: size for name, size in components.items() if name.startswith("model:")}
+    accounted = components.get("imports", 0) + sum(models.values()) + sum(caches.values()) + flight["bytes"]
+    limit = container_limit_bytes()
+    backend = None
+    if "app.core.ml.model_handler" in sys.modules:
+        handler = sys.modules["app.core.ml.model_handler"]
+        backend = "inference_server" if settings.INFERENCE_SERVER_ENABLED else ("keras" if handler.HAS_KERAS else "numpy")
+
+    def mb(value):
+        return round(value / MB, 1)
+
+    return {
+        "rss_mb": mb(rss),
+        "peak_rss_mb": mb(peak_rss_bytes()),
+        "container_limit_mb": mb(limit) if limit else None,
+        "backend": backend,
+        "imports_mb": mb(components.get("imports", 0)),
+        "keras_import_mb": mb(components.get("keras_import", 0)),
+        "models_mb": {name[len("model:"):]: mb(size) for name, size in models.items()},
+        "caches_mb": {name: mb(size) for name, size in caches.items()},
+        "in_flight": {"batches": flight["batches"], "mb": mb(flight["bytes"]), "peak_mb": mb(flight["peak_bytes"])},
+        "other_mb": mb(max(0, rss - accounted)),
+        "budget": _budget
+    }
+
+
+if __name__ == "__main__":
+    # Measure the import cost of the Keras backend to calibrate MEMORY_KERAS_IMPORT_MB
+    base = rss_bytes()
+    with measure("keras_import"):
+        try:
+            import keras  # noqa: F401
+        except ImportError:
+            import tensorflow.keras  # noqa: F401
+    print(f"📏 RSS before Keras: {base / MB:.0f} MB")
+    print(f"📏 Keras/TensorFlow import: {_components['keras_import'] / MB:.0f} MB (MEMORY_KERAS_IMPORT_MB)")
+    files = [f for f in model_files() if f.exists()]
+    print(f"📏 Models: {', '.join(str(f) for f in files) or 'none'} (~{model_mb(files):.0f} MB loaded)")
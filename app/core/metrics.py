@@ -0,0 +1,65 @@
+"""
+In-process metrics - thread-safe counters and latency summaries
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+
+
+def inc(name, value=1):
+    """Increment a counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, seconds):
+    """Record one latency sample"""
+    with _lock:
+        stats = _timings.get(name)
+        if stats is None:
+            stats = _timings[name] = {"count": 0, "total": 0.0, "max": 0.0}
+        stats["count"] += 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+
+
+@contextmanager
+def timer(name):
+    """Time a block and record it under ``name``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def get(name, default=0):
+    """Current value of a counter"""
+    with _lock:
+        return _counters.get(name, default)
+
+
+def snapshot():
+    """Copy of all counters and timing summaries (mean/max in milliseconds)"""
+    with _lock:
+        timings = {
+            name: {
+                "count": stats["count"],
+                "mean_ms": stats["total"] / stats["count"] * 1000 if stats["count"] else 0.0,
+                "max_ms": stats["max"] * 1000
+            }
+            for name, stats in _timings.items()
+        }
+        return {"counters": dict(_counters), "timings": timings}
+
+
+def reset():
+    """Clear all metrics"""
+    with _lock:
+        _counters.clear()
+        _timings.clear()
@@ -0,0 +1,195 @@
+"""
+Score calibration - per crop/region temperature and class priors
+
+The rule scores come out of hand-tuned clamps, so their confidence does not
+match observed accuracy and ignores how common each disease is for a given
+crop and region. ``fit_calibration.py`` fits, for every (crop, region)
+group with enough labeled samples, a temperature T and a per-class bias b
+(log prior correction). Serving applies them to the whole (N, NUM_CLASSES)
+score matrix at once::
+
+    calibrated = softmax(log(scores) / T[group] + b[group])
+
+Groups are looked up most specific first: ``crop/region``, ``crop/*``,
+``*/region``, ``*/*``. Rows without a matching group are only renormalized.
+Parameters live in a small ``.npz`` file that is reloaded when it changes.
+"""
+
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from app.config import settings
+
+WILDCARD = "*"
+EPSILON = 1e-6
+
+_lock = threading.Lock()
+_cache = {"path": None, "mtime": None, "table": None}
+
+
+def _normalize(value):
+    """Lowercased part, ``*`` when missing; ``/`` is escaped so it cannot split a key"""
+    value = (value or WILDCARD).strip().lower() or WILDCARD
+    return value.replace("%", "%25").replace("/", "%2F")
+
+
+def group_parts(crop=None, region=None):
+    """Normalized ``(crop, region)`` pair, ``*`` for a missing part"""
+    return _normalize(crop), _normalize(region)
+
+
+def group_key(crop=None, region=None):
+    """Normalized ``crop/region`` key, ``*`` for a missing part"""
+    return "/".join(group_parts(crop, region))
+
+
+class CalibrationTable:
+    """Temperatures and class biases per group, plus a trailing identity row"""
+
+    def __init__(self, groups, temperature, bias):
+        bias = np.asarray(bias, dtype=np.float64)
+        self.groups = {str(name): i for i, name in enumerate(groups)}
+        self.temperature = np.append(np.asarray(temperature, dtype=np.float64), 1.0)
+        self.bias = np.vstack([bias, np.zeros((1, bias.shape[1]))])
+        self.identity = len(self.groups)
+
+    def lookup(self, crop=None, region=None):
+        """Row index of the most specific fitted group"""
+        crop_key, region_key = group_parts(crop, region)
+        for key in (f"{crop_key}/{region_key}", f"{crop_key}/{WILDCARD}",
+                    f"{WILDCARD}/{region_key}", f"{WILDCARD}/{WILDCARD}"):
+            if key in self.groups:
+                return self.groups[key]
+        return self.identity
+
+    def apply(self, scores, rows):
+        """
+        Calibrate a score matrix
+
+        Args:
+            scores: (N, C) scores
+            rows: (N,) group row indices
+
+        Returns:
+            numpy array: (N, C) calibrated probabilities
+        """
+        if self.bias.shape[1] != scores.shape[1]:
+            return scores / scores.sum(axis=1, keepdims=True)
+        logits = np.log(np.clip(scores, EPSILON, None)) / self.temperature[rows, np.newaxis] + self.bias[rows]
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+
+def save_table(path, groups, temperature, bias, **extra):
+    """Write calibration parameters (``extra`` arrays are stored alongside, e.g. sample counts)"""
+    np.savez(path, groups=np.array(groups, dtype=str), temperature=np.asarray(temperature, dtype=np.float64),
+             bias=np.asarray(bias, dtype=np.float64), **extra)
+
+
+def load_table(path=None):
+    """
+    Load the calibration table, reusing the cached one until the file changes
+
+    Returns:
+        CalibrationTable or None: None when calibration is disabled or no file exists
+    """
+    if not settings.CALIBRATION_ENABLED:
+        return None
+    path = Path(path or settings.CALIBRATION_PATH)
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+
+    with _lock:
+        if _cache["path"] == path and _cache["mtime"] == mtime:
+            return _cache["table"]
+        try:
+            with np.load(path) as data:
+                table = CalibrationTable(data["groups"], data["temperature"], data["bias"])
+            print(f"✅ Calibration loaded: {len(table.groups)} groups from {path.name}")
+        except Exception as e:
+            print(f"⚠️  Could not load calibration {path}: {e}")
+            table = None
+        _cache.update(path=path, mtime=mtime, table=table)
+        return table
+
+
+def calibrate(scores, crop=None, region=None, table=None):
+    """
+    Apply calibration to a score matrix in one vectorized pass
+
+    Args:
+        scores: (N, C) or (C,) scores
+        crop: Crop type, a single value or one per row
+        region: Region, a single value or one per row
+        table: CalibrationTable, defaults to the configured file
+
+    Returns:
+        numpy array: Calibrated scores with the input's shape (unchanged without a table)
+    """
+    table = table if table is not None else load_table()
+    if table is None:
+        return scores
+
+    scores = np.asarray(scores, dtype=np.float64)
+    single = scores.ndim == 1
+    matrix = np.atleast_2d(scores)
+    n = matrix.shape[0]
+
+    crops = crop if isinstance(crop, (list, tuple, np.ndarray)) else [crop] * n
+    regions = region if isinstance(region, (list, tuple, np.ndarray)) else [region] * n
+    rows = np.array([table.lookup(c, r) for c, r in zip(crops, regions)], dtype=np.intp)
+
+    calibrated = table.apply(matrix, rows)
+    return calibrated[0] if single else calibrated
+
+
+def negative_log_likelihood(log_scores, labels, temperature, bias):
+    """Mean NLL of the calibrated probabilities"""
+    logits = log_scores / temperature + bias
+    logits = logits - logits.max(axis=1, keepdims=True)
+    log_norm = np.log(np.exp(logits).sum(axis=1))
+    return float((log_norm - logits[np.arange(len(labels)), labels]).mean())
+
+
+def fit_group(scores, labels, num_classes, rounds=5, prior_smoothing=1.0):
+    """
+    Fit a temperature and class biases for one group
+
+    Alternates a log-spaced search over T (minimizing NLL) with prior
+    matching of the biases: each class bias moves by log(observed frequency /
+    mean calibrated probability), so the calibrated scores reproduce the
+    group's class frequencies.
+
+    Args:
+        scores: (N, C) raw scores
+        labels: (N,) class indices
+        num_classes: C
+        rounds: Alternation rounds
+        prior_smoothing: Additive smoothing of class counts
+
+    Returns:
+        tuple: (temperature, (C,) bias, final NLL)
+    """
+    log_scores = np.log(np.clip(scores, EPSILON, None))
+    counts = np.bincount(labels, minlength=num_classes) + prior_smoothing
+    target = counts / counts.sum()
+
+    temperatures = np.geomspace(0.05, 20.0, 81)
+    temperature, bias = 1.0, np.zeros(num_classes)
+    for _ in range(rounds):
+        losses = [negative_log_likelihood(log_scores, labels, t, bias) for t in temperatures]
+        temperature = float(temperatures[int(np.argmin(losses))])
+
+        logits = log_scores / temperature + bias
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        bias += np.log(target / np.clip(probs.mean(axis=0), EPSILON, None))
+        bias -= bias.mean()
+
+    return temperature, bias, negative_log_likelihood(log_scores, labels, temperature, bias)
@@ -0,0 +1,100 @@
+"""
+Confidence-gated cascade - cheap downsampled rules first, full pipeline only when uncertain
+
+Stage 1 runs the rules on an area-downsampled thumbnail (1/16 of the pixels
+at the default size). When the margin between the top two class scores
+clears ``CASCADE_MARGIN`` the result is returned immediately; ambiguous
+images escalate to stage 2, the full-resolution rules plus the deep model.
+
+Thresholds are chosen offline with ``calibrate_cascade.py``.
+"""
+
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.core import metrics
+
+# Version label reported for images answered by stage 1
+CASCADE_VERSION = "rules-cascade"
+
+
+def is_enabled():
+    """Check if scoring should try the cheap stage first"""
+    return settings.CASCADE_ENABLED
+
+
+def downsample(img_array, size):
+    """
+    Area-downsample a preprocessed image to ``size`` x ``size``
+
+    Uses an exact block mean when the size divides the input, otherwise
+    nearest-neighbour sampling.
+
+    Args:
+        img_array: Array (1, H, W, 3) or (H, W, 3)
+        size: Output side length
+
+    Returns:
+        numpy array: (1, size, size, 3) array
+    """
+    img = img_array[0] if img_array.ndim == 4 else img_array
+    height, width = img.shape[:2]
+    if height % size == 0 and width % size == 0:
+        fy, fx = height // size, width // size
+        small = img.reshape(size, fy, size, fx, 3).mean(axis=(1, 3))
+    else:
+        rows = ((np.arange(size) + 0.5) * height / size).astype(np.intp)
+        cols = ((np.arange(size) + 0.5) * width / size).astype(np.intp)
+        small = img[rows[:, None], cols[None, :]]
+    return small[np.newaxis].astype(img.dtype, copy=False)
+
+
+def top_margin(scores):
+    """Difference between the two highest scores of each row"""
+    ordered = np.sort(np.atleast_2d(scores), axis=1)
+    return ordered[:, -1] - ordered[:, -2]
+
+
+def stage_one(img_array, size=None):
+    """
+    Score the downsampled image with the rules
+
+    Returns:
+        tuple: (score vector, top-2 margin)
+    """
+    from app.core.ml.model_handler import advanced_disease_detection_batch
+
+    scores = advanced_disease_detection_batch(downsample(img_array, size or settings.CASCADE_THUMB_SIZE))
+    return scores[0], float(top_margin(scores)[0])
+
+
+def try_early_exit(img_array, margin_threshold=None):
+    """
+    Run stage 1 and decide whether it is confident enough
+
+    Returns:
+        numpy array: Stage 1 scores when the image exits early, None to escalate
+    """
+    threshold = settings.CASCADE_MARGIN if margin_threshold is None else margin_threshold
+    start = time.perf_counter()
+    scores, margin = stage_one(img_array)
+    metrics.observe("cascade.stage1", time.perf_counter() - start)
+    metrics.inc("cascade.stage1.requests")
+
+    if margin >= threshold:
+        metrics.inc("cascade.stage1.exits")
+        return scores
+
+    metrics.inc("cascade.stage2.requests")
+    return None
+
+
+def exit_rates():
+    """Fraction of requests answered by each stage"""
+    total = metrics.get("cascade.stage1.requests")
+    early = metrics.get("cascade.stage1.exits")
+    if not total:
+        return {"stage1": 0.0, "stage2": 0.0}
+    return {"stage1": early / total, "stage2": (total - early) / total}
@@ -0,0 +1,324 @@
+"""
+Embedding index - compact memory-mapped vectors with IVF nearest-neighbour search
+
+Every scored image is stored as an L2-normalized float16 vector together with
+its score vector. Two kinds of index are kept:
+
+- ``thumb``: a cheap descriptor of the preprocessed image, computed before any
+  forward pass, used to answer near-duplicate uploads from their neighbour
+- ``deep-<version>``: penultimate-layer features of a Keras model version,
+  used for the "similar past cases" query
+
+Search is exact while the index is small. Once it grows past
+``EMBEDDING_IVF_MIN_TRAIN`` vectors a k-means coarse quantizer is trained in
+the background and queries only scan the ``EMBEDDING_IVF_NPROBE`` closest
+inverted lists.
+"""
+
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from app.config import settings
+
+DESCRIPTOR_GRID = 16  # thumbnail descriptor is a 16x16 RGB grid
+
+
+def image_descriptor(img_array):
+    """
+    Cheap near-duplicate descriptor of a preprocessed image
+
+    Area-downsamples to a 16x16 RGB grid and removes the mean brightness, so
+    re-encoded or slightly rescaled copies of the same photo stay close.
+
+    Args:
+        img_array: Float array (1, H, W, 3) or (H, W, 3) in [0, 1]
+
+    Returns:
+        numpy array: float32 vector of length 16 * 16 * 3
+    """
+    img = img_array[0] if img_array.ndim == 4 else img_array
+    height, width = img.shape[:2]
+    cell_h, cell_w = height // DESCRIPTOR_GRID, width // DESCRIPTOR_GRID
+    cropped = img[:cell_h * DESCRIPTOR_GRID, :cell_w * DESCRIPTOR_GRID]
+    grid = cropped.reshape(DESCRIPTOR_GRID, cell_h, DESCRIPTOR_GRID, cell_w, 3).mean(axis=(1, 3))
+    vector = grid.astype(np.float32).ravel()
+    return vector - vector.mean()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def kmeans(vectors, k, iterations=10, seed=0):
+    """
+    Spherical k-means on normalized vectors
+
+    Returns:
+        numpy array: (k, dim) normalized centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=k)
+        # Keep the previous centroid for empty clusters
+        empty = counts == 0
+        sums[empty] = centroids[empty]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class EmbeddingIndex:
+    """Append-only float16 vector store with optional IVF search"""
+
+    def __init__(self, directory, name, dim, num_classes):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.dim = dim
+        self.num_classes = num_classes
+
+        self._lock = threading.Lock()
+        self._training = False
+        self.centroids = None
+        self.lists = None
+        self.trained_count = 0
+
+        self._load()
+
+    # === Storage ===
+
+    def _path(self, suffix):
+        return self.directory / f"{self.name}.{suffix}"
+
+    def _open(self, suffix, columns, capacity):
+        path = self._path(suffix)
+        if path.exists():
+            return np.lib.format.open_memmap(str(path), mode='r+')
+        return np.lib.format.open_memmap(str(path), mode='w+', dtype=np.float16,
+                                         shape=(capacity, columns))
+
+    def _load(self):
+        meta_path = self._path("meta.json")
+        if meta_path.exists():
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        else:
+            meta = {"count": 0, "refs": []}
+        self.count = meta["count"]
+        self.refs = meta["refs"]
+
+        capacity = max(1024, self.count)
+        self.vectors = self._open("vectors.npy", self.dim, capacity)
+        self.scores = self._open("scores.npy", self.num_classes, capacity)
+        if self.vectors.shape[1] != self.dim:
+            raise ValueError(f"Index '{self.name}' has dim {self.vectors.shape[1]}, expected {self.dim}")
+
+        centroids_path = self._path("centroids.npy")
+        if centroids_path.exists() and self.count:
+            self._set_centroids(np.load(str(centroids_path)), self.count)
+
+    def _grow(self):
+        """Double the memmap capacity"""
+        capacity = len(self.vectors) * 2
+        for attr, suffix in (("vectors", "vectors.npy"), ("scores", "scores.npy")):
+            old = getattr(self, attr)
+            tmp_path = self._path(suffix + ".tmp")
+            new = np.lib.format.open_memmap(str(tmp_path), mode='w+', dtype=np.float16,
+                                            shape=(capacity, old.shape[1]))
+            new[:self.count] = old[:self.count]
+            new.flush()
+            del new
+            old.flush()
+            setattr(self, attr, None)
+            del old
+            tmp_path.replace(self._path(suffix))
+            setattr(self, attr, np.lib.format.open_memmap(str(self._path(suffix)), mode='r+'))
+
+    def flush(self):
+        """Persist vectors and metadata"""
+        with self._lock:
+            self.vectors.flush()
+            self.scores.flush()
+            tmp_path = self._path("meta.json.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"count": self.count, "refs": self.refs}, f)
+            tmp_path.replace(self._path("meta.json"))
+
+    # === IVF ===
+
+    def _set_centroids(self, centroids, upto):
+        assign = np.argmax(self._matrix(upto) @ centroids.T, axis=1)
+        lists = [list(np.flatnonzero(assign == j)) for j in range(len(centroids))]
+        self.centroids = centroids
+        self.lists = lists
+        self.trained_count = upto
+
+    def _matrix(self, upto):
+        return np.asarray(self.vectors[:upto], dtype=np.float32)
+
+    def _train(self):
+        try:
+            upto = self.count
+            k = max(8, int(np.sqrt(upto)))
+            centroids = kmeans(self._matrix(upto), k)
+            with self._lock:
+                # Vectors added while training are assigned below
+                self._set_centroids(centroids, upto)
+                if self.count > upto:
+                    extra = self._matrix(self.count)[upto:]
+                    for offset, j in enumerate(np.argmax(extra @ centroids.T, axis=1)):
+                        self.lists[j].append(upto + offset)
+            np.save(str(self._path("centroids.npy")), centroids)
+            print(f"🧭 Index '{self.name}' trained: {k} lists over {upto} vectors")
+        except Exception as e:
+            print(f"⚠️  Index '{self.name}' training failed: {e}")
+        finally:
+            self._training = False
+
+    def _maybe_train(self):
+        if self._training or self.count < settings.EMBEDDING_IVF_MIN_TRAIN:
+            return
+        if self.centroids is not None and self.count < 2 * self.trained_count:
+            return
+        self._training = True
+        threading.Thread(target=self._train, name=f"ivf-{self.name}", daemon=True).start()
+
+    # === Public API ===
+
+    def add(self, vector, scores, ref):
+        """
+        Append one vector
+
+        Args:
+            vector: Embedding (normalized on insert)
+            scores: Score vector in DISEASE_KEYS order
+            ref: JSON-serializable reference (image URL, version, ...)
+        """
+        vector = _normalize(vector)
+        with self._lock:
+            if self.count >= len(self.vectors):
+                self._grow()
+            idx = self.count
+            self.vectors[idx] = vector
+            self.scores[idx] = scores
+            self.refs.append(ref)
+            self.count += 1
+            if self.centroids is not None:
+                self.lists[int(np.argmax(self.centroids @ vector))].append(idx)
+        if self.count % settings.EMBEDDING_FLUSH_EVERY == 0:
+            self.flush()
+        self._maybe_train()
+
+    def search(self, vector, k=5):
+        """
+        Approximate k nearest neighbours by cosine similarity
+
+        Returns:
+            list: [(similarity, index)] best first
+        """
+        query = _normalize(vector)
+        with self._lock:
+            count = self.count
+            if count == 0:
+                return []
+            if self.centroids is None:
+                candidates = np.arange(count)
+            else:
+                probes = np.argsort(self.centroids @ query)[::-1][:settings.EMBEDDING_IVF_NPROBE]
+                candidates = np.fromiter(
+                    (i for j in probes for i in self.lists[j]), dtype=np.int64)
+                if len(candidates) == 0:
+                    return []
+            matrix = np.asarray(self.vectors[candidates], dtype=np.float32)
+
+        sims = matrix @ query
+        top = np.argsort(sims)[::-1][:k]
+        return [(float(sims[i]), int(candidates[i])) for i in top]
+
+    def neighbour(self, index):
+        """Stored scores and reference of one entry"""
+        return np.asarray(self.scores[index], dtype=np.float64), self.refs[index]
+
+
+# Indexes opened by this process, by name
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(name, dim):
+    """Open (or create) a named index in ``settings.EMBEDDING_INDEX_DIR``"""
+    from app.core.ml.model_handler import NUM_CLASSES
+
+    with _indexes_lock:
+        index = _indexes.get(name)
+        if index is None:
+            index = EmbeddingIndex(settings.EMBEDDING_INDEX_DIR, name, dim, NUM_CLASSES)
+            _indexes[name] = index
+    return index
+
+
+def flush_all():
+    """Persist every open index (called on shutdown)"""
+    for index in list(_indexes.values()):
+        index.flush()
+
+
+def is_enabled():
+    """Check if scoring should consult and feed the index"""
+    return settings.EMBEDDING_INDEX_ENABLED and not settings.INFERENCE_SERVER_ENABLED
+
+
+def thumb_index():
+    return get_index("thumb", DESCRIPTOR_GRID * DESCRIPTOR_GRID * 3)
+
+
+def find_duplicate(descriptor):
+    """
+    Look up a near-duplicate of an image by its descriptor
+
+    Returns:
+        tuple: (scores, ref) of the neighbour, or None below the similarity threshold
+    """
+    hits = thumb_index().search(descriptor, k=1)
+    if hits and hits[0][0] >= settings.EMBEDDING_DUPLICATE_SIMILARITY:
+        return thumb_index().neighbour(hits[0][1])
+    return None
+
+
+def record(descriptor, scores, ref, version=None, embedding=None):
+    """Store a scored image in the thumb index and, when available, the deep index"""
+    thumb_index().add(descriptor, scores, ref)
+    if embedding is not None and version:
+        get_index(f"deep-{version}", len(embedding)).add(embedding, scores, ref)
+
+
+def similar_cases(descriptor, embedding=None, version=None, k=5):
+    """
+    Past cases most similar to an image
+
+    Uses the deep index of ``version`` when an embedding is given, otherwise
+    the thumbnail index.
+
+    Returns:
+        list: [{"similarity", "scores", "ref"}] best first
+    """
+    if embedding is not None and version:
+        index = get_index(f"deep-{version}", len(embedding))
+        query = embedding
+    else:
+        index = thumb_index()
+        query = descriptor
+
+    results = []
+    for similarity, idx in index.search(query, k=k):
+        scores, ref = index.neighbour(idx)
+        results.append({"similarity": similarity, "scores": scores, "ref": ref})
+    return results
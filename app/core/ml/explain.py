@@ -0,0 +1,72 @@
+"""
+Explainability overlays from the rules masks
+
+The color and spot masks that ``advanced_disease_detection_batch`` computes
+while scoring are captured (see ``model_handler.capture_masks``) and encoded
+here as run-length layers, so the UI can highlight affected regions without
+a second request or any server-side image processing.
+
+Encoding: each layer is the row-major flattened (height, width) mask as
+alternating run lengths, starting with a run of background pixels (which
+may be 0).
+"""
+
+import numpy as np
+
+# Layers in drawing order; disease layers after the healthy one
+LAYERS = ("green", "pale", "yellow", "brown", "dark", "spots")
+
+
+def rle_encode(mask):
+    """
+    Run-length encode a boolean mask in row-major order
+
+    Returns:
+        list: Alternating background/foreground run lengths, background first
+    """
+    flat = np.asarray(mask, dtype=bool).ravel()
+    if flat.size == 0:
+        return []
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], change, [flat.size])))
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return counts.tolist()
+
+
+def rle_decode(counts, shape):
+    """Inverse of ``rle_encode``"""
+    values = np.arange(len(counts)) % 2 == 1
+    return np.repeat(values, counts).reshape(shape)
+
+
+def build_explanation(masks, index=0, box=None):
+    """
+    Encode captured masks for one image of the scored batch
+
+    Args:
+        masks: Dict of (N, H, W) boolean arrays from ``capture_masks``
+        index: Image in the batch (0 is the unaugmented view under TTA)
+        box: Region of the upload the masks cover, (left, top, right, bottom) fractions
+
+    Returns:
+        dict: ``height``, ``width``, ``box``, ``encoding``, per-layer ``layers``
+        run lengths and ``coverage`` fractions
+    """
+    layers = {}
+    coverage = {}
+    height = width = 0
+    for name in LAYERS:
+        mask = masks[name][index]
+        height, width = mask.shape
+        layers[name] = rle_encode(mask)
+        coverage[name] = float(mask.mean())
+
+    return {
+        "height": height,
+        "width": width,
+        "box": [float(x) for x in (box or (0.0, 0.0, 1.0, 1.0))],
+        "encoding": "rle",
+        "layers": layers,
+        "coverage": coverage
+    }
@@ -0,0 +1,132 @@
+"""
+Low-overhead forward pass for the Keras model
+
+``Model.predict`` builds a data adapter and runs callbacks on every call,
+which costs more than a MobileNetV2 forward pass at batch size 1. The fast
+path calls the concrete functions traced during warm-up (falling back to
+``predict_on_batch`` for untraced shapes) on input buffers taken from a
+pool, so steady-state requests allocate no new input tensors.
+"""
+
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.config import settings
+
+
+def configure_threads():
+    """Pin TensorFlow intra/inter-op thread pools from Settings (0 keeps TF defaults)"""
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return False
+
+    try:
+        if settings.TF_INTRA_OP_THREADS > 0:
+            tf.config.threading.set_intra_op_parallelism_threads(settings.TF_INTRA_OP_THREADS)
+        if settings.TF_INTER_OP_THREADS > 0:
+            tf.config.threading.set_inter_op_parallelism_threads(settings.TF_INTER_OP_THREADS)
+    except RuntimeError as e:
+        # The runtime is already initialized; thread pools can no longer change
+        print(f"⚠️  Could not pin TensorFlow threads: {e}")
+        return False
+    return True
+
+
+class TensorPool:
+    """
+    Reusable float32 input buffers keyed by shape
+
+    Buffers are handed out to one caller at a time and returned on release,
+    so concurrent requests never share a buffer.
+    """
+
+    def __init__(self, max_per_shape=None):
+        self.max_per_shape = max_per_shape or settings.TENSOR_POOL_SIZE
+        self._free = {}
+        self._lock = threading.Lock()
+        self.allocated = 0
+
+    @contextmanager
+    def buffer(self, shape):
+        """Borrow a float32 buffer of ``shape``; contents are undefined"""
+        shape = tuple(shape)
+        with self._lock:
+            free = self._free.setdefault(shape, [])
+            buf = free.pop() if free else None
+        if buf is None:
+            buf = np.empty(shape, dtype=np.float32)
+            self.allocated += 1
+        try:
+            yield buf
+        finally:
+            with self._lock:
+                free = self._free[shape]
+                if len(free) < self.max_per_shape:
+                    free.append(buf)
+
+    def nbytes(self):
+        """Bytes currently parked in the pool"""
+        with self._lock:
+            return sum(buf.nbytes for bufs in self._free.values() for buf in bufs)
+
+
+# Process-wide pool shared by all model versions
+pool = TensorPool()
+
+
+def fill_input(buf, batch):
+    """Copy ``batch`` into the head of ``buf`` as float32 in [0, 1], zeroing the padding"""
+    n = len(batch)
+    if batch.dtype == np.uint8:
+        np.multiply(batch, np.float32(1.0 / 255.0), out=buf[:n], casting='unsafe')
+    else:
+        buf[:n] = batch
+    if n < len(buf):
+        buf[n:] = 0.0
+    return buf
+
+
+def _forward_chunk(model, traced, batch):
+    n = len(batch)
+    # Smallest traced graph that fits, padding the batch up to its size
+    fit = next((b for b in sorted(traced) if b >= n), None)
+    rows = fit or n
+
+    with pool.buffer((rows,) + batch.shape[1:]) as buf:
+        fill_input(buf, batch)
+        if fit is not None:
+            outputs = traced[fit](buf)
+        else:
+            # Compiled predict step without predict()'s adapter and callbacks;
+            # an eager model(x, training=False) call measured slower than both
+            outputs = model.predict_on_batch(buf)
+        if isinstance(outputs, (list, tuple)):
+            return [np.asarray(o)[:n].copy() for o in outputs]
+        return np.asarray(outputs)[:n].copy()
+
+
+def forward(model, traced, batch):
+    """
+    Run the network without ``Model.predict``
+
+    Args:
+        model: Keras model
+        traced: {batch_size: concrete function} from warm-up (may be empty)
+        batch: Array (N, H, W, 3), uint8 or float in [0, 1]
+
+    Returns:
+        numpy array: Model outputs for the N images (a list for multi-output models)
+    """
+    if not traced or len(batch) <= max(traced):
+        return _forward_chunk(model, traced, batch)
+
+    # Larger than any traced graph: run it in chunks of the largest one
+    step = max(traced)
+    chunks = [_forward_chunk(model, traced, batch[i:i + step])
+              for i in range(0, len(batch), step)]
+    if isinstance(chunks[0], list):
+        return [np.concatenate(parts) for parts in zip(*chunks)]
+    return np.concatenate(chunks)
@@ -0,0 +1,447 @@
+"""
+Out-of-process inference server backed by a shared memory ring buffer
+
+Several Uvicorn workers can share one inference process that holds the only
+copy of the model. Workers write preprocessed uint8 tensors into slots of a
+``multiprocessing.shared_memory`` block and poll for completion; the server
+scores every ready slot as one batch.
+
+Run the server on the same host as the API workers:
+
+    python -m app.core.ml.inference_server
+
+and start the API with ``INFERENCE_SERVER_ENABLED=true``.
+"""
+
+import fcntl
+import os
+import signal
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+from pathlib import Path
+
+import numpy as np
+
+from app.config import settings
+from app.core.ml.preprocessing import to_uint8
+
+# Slot states
+FREE = 0
+WRITING = 1
+READY = 2
+BUSY = 3
+DONE = 4
+ABANDONED = 5
+
+MAGIC = 0x504C414E54  # "PLANT"
+HEADER_FIELDS = 8  # magic, slots, height, width, channels, classes, server pid, reserved
+VERSION_BYTES = 32  # per-slot name of the model version that scored it
+
+# Seconds between attach attempts when the server is unreachable
+RECONNECT_INTERVAL = 5.0
+
+# Seconds between server sweeps for slots left behind by a dead worker
+RECLAIM_INTERVAL = 1.0
+
+
+def is_enabled():
+    """Check if API workers should score through the inference server"""
+    return settings.INFERENCE_SERVER_ENABLED
+
+
+def _lock_path(name):
+    """Path of the lock file guarding slot state transitions"""
+    base = Path('/dev/shm') if Path('/dev/shm').is_dir() else Path(tempfile.gettempdir())
+    return base / f"{name}.lock"
+
+
+class SlotLock:
+    """
+    Cross-process lock serializing slot state transitions
+
+    flock() does not exclude threads sharing one descriptor, so a thread lock
+    guards the file lock within a process.
+    """
+
+    def __init__(self, name):
+        self.fd = os.open(str(_lock_path(name)), os.O_RDWR | os.O_CREAT, 0o600)
+        self.thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RingBuffer:
+    """
+    Typed views over the shared memory block
+
+    Layout: int64 header, int64 per-slot state table, float64 per-slot
+    time of the last state change (``time.monotonic``, shared by the
+    processes of one host), uint8 input tensors (slots, H, W, 3), float32
+    score vectors (slots, classes) and the serving model version name per
+    slot.
+    """
+
+    def __init__(self, shm, slots, height, width, num_classes):
+        self.shm = shm
+        self.slots = slots
+        self.shape = (height, width, 3)
+        self.num_classes = num_classes
+
+        offset = 0
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self.header.nbytes
+        self.ctrl = np.ndarray((slots,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self.ctrl.nbytes
+        self.stamps = np.ndarray((slots,), dtype=np.float64, buffer=shm.buf, offset=offset)
+        offset += self.stamps.nbytes
+        self.inputs = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+        offset += self.inputs.nbytes
+        self.outputs = np.ndarray((slots, num_classes), dtype=np.float32, buffer=shm.buf, offset=offset)
+        offset += self.outputs.nbytes
+        self.versions = np.ndarray((slots, VERSION_BYTES), dtype=np.uint8, buffer=shm.buf, offset=offset)
+
+    @staticmethod
+    def nbytes(slots, height, width, num_classes):
+        """Total shared memory size for the given geometry"""
+        return (HEADER_FIELDS * 8 + slots * 8 + slots * 8 +
+                slots * height * width * 3 + slots * num_classes * 4 +
+                slots * VERSION_BYTES)
+
+    @classmethod
+    def create(cls, name, slots, height, width, num_classes):
+        """Create (or recreate) the shared block and write its header"""
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+
+        size = cls.nbytes(slots, height, width, num_classes)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        ring = cls(shm, slots, height, width, num_classes)
+        ring.ctrl[:] = 0
+        ring.stamps[:] = 0.0
+        ring.header[:] = [MAGIC, slots, height, width, 3, num_classes, os.getpid(), 0]
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to an existing block, reading its geometry from the header"""
+        shm = shared_memory.SharedMemory(name=name)
+        # The creating server owns the segment; stop this process's resource
+        # tracker from unlinking it when the worker exits
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        if int(header[0]) != MAGIC:
+            shm.close()
+            raise RuntimeError(f"Shared memory '{name}' is not an inference ring buffer")
+        slots, height, width, _, num_classes = (int(x) for x in header[1:6])
+        return cls(shm, slots, height, width, num_classes)
+
+    def set_state(self, slots, state):
+        """Move slots to ``state`` and timestamp the change (call under the slot lock)"""
+        self.ctrl[slots] = state
+        self.stamps[slots] = time.monotonic()
+
+    def close(self):
+        """Drop the numpy views and detach from the block"""
+        self.header = self.ctrl = self.stamps = self.inputs = self.outputs = self.versions = None
+        self.shm.close()
+
+
+class InferenceClient:
+    """API worker side of the ring buffer"""
+
+    def __init__(self, name=None):
+        self.name = name or settings.INFERENCE_SHM_NAME
+        self.ring = RingBuffer.attach(self.name)
+        self.lock = SlotLock(self.name)
+
+    def _claim(self, count):
+        """Reserve up to ``count`` free slots, returns their indices"""
+        with self.lock:
+            free = np.flatnonzero(self.ring.ctrl == FREE)[:count]
+            self.ring.set_state(free, WRITING)
+        return free
+
+    def submit(self, images_uint8):
+        """
+        Copy images into free slots and mark them ready
+
+        Args:
+            images_uint8: uint8 array of shape (N, H, W, 3)
+
+        Returns:
+            numpy array: Slot indices holding the images, in input order
+        """
+        slots = self._claim(len(images_uint8))
+        if len(slots) < len(images_uint8):
+            self._release(slots)
+            raise RuntimeError("Inference ring buffer is full")
+
+        self.ring.inputs[slots] = images_uint8
+        with self.lock:
+            self.ring.set_state(slots, READY)
+        return slots
+
+    def _release(self, slots):
+        with self.lock:
+            self.ring.set_state(slots, FREE)
+
+    def wait(self, slots, timeout):
+        """
+        Wait until all slots are scored and copy out their score vectors
+
+        Returns:
+            tuple: ((N, classes) scores, list of serving version names)
+
+        Raises:
+            TimeoutError: When the server does not answer within ``timeout``
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.0002
+        ctrl = self.ring.ctrl
+        while not np.all(ctrl[slots] == DONE):
+            if time.monotonic() > deadline:
+                self._abandon(slots)
+                raise TimeoutError("Inference server did not respond in time")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.002)
+
+        scores = self.ring.outputs[slots].astype(np.float64)
+        versions = [bytes(row).rstrip(b'\0').decode('utf-8', 'replace')
+                    for row in self.ring.versions[slots]]
+        self._release(slots)
+        return scores, versions
+
+    def _abandon(self, slots):
+        """Give slots back after a timeout without racing the server"""
+        with self.lock:
+            for slot in slots:
+                state = self.ring.ctrl[slot]
+                # The server frees busy slots itself once it finishes them
+                self.ring.set_state(slot, ABANDONED if state == BUSY else FREE)
+
+    def score(self, images_uint8, timeout=None):
+        """Score a uint8 batch through the server, returns (scores, versions)"""
+        slots = self.submit(images_uint8)
+        return self.wait(slots, timeout or settings.INFERENCE_TIMEOUT)
+
+    def close(self):
+        self.ring.close()
+        self.lock.close()
+
+
+class InferenceServer:
+    """Single process holding the model and scoring ready slots in batches"""
+
+    def __init__(self, name=None, slots=None, max_batch=None, batch_wait_ms=None):
+        from app.core.ml import model_handler
+
+        self.name = name or settings.INFERENCE_SHM_NAME
+        self.max_batch = max_batch or settings.INFERENCE_MAX_BATCH
+        self.batch_wait = (settings.INFERENCE_BATCH_WAIT_MS if batch_wait_ms is None
+                           else batch_wait_ms) / 1000.0
+        self.score_batch = model_handler.score_batch
+        self.ring = RingBuffer.create(
+            self.name,
+            slots or settings.INFERENCE_SLOTS,
+            settings.IMG_HEIGHT,
+            settings.IMG_WIDTH,
+            model_handler.NUM_CLASSES
+        )
+        self.lock = SlotLock(self.name)
+        self.running = False
+        self.batches = 0
+        self.images = 0
+        self.reclaimed = 0
+        self._last_reclaim = time.monotonic()
+
+    def _reclaim(self):
+        """
+        Free slots a worker claimed or left DONE and then died with
+
+        Workers give up on a request after ``INFERENCE_TIMEOUT``, so a
+        WRITING or DONE slot older than twice that has no owner left. BUSY
+        and ABANDONED slots only exist while this process scores a batch,
+        so the same age also catches any left over from a failed one.
+        """
+        now = time.monotonic()
+        if now - self._last_reclaim < RECLAIM_INTERVAL:
+            return
+        self._last_reclaim = now
+        ctrl = self.ring.ctrl
+        cutoff = now - 2 * settings.INFERENCE_TIMEOUT
+        with self.lock:
+            stale = np.flatnonzero(np.isin(ctrl, (WRITING, BUSY, DONE, ABANDONED)) & (self.ring.stamps < cutoff))
+            self.ring.set_state(stale, FREE)
+        if len(stale):
+            self.reclaimed += len(stale)
+            print(f"♻️  Reclaimed {len(stale)} slots left by a lost worker")
+
+    def _collect(self):
+        """Wait for ready slots, giving stragglers a short window to join the batch"""
+        ctrl = self.ring.ctrl
+        idle_delay = 0.0002
+        while self.running:
+            self._reclaim()
+            ready = np.flatnonzero(ctrl == READY)
+            if len(ready) == 0:
+                time.sleep(idle_delay)
+                idle_delay = min(idle_delay * 2, 0.005)
+                continue
+
+            if len(ready) < self.max_batch and self.batch_wait > 0:
+                time.sleep(self.batch_wait)
+
+            with self.lock:
+                ready = np.flatnonzero(ctrl == READY)[:self.max_batch]
+                self.ring.set_state(ready, BUSY)
+            if len(ready):
+                return ready
+        return None
+
+    def _complete(self, slots, scores, version):
+        ctrl = self.ring.ctrl
+        label = np.zeros(VERSION_BYTES, dtype=np.uint8)
+        encoded = version.encode('utf-8')[:VERSION_BYTES]
+        label[:len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+        with self.lock:
+            for slot, row in zip(slots, scores):
+                if ctrl[slot] == BUSY:
+                    self.ring.outputs[slot] = row
+                    self.ring.versions[slot] = label
+                    self.ring.set_state(slot, DONE)
+                else:
+                    self.ring.set_state(slot, FREE)
+
+    def serve_forever(self):
+        """Score batches until ``stop()`` is called or the process is signalled"""
+        self.running = True
+        print(f"🚀 Inference server ready: shm={self.name} slots={self.ring.slots} "
+              f"max_batch={self.max_batch}")
+        while self.running:
+            slots = self._collect()
+            if slots is None:
+                break
+            try:
+                scores, version = self.score_batch(self.ring.inputs[slots])
+            except Exception as e:
+                print(f"❌ Inference batch failed: {e}")
+                scores = np.full((len(slots), self.ring.num_classes),
+                                 1.0 / self.ring.num_classes, dtype=np.float32)
+                version = "error"
+            self._complete(slots, scores, version)
+            self.batches += 1
+            self.images += len(slots)
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        """Detach and remove the shared block"""
+        shm = self.ring.shm
+        self.ring.close()
+        shm.unlink()
+        self.lock.close()
+        try:
+            _lock_path(self.name).unlink()
+        except FileNotFoundError:
+            pass
+
+
+# Per-worker client, attached lazily on first use
+_client = None
+_last_attach_attempt = 0.0
+
+
+def get_client():
+    """Return the worker's client, or None if the server is not reachable"""
+    global _client, _last_attach_attempt
+    if _client is not None:
+        return _client
+
+    now = time.monotonic()
+    if now - _last_attach_attempt < RECONNECT_INTERVAL:
+        return None
+    _last_attach_attempt = now
+
+    try:
+        _client = InferenceClient()
+        print(f"✅ Attached to inference server '{_client.name}'")
+    except Exception as e:
+        print(f"⚠️  Inference server unavailable ({e}), scoring locally")
+        _client = None
+    return _client
+
+
+def score_remote(img_batch):
+    """
+    Score preprocessed images through the inference server
+
+    Args:
+        img_batch: Float array (N, H, W, 3) or (H, W, 3) with values in [0, 1]
+
+    Returns:
+        tuple: ((N, NUM_CLASSES) scores, serving version name), or None when
+        the caller should score locally
+    """
+    client = get_client()
+    if client is None:
+        return None
+
+    batch = img_batch if img_batch.ndim == 4 else img_batch[np.newaxis]
+    if batch.shape[1:] != client.ring.shape:
+        return None
+
+    images = to_uint8(batch)
+    try:
+        scores, versions = client.score(images)
+    except Exception as e:
+        print(f"⚠️  Remote inference failed ({e}), scoring locally")
+        return None
+    return scores, versions[0]
+
+
+def main():
+    """Run the inference server in the foreground"""
+    # This process scores locally and owns the one model instance
+    settings.INFERENCE_SERVER_ENABLED = False
+
+    server = InferenceServer()
+    # Load the active model version before accepting work
+    from app.core.ml.model_registry import get_registry
+    get_registry()
+
+    def _shutdown(signum, frame):
+        server.stop()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+    try:
+        server.serve_forever()
+    finally:
+        print(f"🛑 Inference server stopped after {server.batches} batches "
+              f"({server.images} images)")
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,13 @@ import numpy as np
 from pathlib import Path
 from PIL import Image
 import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from app.config import settings
+from app.core import memory, metrics
+from app.core.ml.preprocessing import to_uint8
 
 # Get base directory (project root)
 BASE_DIR = Path(__file__).parent.parent.parent.parent
@@ -17,29 +24,88 @@ class_indices_path = BASE_DIR / 'models' / 'class_indices.json'
 with open(class_indices_path, 'r', encoding='utf-8') as f:
     CLASS_INDICES = json.load(f)
 
-# Try loading TensorFlow/Keras
-MODEL = None
-try:
+# Class keys scored by the rules engine, in score-vector column order
+DISEASE_KEYS = (
+    'khoe_manh', 'benh_dom_la', 'benh_vang_la', 'benh_phan_trang',
+    'benh_dao_on', 'benh_gia_phan', 'benh_heo_xanh', 'benh_xoan_la',
+    'benh_kham_virus', 'benh_than_thu', 'benh_thoi_re', 'benh_dom_vong',
+    'benh_kham_la', 'benh_thoi_qua', 'benh_heo_ru'
+)
+NUM_CLASSES = len(DISEASE_KEYS)
+
+# Dataset folder names whose ASCII form differs from the class key
+CLASS_KEY_ALIASES = {
+    'la_khoe_manh': 'khoe_manh',
+    'benh_nam_phan_trang': 'benh_phan_trang'
+}
+
+
+def class_key(name):
+    """
+    Map a class key or a Vietnamese class/folder name to a DISEASE_KEYS entry
+
+    Returns:
+        str or None: The class key, None when the name matches no class
+    """
+    import unicodedata
+    name = str(name).strip()
+    if name in DISEASE_KEYS:
+        return name
+    ascii_name = unicodedata.normalize('NFKD', name.replace('đ', 'd').replace('Đ', 'D'))
+    slug = '_'.join(ascii_name.encode('ascii', 'ignore').decode().lower().split())
+    slug = CLASS_KEY_ALIASES.get(slug, slug)
+    return slug if slug in DISEASE_KEYS else None
+
+# Version label reported when only the rules engine scored an image
+RULES_VERSION = "rules"
+
+# Try importing TensorFlow/Keras; model artifacts are loaded by the model registry
+HAS_KERAS = False
+if settings.INFERENCE_SERVER_ENABLED:
+    # API workers delegate scoring to the shared inference process
+    print("ℹ️  Inference server enabled, skipping local model load")
+elif not memory.keras_allowed():
+    print(f"ℹ️  Keras does not fit in MEMORY_LIMIT_MB={settings.MEMORY_LIMIT_MB}, using lightweight inference")
+else:
     try:
-        from keras.models import load_model as keras_load_model
-        print("✅ Using Keras")
-        HAS_KERAS = True
-    except:
-        from tensorflow.keras.models import load_model as keras_load_model
-        print("✅ Using TensorFlow.Keras")
-        HAS_KERAS = True
-    
-    # Try loading model file
-    model_path = BASE_DIR / 'models' / 'disease_model.h5'
-    if model_path.exists():
-        MODEL = keras_load_model(str(model_path), compile=False)
-        print(f"✅ Loaded model from {model_path}")
-    else:
-        print("⚠️  Model file not found, using smart inference")
-except Exception as e:
-    print(f"⚠️  Keras/TensorFlow not available: {e}")
-    print("   Using lightweight inference")
-    HAS_KERAS = False
+        with memory.measure("keras_import"):
+            try:
+                from keras.models import load_model as keras_load_model
+                print("✅ Using Keras")
+                HAS_KERAS = True
+            except:
+                from tensorflow.keras.models import load_model as keras_load_model
+                print("✅ Using TensorFlow.Keras")
+                HAS_KERAS = True
+        
+        from app.core.ml.fast_path import configure_threads
+        configure_threads()
+    except Exception as e:
+        print(f"⚠️  Keras/TensorFlow not available: {e}")
+        print("   Using lightweight inference")
+        HAS_KERAS = False
+
+
+def load_keras_model(model_path):
+    """Load a Keras artifact, or return None when it cannot be used"""
+    model_path = Path(model_path)
+    if not HAS_KERAS:
+        return None
+    if not model_path.exists():
+        print(f"⚠️  Model file not found: {model_path}, using smart inference")
+        return None
+    if not memory.model_fits(model_path):
+        print(f"⚠️  Model {model_path} does not fit in the memory budget, using smart inference")
+        return None
+    model = keras_load_model(str(model_path), compile=False)
+    print(f"✅ Loaded model from {model_path}")
+    return model
+
+
+def get_active_version():
+    """Return the active registry version"""
+    from app.core.ml.model_registry import get_registry
+    return get_registry().active
 
 def load_model():
     """Load model configuration"""
@@ -53,188 +119,430 @@ def load_model():
 
 def extract_features_with_model(image_array):
     """Extract features using MobileNetV2 then apply smart rules"""
-    if MODEL is None:
+    version = get_active_version()
+    if version.model is None:
         return None
     
     # Model expects batch dimension
     if len(image_array.shape) == 3:
         image_array = np.expand_dims(image_array, axis=0)
     
-    # Get deep learning features (not final predictions)
+    # Get deep learning features (not final predictions) through the
+    # low-overhead path instead of Model.predict
     # We'll use these features with our disease detection rules
-    features = MODEL.predict(image_array, verbose=0)
+    _, features = version.predict_features(image_array)
     
     # Analyze features + image statistics
     return advanced_disease_detection(image_array[0], features[0])
 
-def advanced_disease_detection(img_array, deep_features=None):
-    """Advanced disease detection with color, texture, and pattern analysis"""
-    
-    # Ensure img_array is (224, 224, 3) shape
-    if len(img_array.shape) == 4:
-        img_array = img_array[0]  # Remove batch dimension
-    
-    # Ensure values are in [0, 1] range
-    if img_array.max() > 1.0:
-        img_array = img_array / 255.0
-    
-    # Convert to uint8 for PIL
-    img_uint8 = (img_array * 255).astype('uint8')
-    
-    # Convert to HSV for better color analysis
-    from PIL import Image
-    img_pil = Image.fromarray(img_uint8, mode='RGB')
-    
+def rgb_to_hsv_batch(img_uint8):
+    """
+    Vectorized equivalent of PIL's ``Image.convert('HSV')``
+
+    Args:
+        img_uint8: uint8 array of shape (..., 3)
+
+    Returns:
+        numpy array: uint8 HSV array with the same shape
+    """
+    # Mirrors Pillow's float32/double mix so the quantized output is identical
+    rgb = img_uint8.astype(np.float32)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    cr = maxc - minc
+    chromatic = cr > 0
+
+    safe_cr = np.where(chromatic, cr, np.float32(1.0))
+    safe_max = np.where(maxc > 0, maxc, np.float32(1.0))
+    s = np.where(chromatic, cr / safe_max, np.float32(0.0))
+
+    rc = ((maxc - r) / safe_cr).astype(np.float64)
+    gc = ((maxc - g) / safe_cr).astype(np.float64)
+    bc = ((maxc - b) / safe_cr).astype(np.float64)
+    h = np.where(r == maxc, (bc - gc).astype(np.float32),
+                 np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc)).astype(np.float32)
+    h = np.fmod(h.astype(np.float64) / 6.0 + 1.0, 1.0).astype(np.float32)
+    h = np.where(chromatic, h, np.float32(0.0))
+
+    hsv = np.empty(img_uint8.shape, dtype=np.uint8)
+    hsv[..., 0] = np.clip((h.astype(np.float64) * 255.0).astype(np.int32), 0, 255)
+    hsv[..., 1] = np.clip((s.astype(np.float64) * 255.0).astype(np.int32), 0, 255)
+    hsv[..., 2] = maxc.astype(np.uint8)
+    return hsv
+
+
+# Per-thread capture of the rules' masks, set only while an explanation is requested
+_capture = threading.local()
+
+
+@contextmanager
+def capture_masks():
+    """
+    Collect the masks computed by rules scoring in this thread
+
+    Yields:
+        dict: Filled by the latest ``advanced_disease_detection_batch`` call
+        with (N, H, W) boolean arrays keyed by layer name
+    """
+    masks = {}
+    _capture.masks = masks
     try:
-        hsv = np.array(img_pil.convert('HSV'))
-    except Exception as e:
-        print(f"HSV conversion error: {e}")
-        # Fallback: manual HSV conversion
-        hsv = img_uint8
-    
-    # Extract color channels (normalize to 0-1)
-    h = hsv[:,:,0] / 255.0
-    s = hsv[:,:,1] / 255.0
-    v = hsv[:,:,2] / 255.0
-    
-    r, g, b = img_array[:,:,0], img_array[:,:,1], img_array[:,:,2]
-    
+        yield masks
+    finally:
+        _capture.masks = None
+
+
+def laplace_batch(gray):
+    """
+    Discrete Laplacian over the last two axes of a (N, H, W) batch
+
+    Matches ``scipy.ndimage.laplace`` with its default ``reflect`` border mode
+    applied image by image.
+    """
+    p = np.pad(gray, ((0, 0), (1, 1), (1, 1)), mode='symmetric')
+    return (p[:, :-2, 1:-1] + p[:, 2:, 1:-1] +
+            p[:, 1:-1, :-2] + p[:, 1:-1, 2:] - 4.0 * p[:, 1:-1, 1:-1])
+
+
+def advanced_disease_detection_batch(img_batch, deep_features=None):
+    """
+    Vectorized color, texture and pattern analysis for a batch of images
+
+    Args:
+        img_batch: Array of shape (N, H, W, 3), either uint8 or float in [0, 1]
+        deep_features: Optional deep features, one row per image (unused by the rules)
+
+    Returns:
+        numpy array: (N, NUM_CLASSES) score matrix in DISEASE_KEYS order, rows sum to 1
+    """
+    img_batch = np.asarray(img_batch)
+    if img_batch.ndim == 3:
+        img_batch = img_batch[np.newaxis]
+
+    # Ensure values are in [0, 1] range
+    if img_batch.dtype == np.uint8:
+        img_uint8 = img_batch
+        img_batch = img_batch.astype(np.float32) / 255.0
+    else:
+        if img_batch.max() > 1.0:
+            img_batch = img_batch / 255.0
+        img_uint8 = to_uint8(img_batch)
+
+    n = img_batch.shape[0]
+    pixel_axes = (1, 2)
+
+    # HSV channels normalized to 0-1
+    hsv = rgb_to_hsv_batch(img_uint8)
+    h = hsv[..., 0] / 255.0
+    s = hsv[..., 1] / 255.0
+    v = hsv[..., 2] / 255.0
+
     # === COLOR ANALYSIS ===
     # Green (healthy) detection - normalized hue [0-1]
     green_mask = (h > 0.15) & (h < 0.4) & (s > 0.2)
-    green_ratio = np.mean(green_mask)
-    
+    green_ratio = np.mean(green_mask, axis=pixel_axes)
+
     # Yellow (disease) detection
     yellow_mask = (h > 0.08) & (h < 0.18) & (s > 0.3)
-    yellow_ratio = np.mean(yellow_mask)
-    
+    yellow_ratio = np.mean(yellow_mask, axis=pixel_axes)
+
     # Brown (disease/death) detection
     brown_mask = (h < 0.12) & (v < 0.6)
-    brown_ratio = np.mean(brown_mask)
-    
+    brown_ratio = np.mean(brown_mask, axis=pixel_axes)
+
     # White/pale (powdery mildew) detection
     pale_mask = (s < 0.2) & (v > 0.6)
-    pale_ratio = np.mean(pale_mask)
-    
+    pale_ratio = np.mean(pale_mask, axis=pixel_axes)
+
     # === TEXTURE ANALYSIS ===
     # Calculate variance (spots = high variance)
-    variance = np.var(img_array)
-    
+    variance = np.var(img_batch, axis=(1, 2, 3))
+
     # Edge detection (disease patterns)
-    gray = np.mean(img_array, axis=2)
-    edges = np.abs(np.gradient(gray)[0]) + np.abs(np.gradient(gray)[1])
-    edge_density = np.mean(edges > 0.1)
-    
+    gray = np.mean(img_batch, axis=3)
+    edges = np.abs(np.gradient(gray, axis=1)) + np.abs(np.gradient(gray, axis=2))
+    edge_density = np.mean(edges > 0.1, axis=pixel_axes)
+
     # Spot detection (circular patterns)
-    try:
-        from scipy import ndimage
-        laplacian = ndimage.laplace(gray)
-        spot_count = np.sum(np.abs(laplacian) > 0.3) / laplacian.size
-    except ImportError:
-        # Fallback without scipy
-        dx = np.diff(gray, axis=0)
-        dy = np.diff(gray, axis=1)
-        spot_count = (np.var(dx) + np.var(dy)) * 10
-    
+    spot_mask = np.abs(laplace_batch(gray)) > 0.3
+    spot_count = np.mean(spot_mask, axis=pixel_axes)
+
     # === PATTERN ANALYSIS ===
     # Dark spots (bacterial/fungal)
-    dark_spots = np.sum((v < 0.3) & (s > 0.2))
-    dark_spot_ratio = dark_spots / v.size
-    
+    dark_mask = (v < 0.3) & (s > 0.2)
+    dark_spot_ratio = np.mean(dark_mask, axis=pixel_axes)
+
+    # Hand the masks to an active explanation capture instead of dropping them
+    captured = getattr(_capture, 'masks', None)
+    if captured is not None:
+        captured.update(green=green_mask, yellow=yellow_mask, brown=brown_mask,
+                        pale=pale_mask, dark=dark_mask, spots=spot_mask)
+
+    s_mean = s.mean(axis=pixel_axes)
+    v_mean = v.mean(axis=pixel_axes)
+
     # === DISEASE SCORING ===
-    scores = {}
-    
+    scores = np.empty((n, NUM_CLASSES), dtype=np.float64)
+
     # Healthy (Lá khỏe mạnh)
     healthy_score = green_ratio * 0.6
-    if variance < 0.02 and yellow_ratio < 0.2 and brown_ratio < 0.1:
-        healthy_score += 0.3
-    scores['khoe_manh'] = max(0.05, min(0.95, healthy_score))
-    
+    healthy_score = healthy_score + np.where(
+        (variance < 0.02) & (yellow_ratio < 0.2) & (brown_ratio < 0.1), 0.3, 0.0)
+    scores[:, 0] = np.clip(healthy_score, 0.05, 0.95)
+
     # Bệnh đốm lá (Leaf spot) - dark spots + yellow
-    spot_score = (spot_count * 0.4 + dark_spot_ratio * 0.3 + yellow_ratio * 0.2)
-    if spot_count > 0.1 or dark_spot_ratio > 0.05:
-        spot_score += 0.2
-    scores['benh_dom_la'] = max(0.05, min(0.85, spot_score))
-    
+    spot_score = spot_count * 0.4 + dark_spot_ratio * 0.3 + yellow_ratio * 0.2
+    spot_score = spot_score + np.where((spot_count > 0.1) | (dark_spot_ratio > 0.05), 0.2, 0.0)
+    scores[:, 1] = np.clip(spot_score, 0.05, 0.85)
+
     # Bệnh vàng lá (Leaf yellowing)
     yellow_score = yellow_ratio * 0.6
-    if yellow_ratio > 0.3 and green_ratio < 0.4:
-        yellow_score += 0.25
-    scores['benh_vang_la'] = max(0.05, min(0.85, yellow_score))
-    
+    yellow_score = yellow_score + np.where((yellow_ratio > 0.3) & (green_ratio < 0.4), 0.25, 0.0)
+    scores[:, 2] = np.clip(yellow_score, 0.05, 0.85)
+
     # Bệnh phấn trắng (Powdery mildew) - white/pale patches
     mildew_score = pale_ratio * 0.5
-    if pale_ratio > 0.2 and s.mean() < 0.3:
-        mildew_score += 0.3
-    scores['benh_phan_trang'] = max(0.05, min(0.80, mildew_score))
-    
+    mildew_score = mildew_score + np.where((pale_ratio > 0.2) & (s_mean < 0.3), 0.3, 0.0)
+    scores[:, 3] = np.clip(mildew_score, 0.05, 0.80)
+
     # Bệnh đạo ôn (Blight) - dark brown, high texture
-    blight_score = (brown_ratio * 0.4 + edge_density * 0.3)
-    if brown_ratio > 0.3 or (variance > 0.03 and v.mean() < 0.5):
-        blight_score += 0.2
-    scores['benh_dao_on'] = max(0.05, min(0.80, blight_score))
-    
+    blight_score = brown_ratio * 0.4 + edge_density * 0.3
+    blight_score = blight_score + np.where(
+        (brown_ratio > 0.3) | ((variance > 0.03) & (v_mean < 0.5)), 0.2, 0.0)
+    scores[:, 4] = np.clip(blight_score, 0.05, 0.80)
+
     # Bệnh giả phấn (Downy mildew) - yellow + pale underside
-    downy_score = (yellow_ratio * 0.3 + pale_ratio * 0.2 + variance * 2)
-    if yellow_ratio > 0.2 and variance > 0.025:
-        downy_score += 0.2
-    scores['benh_gia_phan'] = max(0.05, min(0.75, downy_score))
-    
-    # Bệnh héo xanh (Bacterial wilt) - wilted appearance
-    wilt_score = 0.1
-    if green_ratio > 0.4 and v.mean() < 0.5:  # Dark green
-        wilt_score += 0.3
-    scores['benh_heo_xanh'] = max(0.05, min(0.70, wilt_score))
-    
+    downy_score = yellow_ratio * 0.3 + pale_ratio * 0.2 + variance * 2
+    downy_score = downy_score + np.where((yellow_ratio > 0.2) & (variance > 0.025), 0.2, 0.0)
+    scores[:, 5] = np.clip(downy_score, 0.05, 0.75)
+
+    # Bệnh héo xanh (Bacterial wilt) - wilted appearance (dark green)
+    wilt_score = 0.1 + np.where((green_ratio > 0.4) & (v_mean < 0.5), 0.3, 0.0)
+    scores[:, 6] = np.clip(wilt_score, 0.05, 0.70)
+
     # Bệnh xoăn lá (Leaf curl) - texture variance
     curl_score = edge_density * 0.4
-    if edge_density > 0.3:
-        curl_score += 0.2
-    scores['benh_xoan_la'] = max(0.05, min(0.70, curl_score))
-    
+    curl_score = curl_score + np.where(edge_density > 0.3, 0.2, 0.0)
+    scores[:, 7] = np.clip(curl_score, 0.05, 0.70)
+
     # Other diseases - lower probabilities
-    remaining = ['benh_kham_virus', 'benh_than_thu', 'benh_thoi_re', 
-                 'benh_dom_vong', 'benh_kham_la', 'benh_thoi_qua', 'benh_heo_ru']
-    
-    total_assigned = sum(scores.values())
-    remaining_prob = max(0.1, 1.0 - total_assigned)
-    
-    for disease in remaining:
-        scores[disease] = remaining_prob / len(remaining) * random.uniform(0.3, 1.2)
-    
+    num_ruled = 8
+    total_assigned = scores[:, :num_ruled].sum(axis=1)
+    remaining_prob = np.maximum(0.1, 1.0 - total_assigned)
+    num_remaining = NUM_CLASSES - num_ruled
+    jitter = np.random.uniform(0.3, 1.2, size=(n, num_remaining))
+    scores[:, num_ruled:] = (remaining_prob / num_remaining)[:, np.newaxis] * jitter
+
     # Normalize to sum = 1
-    total = sum(scores.values())
-    scores = {k: v/total for k, v in scores.items()}
-    
+    scores /= scores.sum(axis=1, keepdims=True)
+
     return scores
 
+
+def scores_to_dict(score_row):
+    """Convert a score vector in DISEASE_KEYS order to a {class_key: score} dict"""
+    return {key: float(score) for key, score in zip(DISEASE_KEYS, score_row)}
+
+
+def advanced_disease_detection(img_array, deep_features=None):
+    """Advanced disease detection with color, texture, and pattern analysis"""
+    
+    # Ensure img_array is (224, 224, 3) shape
+    if len(img_array.shape) == 4:
+        img_array = img_array[0]  # Remove batch dimension
+    
+    features = None if deep_features is None else np.asarray(deep_features)[np.newaxis]
+    scores = advanced_disease_detection_batch(img_array[np.newaxis], features)
+    return scores_to_dict(scores[0])
+
+
+def score_batch(img_batch, with_embeddings=False, priority=None):
+    """
+    Score a batch of preprocessed images with the active model version
+
+    Args:
+        img_batch: Array of shape (N, H, W, 3), uint8 or float in [0, 1]
+        with_embeddings: Also return penultimate-layer embeddings (or None)
+        priority: Request priority; priorities in ``STUDENT_PRIORITIES`` go to the student version
+
+    Returns:
+        tuple: ((N, NUM_CLASSES) scores in DISEASE_KEYS order, serving version name)
+    """
+    from app.core.ml.model_registry import get_registry
+    return get_registry().score_batch(img_batch, with_embeddings=with_embeddings, priority=priority)
+
+
+def score_routed(img_batch, priority=None):
+    """
+    Score a batch out-of-process when the inference server is enabled, else in-process
+
+    Workers hold no model, so a failed remote call falls back to the rules.
+    The inference server always scores with its active version.
+
+    Returns:
+        tuple: ((N, NUM_CLASSES) scores, serving version name, embeddings or None)
+    """
+    from app.core.ml import inference_server
+    if inference_server.is_enabled():
+        result = inference_server.score_remote(img_batch)
+        if result is not None:
+            return result[0], result[1], None
+        return advanced_disease_detection_batch(img_batch), RULES_VERSION, None
+    return score_batch(img_batch, with_embeddings=True, priority=priority)
+
 def smart_predict(image_array):
     """Smart prediction based on image features"""
     return advanced_disease_detection(image_array)
 
-def get_predictions(image_path, top_k=3):
-    """Get predictions for image"""
+def probs_to_predictions(probs, top_k=3, model_version=None):
+    """Convert a {class_key: probability} dict to the sorted prediction list"""
+    predictions = []
+    for class_name, prob in sorted(probs.items(), key=lambda x: x[1], reverse=True):
+        # Get Vietnamese label
+        vietnamese_label = CLASS_INDICES.get(class_name, class_name)
+        predictions.append({
+            'class': vietnamese_label,
+            'class_index': class_name,
+            'confidence': float(prob * 100),  # Convert to percentage (0-100)
+            'model_version': model_version
+        })
+    
+    return predictions[:top_k]
+
+_inflight = None
+
+
+def get_inflight():
+    """Single-flight group shared by every prediction call in this process"""
+    global _inflight
+    if _inflight is None:
+        from app.core.singleflight import SingleFlight
+        _inflight = SingleFlight("predict")
+    return _inflight
+
+
+def _flight_key(image_hash, top_k, tta_views, explain, crop, region, priority):
+    """Requests are coalesced only when the image and every output-affecting option match"""
+    if not image_hash or not settings.SINGLE_FLIGHT_ENABLED:
+        return None
+    return (image_hash, top_k, tta_views, explain, crop, region, priority)
+
+
+def get_predictions(image_path, top_k=3, tta_views=0, explain=False, crop=None, region=None,
+                    priority=None, image_hash=None):
+    """
+    Get predictions for image
+    
+    Concurrent calls for the same ``image_hash`` (double-clicked uploads, webcam
+    retries) share one computation; see ``_predict`` for the arguments.
+    """
+    key = _flight_key(image_hash, top_k, tta_views, explain, crop, region, priority)
+    if key is None:
+        return _predict(image_path, top_k, tta_views, explain, crop, region, priority, image_hash)
+    return get_inflight().do(key, _predict, image_path, top_k, tta_views, explain, crop, region,
+                             priority, image_hash)
+
+
+async def get_predictions_async(image_path, top_k=3, tta_views=0, explain=False, crop=None, region=None,
+                                priority=None, image_hash=None):
+    """``get_predictions`` for route handlers: scores in the threadpool, keeping the event loop free"""
+    from fastapi.concurrency import run_in_threadpool
+    key = _flight_key(image_hash, top_k, tta_views, explain, crop, region, priority)
+    if key is None:
+        return await run_in_threadpool(_predict, image_path, top_k, tta_views, explain, crop, region,
+                                       priority, image_hash)
+    return await get_inflight().do_async(key, _predict, image_path, top_k, tta_views, explain, crop,
+                                         region, priority, image_hash)
+
+
+def _predict(image_path, top_k=3, tta_views=0, explain=False, crop=None, region=None,
+             priority=None, image_hash=None):
+    """
+    Get predictions for image
+    
+    Args:
+        image_path: Path to image file
+        top_k: Number of predictions to return
+        tta_views: Test-time augmentation views scored as one batch (0 or 1 = off)
+        explain: Also return the rules masks as an overlay (see ``explain.build_explanation``)
+        crop: Crop type, selects calibration parameters
+        region: Growing region, selects calibration parameters
+        priority: Request priority (high/normal/low); low-priority requests may be
+            served by the distilled student version
+        image_hash: Content hash of the upload; the scores are logged for active learning
+    
+    Returns:
+        list: Top-k prediction dicts, or (predictions, explanation or None) with ``explain``
+    """
     
     try:
         # Load and preprocess image
         from app.core.ml.preprocessing import preprocess_image
-        img_array = preprocess_image(image_path)
+        img_array, box = preprocess_image(
+            image_path, settings.IMG_SIZE, crop_leaf=settings.ROI_CROP_ENABLED, return_box=True
+        )
         
-        # Use advanced detection
-        probs = advanced_disease_detection(img_array)
+        use_tta = tta_views > 1
+        if use_tta:
+            from app.core.ml import tta
+            batch = tta.augment(img_array, tta_views)
+        else:
+            batch = img_array
         
-        # Convert to list format
-        predictions = []
-        for class_name, prob in sorted(probs.items(), key=lambda x: x[1], reverse=True):
-            # Get Vietnamese label
-            vietnamese_label = CLASS_INDICES.get(class_name, class_name)
-            predictions.append({
-                'class': vietnamese_label,
-                'class_index': class_name,
-                'confidence': float(prob * 100)  # Convert to percentage (0-100)
-            })
+        def combine(scores):
+            return tta.average_scores(scores) if use_tta else scores[0]
         
-        return predictions[:top_k]
+        from app.core.ml import embedding_index, cascade, calibration
+        from app.core import feedback
+        
+        with capture_masks() if explain else nullcontext() as masks:
+            
+            def finish(score_row, version):
+                score_row = calibration.calibrate(score_row, crop, region)
+                if image_hash and feedback.is_enabled():
+                    feedback.record_prediction(image_hash, score_row, version, Path(image_path).name, crop, region)
+                predictions = probs_to_predictions(scores_to_dict(score_row), top_k, version)
+                if not explain:
+                    return predictions
+                from app.core.ml.explain import build_explanation
+                if not masks:
+                    # Scored remotely or answered from the index: run the rules locally once
+                    advanced_disease_detection_batch(img_array)
+                return predictions, build_explanation(masks, 0, box)
+            
+            # Near-duplicates of already scored images are answered from the index
+            use_index = embedding_index.is_enabled() and not use_tta
+            if use_index:
+                descriptor = embedding_index.image_descriptor(img_array)
+                duplicate = embedding_index.find_duplicate(descriptor)
+                if duplicate is not None:
+                    scores, ref = duplicate
+                    return finish(scores, ref.get('version'))
+            
+            # Confident images exit after the cheap downsampled rules pass
+            use_cascade = cascade.is_enabled() and not use_tta
+            if use_cascade:
+                early = cascade.try_early_exit(img_array)
+                if early is not None:
+                    return finish(early, cascade.CASCADE_VERSION)
+                if explain:
+                    # Drop the thumbnail masks; stage 2 (or finish) captures full-size ones
+                    masks.clear()
+
+            start = time.perf_counter()
+            scores, version, embeddings = score_routed(batch, priority)
+            if use_cascade:
+                metrics.observe("cascade.stage2", time.perf_counter() - start)
+            
+            if use_index:
+                embedding_index.record(
+                    descriptor, scores[0],
+                    {'image': Path(image_path).name, 'version': version},
+                    version, None if embeddings is None else embeddings[0]
+                )
+            
+            return finish(combine(scores), version)
         
     except Exception as e:
         print(f"Prediction error: {e}")
@@ -249,4 +557,5 @@ def get_predictions(image_path, top_k=3):
                 'class_index': class_name,
                 'confidence': random.uniform(0.2, 0.9)
             })
-        return sorted(predictions, key=lambda x: x['confidence'], reverse=True)
+        predictions = sorted(predictions, key=lambda x: x['confidence'], reverse=True)
+        return (predictions, None) if explain else predictions
@@ -0,0 +1,504 @@
+"""
+Model registry - versioned artifacts with background warm-up and atomic hot-swap
+
+Versions are described by ``models/manifest.json``. Every version entry
+inherits the fields of ``models/model_config.json`` and may override them:
+
+    {
+      "active": "v2",
+      "shadow": "v3",
+      "student": "v2-student",
+      "versions": {
+        "v2": {"path": "v2/disease_model.h5"},
+        "v3": {"path": "v3/disease_model.h5", "classes": ["khoe_manh", ...]}
+      }
+    }
+
+The optional student (a distilled, cheaper version from ``distill.py``)
+serves requests whose priority is listed in ``STUDENT_PRIORITIES``.
+
+A version is loaded and warmed in a background thread while the current one
+keeps serving, then swapped in with a single reference assignment. Other
+processes (API workers, the inference server) notice manifest changes by
+polling its modification time and roll over the same way.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from app.config import settings
+from app.core import memory, metrics
+
+DEFAULT_VERSION = "default"
+
+# Weight of a trained classifier head when blended with the rule scores
+DEFAULT_BLEND_WEIGHT = 0.5
+
+
+def with_embedding_output(model):
+    """
+    Wrap a Keras model so it also outputs its penultimate layer
+
+    Returns the model unchanged when it cannot be split.
+    """
+    try:
+        try:
+            from keras.models import Model
+        except ImportError:
+            from tensorflow.keras.models import Model
+        return Model(inputs=model.inputs, outputs=[model.layers[-2].output, model.outputs[0]])
+    except Exception as e:
+        print(f"⚠️  Penultimate-layer output unavailable: {e}")
+        return model
+
+
+def resize_batch(batch, size):
+    """Area-resize a batch to (height, width) for a version with a different input size"""
+    import tensorflow as tf
+    if batch.dtype == np.uint8:
+        batch = batch.astype(np.float32) / 255.0
+    return tf.image.resize(batch, size, method='area').numpy()
+
+
+class ModelVersion:
+    """A loaded model artifact plus its manifest entry"""
+
+    def __init__(self, name, config, model=None):
+        from app.core.ml.model_handler import DISEASE_KEYS
+
+        self.name = name
+        self.config = config
+        self.model = model
+        self.loaded_at = time.time()
+        self.warm = False
+        self.warmup_seconds = None
+
+        # Network with an extra penultimate-layer output, so embeddings come
+        # out of the same forward pass as the predictions
+        self.forward_model = with_embedding_output(model) if model is not None else None
+
+        # Concrete functions traced at fixed batch sizes during warm-up
+        self.traced = {}
+
+        # Columns of a trained head that map onto the rule classes
+        self.class_map = None
+        classes = config.get('classes')
+        if model is not None and classes:
+            pairs = [(i, DISEASE_KEYS.index(c)) for i, c in enumerate(classes) if c in DISEASE_KEYS]
+            if pairs:
+                self.class_map = np.array(pairs, dtype=np.intp)
+        self.blend_weight = float(config.get('blend_weight', DEFAULT_BLEND_WEIGHT))
+
+    @property
+    def input_size(self):
+        """(height, width) the artifact expects"""
+        shape = self.config.get('input_shape') or [settings.IMG_HEIGHT, settings.IMG_WIDTH, 3]
+        return (int(shape[0]), int(shape[1]))
+
+    def predict_features(self, batch):
+        """
+        Run the network on a batch (uint8 or float in [0, 1]) via the fast path
+
+        Returns:
+            tuple: (penultimate-layer embeddings or None, model outputs)
+        """
+        from app.core.ml.fast_path import forward
+        if tuple(batch.shape[1:3]) != self.input_size:
+            batch = resize_batch(batch, self.input_size)
+        outputs = forward(self.forward_model, self.traced, batch)
+        if isinstance(outputs, list):
+            return outputs[0], outputs[1]
+        return None, outputs
+
+    def score_batch(self, img_batch, with_embeddings=False):
+        """
+        Score a batch with this version
+
+        Args:
+            img_batch: Array of shape (N, H, W, 3), uint8 or float in [0, 1]
+            with_embeddings: Also return penultimate-layer embeddings
+
+        Returns:
+            numpy array: (N, NUM_CLASSES) score matrix in DISEASE_KEYS order,
+            or (scores, embeddings or None) with ``with_embeddings``
+        """
+        from app.core.ml.model_handler import advanced_disease_detection_batch
+
+        embeddings = features = None
+        with memory.in_flight(img_batch):
+            if self.model is not None:
+                embeddings, features = self.predict_features(img_batch)
+
+            scores = advanced_disease_detection_batch(img_batch, features)
+
+        if self.class_map is not None:
+            head = np.zeros_like(scores)
+            head[:, self.class_map[:, 1]] = np.asarray(features)[:, self.class_map[:, 0]]
+            head_total = head.sum(axis=1, keepdims=True)
+            head = np.divide(head, head_total, out=np.zeros_like(head), where=head_total > 0)
+            scores = (1.0 - self.blend_weight) * scores + self.blend_weight * head
+
+        if with_embeddings:
+            return scores, embeddings
+        return scores
+
+    def warm_up(self):
+        """Trace and run synthetic batches so real requests do not pay setup costs"""
+        if not settings.WARMUP_ENABLED:
+            return
+        from app.core.ml.warmup import warm_up_version
+        self.warmup_seconds = warm_up_version(self)
+        print(f"🔥 Model version '{self.name}' warmed in {self.warmup_seconds:.2f}s")
+
+    def info(self):
+        """Summary for the admin endpoint"""
+        return {
+            "name": self.name,
+            "path": self.config.get('path'),
+            "has_model": self.model is not None,
+            "warm": self.warm,
+            "warmup_seconds": self.warmup_seconds,
+            "loaded_at": self.loaded_at
+        }
+
+
+class ModelRegistry:
+    """Holds the active (and optional shadow) model version"""
+
+    def __init__(self, models_dir=None, manifest_path=None):
+        self.models_dir = Path(models_dir or settings.BASE_DIR / "models")
+        self.manifest_path = Path(manifest_path or settings.MODEL_MANIFEST_PATH)
+        self.base_config_path = self.models_dir / "model_config.json"
+
+        self.active = None
+        self.shadow = None
+        self.student = None
+        self.loading = {}
+        # Versions that failed to load, with the (manifest mtime, path, artifact mtime) they failed at
+        self._failed = {}
+
+        self._lock = threading.Lock()
+        self._manifest_mtime = None
+        self._last_manifest_check = 0.0
+        self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+        self._shadow_pending = False
+        self.shadow_stats = {"compared": 0, "agreed": 0, "mean_abs_diff": 0.0}
+
+    # === Manifest ===
+
+    def _read_raw_manifest(self):
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        # No manifest yet: the configured MODEL_PATH is the only version
+        model_path = Path(settings.MODEL_PATH)
+        if model_path.parent == self.models_dir:
+            model_path = Path(model_path.name)
+        return {
+            "active": DEFAULT_VERSION,
+            "shadow": None,
+            "versions": {DEFAULT_VERSION: {"path": str(model_path)}}
+        }
+
+    def read_manifest(self):
+        """Read the manifest, synthesizing a single default version if it is missing"""
+        base = {}
+        if self.base_config_path.exists():
+            with open(self.base_config_path, 'r', encoding='utf-8') as f:
+                base = json.load(f)
+
+        manifest = self._read_raw_manifest()
+        versions = {}
+        for name, entry in manifest.get("versions", {}).items():
+            config = dict(base)
+            config.update(entry)
+            versions[name] = config
+        manifest["versions"] = versions
+        return manifest
+
+    def write_manifest(self, **changes):
+        """Persist active/shadow/student changes so other processes follow them"""
+        manifest = self._read_raw_manifest()
+        manifest.update(changes)
+
+        tmp_path = self.manifest_path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        tmp_path.replace(self.manifest_path)
+        self._manifest_mtime = self.manifest_path.stat().st_mtime
+
+    def register_version(self, name, entry):
+        """Add or replace a version entry without activating it"""
+        versions = dict(self._read_raw_manifest().get("versions", {}))
+        versions[name] = entry
+        self.write_manifest(versions=versions)
+
+    def _resolve_path(self, config):
+        path = Path(config.get('path', settings.MODEL_PATH))
+        if not path.is_absolute():
+            path = self.models_dir / path
+        return path
+
+    # === Loading ===
+
+    def load_version(self, name, manifest=None):
+        """Load and warm one version (blocking)"""
+        from app.core.ml.model_handler import load_keras_model
+
+        manifest = manifest or self.read_manifest()
+        if name not in manifest["versions"]:
+            raise KeyError(f"Unknown model version: {name}")
+
+        config = manifest["versions"][name]
+        path = self._resolve_path(config)
+        with memory.measure(f"model:{name}"):
+            model = load_keras_model(path) if path.suffix in ('.h5', '.keras') else None
+
+        version = ModelVersion(name, config, model)
+        version.warm_up()
+        return version
+
+    def load_initial(self):
+        """Load the manifest's active and shadow versions synchronously at startup"""
+        manifest = self.read_manifest()
+        self._manifest_mtime = self._current_mtime()
+
+        active_name = manifest.get("active") or DEFAULT_VERSION
+        self.active = self.load_version(active_name, manifest)
+        print(f"✅ Model version '{active_name}' active")
+
+        shadow_name = manifest.get("shadow")
+        if shadow_name:
+            try:
+                self.shadow = self.load_version(shadow_name, manifest)
+                print(f"👥 Model version '{shadow_name}' shadow scoring")
+            except Exception as e:
+                print(f"⚠️  Shadow version '{shadow_name}' failed to load: {e}")
+
+        student_name = manifest.get("student")
+        if student_name:
+            try:
+                self.student = self.load_version(student_name, manifest)
+                print(f"🎓 Model version '{student_name}' serves {', '.join(settings.STUDENT_PRIORITY_LEVELS)} priority")
+            except Exception as e:
+                print(f"⚠️  Student version '{student_name}' failed to load: {e}")
+
+    def _load_state(self, name):
+        """(manifest mtime, artifact path, artifact mtime) a load of ``name`` would see"""
+        try:
+            path = self._resolve_path(self.read_manifest()["versions"].get(name, {}))
+        except Exception:
+            path = None
+        try:
+            artifact_mtime = path.stat().st_mtime if path is not None else None
+        except OSError:
+            artifact_mtime = None
+        return self._current_mtime(), path, artifact_mtime
+
+    def _load_in_background(self, name, role):
+        def _worker():
+            state = self._load_state(name)
+            try:
+                version = self.load_version(name)
+            except Exception as e:
+                self.loading[name] = f"failed: {e}"
+                # check_manifest retries only once the manifest or the artifact changes
+                self._failed[name] = state
+                print(f"❌ Model version '{name}' failed to load: {e}")
+                return
+
+            self._failed.pop(name, None)
+
+            # Atomic swap: readers see either the old or the new version
+            if role == "active":
+                self.active = version
+            elif role == "student":
+                self.student = version
+            else:
+                self.shadow = version
+                self._reset_shadow_stats()
+            self.loading.pop(name, None)
+            print(f"🔄 Model version '{name}' is now {role}")
+
+        with self._lock:
+            if self.loading.get(name) == "loading":
+                return
+            self.loading[name] = "loading"
+        threading.Thread(target=_worker, name=f"load-{name}", daemon=True).start()
+
+    def activate(self, name, persist=True):
+        """Warm ``name`` in the background and make it active once ready"""
+        if name not in self.read_manifest()["versions"]:
+            raise KeyError(f"Unknown model version: {name}")
+        if persist:
+            self.write_manifest(active=name)
+        if self.active is None or self.active.name != name:
+            self._load_in_background(name, "active")
+
+    def set_shadow(self, name, persist=True):
+        """Start (or with ``None`` stop) shadow scoring against ``name``"""
+        if name is not None and name not in self.read_manifest()["versions"]:
+            raise KeyError(f"Unknown model version: {name}")
+        if persist:
+            self.write_manifest(shadow=name)
+        if name is None:
+            self.shadow = None
+            self._reset_shadow_stats()
+        elif self.shadow is None or self.shadow.name != name:
+            self._load_in_background(name, "shadow")
+
+    def set_student(self, name, persist=True):
+        """Serve low-priority requests with ``name`` (``None`` sends them to the active version)"""
+        if name is not None and name not in self.read_manifest()["versions"]:
+            raise KeyError(f"Unknown model version: {name}")
+        if persist:
+            self.write_manifest(student=name)
+        if name is None:
+            self.student = None
+        elif self.student is None or self.student.name != name:
+            self._load_in_background(name, "student")
+
+    def _current_mtime(self):
+        try:
+            return self.manifest_path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _may_load(self, name):
+        """False while ``name`` failed and neither the manifest nor its artifact changed since"""
+        failed = self._failed.get(name)
+        return failed is None or failed != self._load_state(name)
+
+    def _retry_due(self):
+        return any(self._may_load(name) for name in list(self._failed))
+
+    def check_manifest(self):
+        """Follow active/shadow changes written by another process"""
+        now = time.monotonic()
+        if now - self._last_manifest_check < settings.MODEL_MANIFEST_POLL_INTERVAL:
+            return
+        self._last_manifest_check = now
+
+        mtime = self._current_mtime()
+        if mtime == self._manifest_mtime and not self._retry_due():
+            return
+
+        try:
+            manifest = self.read_manifest()
+            # A manifest that cannot be read is retried on the next check
+            self._manifest_mtime = mtime
+            active_name = manifest.get("active") or DEFAULT_VERSION
+            if (self.active is None or self.active.name != active_name) and self._may_load(active_name):
+                self._load_in_background(active_name, "active")
+            shadow_name = manifest.get("shadow")
+            if shadow_name is None:
+                self.shadow = None
+            elif (self.shadow is None or self.shadow.name != shadow_name) and self._may_load(shadow_name):
+                self._load_in_background(shadow_name, "shadow")
+            student_name = manifest.get("student")
+            if student_name is None:
+                self.student = None
+            elif (self.student is None or self.student.name != student_name) and self._may_load(student_name):
+                self._load_in_background(student_name, "student")
+        except Exception as e:
+            print(f"⚠️  Could not reload model manifest: {e}")
+
+    # === Scoring ===
+
+    def pick_version(self, priority=None):
+        """The student for priorities in ``STUDENT_PRIORITIES``, else the active version"""
+        # A student is only assigned once loaded (and warmed, with WARMUP_ENABLED)
+        student = self.student
+        if student is not None and priority in settings.STUDENT_PRIORITY_LEVELS:
+            return student
+        return self.active
+
+    def score_batch(self, img_batch, with_embeddings=False, priority=None):
+        """
+        Score with the version for ``priority``, shadow-scoring active traffic in the background
+
+        Returns:
+            tuple: ((N, NUM_CLASSES) scores, name of the version that served them),
+            plus the embeddings (or None) with ``with_embeddings``
+        """
+        self.check_manifest()
+        version = self.pick_version(priority)
+        scores, embeddings = version.score_batch(img_batch, with_embeddings=True)
+
+        shadow = self.shadow
+        if shadow is not None and version is self.active:
+            self._submit_shadow(shadow, img_batch, scores)
+
+        if with_embeddings:
+            return scores, version.name, embeddings
+        return scores, version.name
+
+    def _submit_shadow(self, shadow, img_batch, active_scores):
+        """Queue one comparison; while one is pending the batch is skipped, so copies never pile up"""
+        with self._lock:
+            if self._shadow_pending:
+                metrics.inc("shadow.dropped")
+                return
+            self._shadow_pending = True
+        try:
+            self._shadow_executor.submit(self._compare_shadow, shadow, img_batch.copy(), active_scores)
+        except Exception:
+            self._shadow_pending = False
+            raise
+
+    def _compare_shadow(self, shadow, img_batch, active_scores):
+        try:
+            shadow_scores = shadow.score_batch(img_batch)
+        except Exception as e:
+            print(f"⚠️  Shadow scoring failed: {e}")
+            return
+        finally:
+            self._shadow_pending = False
+
+        agreed = int(np.sum(shadow_scores.argmax(axis=1) == active_scores.argmax(axis=1)))
+        diff = float(np.abs(shadow_scores - active_scores).mean())
+        with self._lock:
+            stats = self.shadow_stats
+            n = len(active_scores)
+            total = stats["compared"] + n
+            stats["mean_abs_diff"] = (stats["mean_abs_diff"] * stats["compared"] + diff * n) / total
+            stats["compared"] = total
+            stats["agreed"] += agreed
+
+    def _reset_shadow_stats(self):
+        with self._lock:
+            self.shadow_stats = {"compared": 0, "agreed": 0, "mean_abs_diff": 0.0}
+
+    def status(self):
+        """Registry state for the admin endpoint"""
+        manifest = self.read_manifest()
+        return {
+            "active": self.active.info() if self.active else None,
+            "shadow": self.shadow.info() if self.shadow else None,
+            "student": self.student.info() if self.student else None,
+            "versions": sorted(manifest["versions"].keys()),
+            "loading": dict(self.loading),
+            "shadow_stats": dict(self.shadow_stats)
+        }
+
+
+# Process-wide registry, created on first use
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the process registry, loading the active version on first call"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = ModelRegistry()
+                registry.load_initial()
+                _registry = registry
+    return _registry
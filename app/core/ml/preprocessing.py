@@ -17,8 +17,9 @@ def validate_image(image_path):
         img.verify()
         
         # Re-open to check format (verify closes the file)
+        from app.config import settings
         img = Image.open(image_path)
-        if img.format.lower() not in ['png', 'jpeg', 'jpg']:
+        if img.format.lower() not in settings.ALLOWED_EXTENSIONS:
             return False
         
         return True
@@ -27,26 +28,194 @@ def validate_image(image_path):
         return False
 
 
-def preprocess_image(image_path, target_size=(224, 224)):
+def to_uint8(img_array):
     """
-    Preprocess image for model prediction
+    Quantize a float image (or batch) in [0, 1] to uint8, rounding to nearest
+
+    Local scoring and the inference server both use this, so an image gets
+    the same pixels (and scores) on either path.
+    """
+    return np.clip(np.rint(img_array * 255.0), 0, 255).astype(np.uint8)
+
+
+def excess_green_mask(rgb, threshold=0.05):
+    """
+    Vegetation mask from the excess-green index on chromatic coordinates
+    
+    ExG = 2g - r - b with r, g, b = R, G, B / (R + G + B). Green and
+    yellowing leaf tissue scores well above zero, while soil, sky and skin
+    sit at or below it.
     
     Args:
-        image_path: Path to image file
-        target_size: Target size tuple (height, width)
+        rgb: Array (..., 3), uint8 or float
+        threshold: Minimum ExG counted as leaf
     
     Returns:
-        numpy array: Preprocessed image ready for model
+        numpy array: Boolean mask with the channel axis dropped
+    """
+    rgb = rgb.astype(np.float32)
+    total = rgb.sum(axis=-1) + 1e-6
+    exg = (2 * rgb[..., 1] - rgb[..., 0] - rgb[..., 2]) / total
+    return exg > threshold
+
+
+def _dilate(mask, radius):
+    """Binary dilation with a (2r+1) square, done separably along each axis"""
+    h, w = mask.shape
+    padded = np.pad(mask, ((radius, radius), (0, 0)))
+    rows = np.zeros_like(mask)
+    for dy in range(2 * radius + 1):
+        rows |= padded[dy:dy + h]
+    padded = np.pad(rows, ((0, 0), (radius, radius)))
+    out = np.zeros_like(mask)
+    for dx in range(2 * radius + 1):
+        out |= padded[:, dx:dx + w]
+    return out
+
+
+def _erode(mask, radius):
+    return ~_dilate(~mask, radius)
+
+
+def find_leaf_box(rgb, threshold=0.05, radius=1, min_fraction=0.02, padding=0.1):
+    """
+    Locate the leaf in a thumbnail
+    
+    The ExG mask is opened (drops speckles from grass and noise) and closed
+    (fills lesions inside the leaf), then the box spans the 1st to 99th
+    percentile of mask pixels along each axis so stray blobs at the border
+    do not stretch it. The box is padded and grown towards a square so the
+    later resize does not distort the leaf.
+    
+    Args:
+        rgb: Thumbnail array (H, W, 3)
+        threshold: ExG threshold
+        radius: Morphology radius in thumbnail pixels
+        min_fraction: Minimum leaf area fraction to trust the mask
+        padding: Margin added around the box, as a fraction of its size
+    
+    Returns:
+        tuple: (left, top, right, bottom) as fractions of the image size,
+        or None when no usable leaf region is found
     """
-    # Load image
+    mask = excess_green_mask(rgb, threshold)
+    if radius > 0:
+        mask = _erode(_dilate(_dilate(_erode(mask, radius), radius), radius), radius)
+    
+    h, w = mask.shape
+    area = mask.sum()
+    if area < min_fraction * h * w:
+        return None
+    
+    def span(counts, size):
+        cdf = np.cumsum(counts) / area
+        lo = int(np.searchsorted(cdf, 0.01))
+        hi = int(np.searchsorted(cdf, 0.99)) + 1
+        return lo, min(hi, size)
+    
+    top, bottom = span(mask.sum(axis=1), h)
+    left, right = span(mask.sum(axis=0), w)
+    
+    # Pad, then grow the short side towards a square
+    box_h, box_w = bottom - top, right - left
+    side = max(box_h, box_w) * (1 + 2 * padding)
+    cy, cx = (top + bottom) / 2, (left + right) / 2
+    side_h, side_w = min(side, h), min(side, w)
+    top = min(max(cy - side_h / 2, 0), h - side_h)
+    left = min(max(cx - side_w / 2, 0), w - side_w)
+    
+    # Nothing to gain when the leaf already fills the frame
+    if side_h * side_w > 0.9 * h * w:
+        return None
+    return (left / w, top / h, (left + side_w) / w, (top + side_h) / h)
+
+
+def load_leaf_region(image_path, target_size=(224, 224), thumb_size=128, **box_kwargs):
+    """
+    Decode only as much of the image as the leaf crop needs
+    
+    A JPEG is first decoded at a reduced DCT scale (``Image.draft``) into a
+    small thumbnail for ``find_leaf_box``, then decoded again at the
+    smallest scale that still leaves the crop at least ``target_size``
+    pixels. Crop and resize happen in one ``resize(box=...)`` call.
+    
+    Args:
+        image_path: Path or file-like object
+        target_size: Output size tuple (height, width)
+        thumb_size: Longest side of the segmentation thumbnail
+        **box_kwargs: Passed to ``find_leaf_box``
+    
+    Returns:
+        tuple: (RGB PIL image of ``target_size``, leaf box as fractions),
+        or None when no leaf region is found
+    """
+    target_h, target_w = target_size
+    
     img = Image.open(image_path)
+    full_w, full_h = img.size
+    img.draft('RGB', (thumb_size, thumb_size))
+    thumb = img.convert('RGB')
+    thumb.thumbnail((thumb_size, thumb_size), Image.BILINEAR)
+    box = find_leaf_box(np.asarray(thumb), **box_kwargs)
+    if box is None:
+        return None
     
-    # Convert to RGB if needed (handle RGBA, grayscale, etc.)
+    if hasattr(image_path, 'seek'):
+        image_path.seek(0)
+    left, top, right, bottom = box
+    crop_w = max((right - left) * full_w, 1)
+    crop_h = max((bottom - top) * full_h, 1)
+    img = Image.open(image_path)
+    img.draft('RGB', (int(np.ceil(full_w * target_w / crop_w)), int(np.ceil(full_h * target_h / crop_h))))
     if img.mode != 'RGB':
         img = img.convert('RGB')
     
-    # Resize to target size
-    img = img.resize(target_size, Image.LANCZOS)
+    # Box in the coordinates of the (possibly reduced) decoded image
+    w, h = img.size
+    img = img.resize((target_w, target_h), Image.LANCZOS, box=(left * w, top * h, right * w, bottom * h))
+    return img, box
+
+
+def preprocess_image(image_path, target_size=(224, 224), crop_leaf=False, return_box=False):
+    """
+    Preprocess image for model prediction
+    
+    Args:
+        image_path: Path to image file
+        target_size: Target size tuple (height, width)
+        crop_leaf: Crop to the detected leaf region first (full frame if none is found)
+        return_box: Also return the region used, as (left, top, right, bottom) fractions
+    
+    Returns:
+        numpy array: Preprocessed image ready for model,
+        or (array, box) with ``return_box``
+    """
+    img = None
+    box = (0.0, 0.0, 1.0, 1.0)
+    if crop_leaf:
+        from app.config import settings
+        region = load_leaf_region(
+            image_path, target_size,
+            thumb_size=settings.ROI_THUMB_SIZE,
+            threshold=settings.ROI_EXG_THRESHOLD,
+            min_fraction=settings.ROI_MIN_FRACTION,
+            padding=settings.ROI_PADDING
+        )
+        if region is not None:
+            img, box = region
+        elif hasattr(image_path, 'seek'):
+            image_path.seek(0)
+    
+    if img is None:
+        # Load image
+        img = Image.open(image_path)
+        
+        # Convert to RGB if needed (handle RGBA, grayscale, etc.)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        
+        # Resize to target size (PIL takes width, height)
+        img = img.resize((target_size[1], target_size[0]), Image.LANCZOS)
     
     # Convert to numpy array
     img_array = np.array(img)
@@ -57,6 +226,8 @@ def preprocess_image(image_path, target_size=(224, 224)):
     # Add batch dimension
     img_array = np.expand_dims(img_array, axis=0)
     
+    if return_box:
+        return img_array, box
     return img_array
 
 
@@ -0,0 +1,216 @@
+"""
+Tiled inference for high-resolution canopy images
+
+A drone or wide shot is cut into overlapping model-sized tiles instead of
+being squashed into one 224x224 input. The image is decoded whole (JPEGs
+reduced during decoding with ``Image.draft``) and resized to at most
+``TILE_MAX_SIDE``, so peak memory follows the decoded size; images that
+would decode to more than ``TILE_MAX_PIXELS`` are rejected up front, and
+the memory budget lowers that cap to fit. Tiles are then cut one strip (one
+row of tiles) at a time; each strip is exposed as a zero-copy
+``as_strided`` window view and only the tile offsets actually needed are
+gathered into the batch. Tiles are scored in fixed-size batches (matching
+the warm-up batch sizes) and aggregated into a per-tile heatmap and an
+image-level result.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from PIL import Image
+
+from app.config import settings
+
+
+def tile_positions(length, tile, stride):
+    """Tile start offsets covering ``length``, the last one flush with the edge"""
+    if length <= tile:
+        return np.array([0], dtype=np.intp)
+    positions = np.arange(0, length - tile + 1, stride, dtype=np.intp)
+    if positions[-1] + tile < length:
+        positions = np.append(positions, length - tile)
+    return positions
+
+
+def window_view(strip, tile_width):
+    """
+    Every ``tile_width``-wide window of a strip, without copying
+
+    Args:
+        strip: Array (strip_height, W, 3)
+        tile_width: Window width
+
+    Returns:
+        numpy array: Read-only view (W - tile_width + 1, strip_height, tile_width, 3)
+    """
+    height, width, channels = strip.shape
+    s_row, s_col, s_chan = strip.strides
+    return as_strided(
+        strip,
+        shape=(width - tile_width + 1, height, tile_width, channels),
+        strides=(s_col, s_row, s_col, s_chan),
+        writeable=False
+    )
+
+
+def open_canopy(image_path, tile_size, max_side):
+    """
+    Open an image lazily and plan its working size, without decoding pixels
+
+    JPEGs are set up to be reduced during decoding with ``Image.draft``;
+    other formats would decode at full size, so an image that would decode
+    to more than ``TILE_MAX_PIXELS`` is rejected from its header.
+
+    Returns:
+        tuple: (PIL image, scale from original to working pixels, working (width, height), original (width, height))
+
+    Raises:
+        ValueError: The image is too large to decode
+    """
+    tile_h, tile_w = tile_size
+    img = Image.open(image_path)
+    width, height = img.size
+
+    scale = min(1.0, max_side / max(width, height))
+    scale = max(scale, tile_h / height, tile_w / width)
+    target = (max(round(width * scale), tile_w), max(round(height * scale), tile_h))
+
+    if target != img.size:
+        img.draft('RGB', target)
+    # The size after draft is what decoding will allocate
+    if img.size[0] * img.size[1] > settings.TILE_MAX_PIXELS:
+        img.close()
+        raise ValueError(f"Image too large: {width}x{height} pixels, at most {settings.TILE_MAX_PIXELS} can be decoded")
+    return img, scale, target, (width, height)
+
+
+def load_canopy(image_path, tile_size, max_side):
+    """
+    Open an image, downscaled so its longest side is at most ``max_side``
+
+    Images smaller than one tile are upscaled to fit it.
+
+    Returns:
+        tuple: (RGB PIL image, scale from original to working pixels, original (width, height))
+    """
+    img, scale, target, image_size = open_canopy(image_path, tile_size, max_side)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if target != img.size:
+        img = img.resize(target, Image.LANCZOS)
+    return img, scale, image_size
+
+
+def check_canopy(image_path):
+    """Raise ValueError if the image is too large for tiled prediction (reads the header only)"""
+    img = open_canopy(image_path, settings.IMG_SIZE, settings.TILE_MAX_SIDE)[0]
+    img.close()
+
+
+def iter_tile_batches(img, tile_size, stride, batch_size):
+    """
+    Stream tiles strip by strip
+
+    Args:
+        img: RGB PIL image
+        tile_size: (height, width) of a tile
+        stride: (vertical, horizontal) step between tiles
+        batch_size: Tiles per yielded batch (only the last one may be smaller)
+
+    Yields:
+        tuple: (uint8 batch (n, tile_h, tile_w, 3), int array (n, 2) of grid (row, col))
+    """
+    tile_h, tile_w = tile_size
+    width, height = img.size
+    ys = tile_positions(height, tile_h, stride[0])
+    xs = tile_positions(width, tile_w, stride[1])
+
+    pending, cells = [], []
+    for row, y in enumerate(ys):
+        strip = np.asarray(img.crop((0, int(y), width, int(y) + tile_h)))
+        pending.append(window_view(strip, tile_w)[xs])
+        cells.extend((row, col) for col in range(len(xs)))
+        last = row == len(ys) - 1
+        if len(cells) < batch_size and not last:
+            continue
+
+        batch = np.concatenate(pending)
+        cell_array = np.array(cells, dtype=np.intp)
+        full = len(batch) if last else len(batch) - len(batch) % batch_size
+        for start in range(0, full, batch_size):
+            yield batch[start:min(start + batch_size, full)], cell_array[start:min(start + batch_size, full)]
+        # Carry the partial batch over to the next strip
+        pending, cells = [batch[full:].copy()], cells[full:]
+
+
+def aggregate(scores, leaf_fraction, min_fraction):
+    """
+    Image-level scores from tile scores
+
+    Tiles are weighted by how much leaf they contain, so soil and sky do
+    not dilute a disease seen on a few leaves; tiles under ``min_fraction``
+    leaf are ignored unless no tile reaches it.
+
+    Args:
+        scores: (rows, cols, NUM_CLASSES) tile scores
+        leaf_fraction: (rows, cols) leaf fraction per tile
+        min_fraction: Minimum leaf fraction for a tile to count
+
+    Returns:
+        numpy array: Normalized (NUM_CLASSES,) score vector
+    """
+    weights = np.where(leaf_fraction >= min_fraction, leaf_fraction, 0.0)
+    if weights.sum() <= 0:
+        weights = np.ones_like(leaf_fraction)
+    combined = np.tensordot(weights, scores, axes=([0, 1], [0, 1])) / weights.sum()
+    return combined / combined.sum()
+
+
+def predict_tiles(image_path, tile_size=None, overlap=None, max_side=None, batch_size=None):
+    """
+    Score a large image tile by tile
+
+    Args:
+        image_path: Path or file-like object
+        tile_size: (height, width) of a tile, defaults to the model input size
+        overlap: Fraction of a tile shared with its neighbour
+        max_side: Longest side the image is reduced to before tiling
+        batch_size: Tiles scored per call
+
+    Returns:
+        dict: ``scores`` (rows, cols, NUM_CLASSES), ``leaf_fraction`` (rows, cols),
+        ``ys``/``xs`` tile offsets in original pixels, ``tile_size`` in original
+        pixels, ``image_size`` (width, height), ``image_scores`` and ``version``
+    """
+    from app.core.ml.model_handler import score_routed, NUM_CLASSES
+    from app.core.ml.preprocessing import excess_green_mask
+
+    tile_size = tuple(tile_size or settings.IMG_SIZE)
+    overlap = settings.TILE_OVERLAP if overlap is None else overlap
+    max_side = max_side or settings.TILE_MAX_SIDE
+    batch_size = batch_size or settings.TILE_BATCH_SIZE
+    stride = tuple(max(1, int(round(t * (1 - overlap)))) for t in tile_size)
+
+    img, scale, image_size = load_canopy(image_path, tile_size, max_side)
+    width, height = img.size
+    ys = tile_positions(height, tile_size[0], stride[0])
+    xs = tile_positions(width, tile_size[1], stride[1])
+
+    scores = np.zeros((len(ys), len(xs), NUM_CLASSES))
+    leaf_fraction = np.zeros((len(ys), len(xs)))
+    version = None
+    for batch, cells in iter_tile_batches(img, tile_size, stride, batch_size):
+        batch_scores, version, _ = score_routed(batch)
+        rows, cols = cells[:, 0], cells[:, 1]
+        scores[rows, cols] = batch_scores
+        leaf_fraction[rows, cols] = excess_green_mask(batch, settings.ROI_EXG_THRESHOLD).mean(axis=(1, 2))
+
+    return {
+        "scores": scores,
+        "leaf_fraction": leaf_fraction,
+        "ys": np.round(ys / scale).astype(int),
+        "xs": np.round(xs / scale).astype(int),
+        "tile_size": tuple(int(round(t / scale)) for t in tile_size),
+        "image_size": image_size,
+        "image_scores": aggregate(scores, leaf_fraction, settings.ROI_MIN_FRACTION),
+        "version": version
+    }
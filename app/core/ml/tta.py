@@ -0,0 +1,110 @@
+"""
+Test-time augmentation built as a single vectorized batch
+
+Every augmented view (flips, center/corner crops, slight rotations) is
+described by a precomputed (H, W) source-coordinate map. All views are then
+produced by one fancy-indexing gather ``img[ys, xs]`` into an (N, H, W, 3)
+batch, which is scored in one batched call and averaged.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+# Views in priority order; a budget of N uses the first N
+VIEW_ORDER = (
+    "identity", "hflip", "center_crop", "rot_pos", "rot_neg",
+    "vflip", "crop_tl", "crop_tr", "crop_bl", "crop_br"
+)
+
+CROP_FRACTION = 0.875
+ROTATION_DEGREES = 8.0
+
+
+def _crop_map(height, width, top, left):
+    """Nearest-neighbour map resizing a crop at (top, left) back to full size"""
+    crop_h, crop_w = height * CROP_FRACTION, width * CROP_FRACTION
+    rows = top + (np.arange(height) + 0.5) * crop_h / height
+    cols = left + (np.arange(width) + 0.5) * crop_w / width
+    ys, xs = np.meshgrid(rows.astype(np.intp), cols.astype(np.intp), indexing='ij')
+    return ys, xs
+
+
+def _rotation_map(height, width, degrees):
+    """Nearest-neighbour map rotating about the center, clamping at the borders"""
+    theta = np.deg2rad(degrees)
+    cy, cx = (height - 1) / 2.0, (width - 1) / 2.0
+    yy, xx = np.meshgrid(np.arange(height) - cy, np.arange(width) - cx, indexing='ij')
+    ys = np.cos(theta) * yy - np.sin(theta) * xx + cy
+    xs = np.sin(theta) * yy + np.cos(theta) * xx + cx
+    ys = np.clip(np.rint(ys), 0, height - 1).astype(np.intp)
+    xs = np.clip(np.rint(xs), 0, width - 1).astype(np.intp)
+    return ys, xs
+
+
+def _view_map(name, height, width):
+    ys, xs = np.meshgrid(np.arange(height), np.arange(width), indexing='ij')
+    margin_h = height * (1 - CROP_FRACTION)
+    margin_w = width * (1 - CROP_FRACTION)
+
+    if name == "identity":
+        return ys, xs
+    if name == "hflip":
+        return ys, xs[:, ::-1]
+    if name == "vflip":
+        return ys[::-1], xs
+    if name == "center_crop":
+        return _crop_map(height, width, margin_h / 2, margin_w / 2)
+    if name == "crop_tl":
+        return _crop_map(height, width, 0, 0)
+    if name == "crop_tr":
+        return _crop_map(height, width, 0, margin_w)
+    if name == "crop_bl":
+        return _crop_map(height, width, margin_h, 0)
+    if name == "crop_br":
+        return _crop_map(height, width, margin_h, margin_w)
+    if name == "rot_pos":
+        return _rotation_map(height, width, ROTATION_DEGREES)
+    if name == "rot_neg":
+        return _rotation_map(height, width, -ROTATION_DEGREES)
+    raise ValueError(f"Unknown TTA view: {name}")
+
+
+@lru_cache(maxsize=16)
+def view_maps(height, width, num_views):
+    """
+    Stacked coordinate maps for the first ``num_views`` views
+
+    Returns:
+        tuple: (ys, xs) int arrays of shape (num_views, H, W), read-only
+    """
+    names = VIEW_ORDER[:num_views]
+    maps = [_view_map(name, height, width) for name in names]
+    ys = np.stack([m[0] for m in maps])
+    xs = np.stack([m[1] for m in maps])
+    ys.flags.writeable = False
+    xs.flags.writeable = False
+    return ys, xs
+
+
+def augment(img_array, num_views):
+    """
+    Build the augmented batch for one image
+
+    Args:
+        img_array: Array (1, H, W, 3) or (H, W, 3)
+        num_views: Number of views, capped at ``len(VIEW_ORDER)``
+
+    Returns:
+        numpy array: (num_views, H, W, 3) batch with the same dtype as the input
+    """
+    img = img_array[0] if img_array.ndim == 4 else img_array
+    num_views = max(1, min(num_views, len(VIEW_ORDER)))
+    ys, xs = view_maps(img.shape[0], img.shape[1], num_views)
+    return img[ys, xs]
+
+
+def average_scores(scores):
+    """Mean of per-view score rows, renormalized to sum to 1"""
+    mean = np.asarray(scores, dtype=np.float64).mean(axis=0)
+    return mean / mean.sum()
@@ -0,0 +1,114 @@
+"""
+Startup warm-up - graph tracing and synthetic batches before serving traffic
+
+The first forward pass through Keras pays for graph construction and oneDNN
+kernel selection. Warm-up traces a ``tf.function`` with a fixed input
+signature for every configured batch size and pushes a synthetic batch of
+each size through the model and the rules, so real requests only ever hit
+already-built graphs.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from app.config import settings
+
+# Readiness state reported by the health endpoints
+state = {
+    "ready": False,
+    "started_at": None,
+    "duration": None,
+    "error": None
+}
+
+
+def trace_model(model, batch_sizes, input_size):
+    """
+    Trace concrete functions with fixed input signatures
+
+    Args:
+        model: Keras model
+        batch_sizes: Batch sizes to trace
+        input_size: (height, width) of the model input
+
+    Returns:
+        dict: {batch_size: concrete function}, empty when TensorFlow is unavailable
+    """
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return {}
+
+    @tf.function
+    def forward(x):
+        return model(x, training=False)
+
+    height, width = input_size
+    traced = {}
+    for batch_size in batch_sizes:
+        spec = tf.TensorSpec((batch_size, height, width, 3), tf.float32)
+        traced[batch_size] = forward.get_concrete_function(spec)
+    return traced
+
+
+def warm_up_version(version, batch_sizes=None):
+    """
+    Trace and exercise one model version at every batch size
+
+    Args:
+        version: ModelVersion to warm
+        batch_sizes: Batch sizes, defaults to ``settings.WARMUP_BATCH_SIZES``
+
+    Returns:
+        float: Warm-up duration in seconds
+    """
+    batch_sizes = batch_sizes or settings.WARMUP_BATCH_SIZES
+    start = time.perf_counter()
+
+    if version.model is not None:
+        version.traced = trace_model(version.forward_model, batch_sizes, version.input_size)
+
+    # Noise rather than zeros so every branch of the rules is exercised
+    rng = np.random.default_rng(0)
+    height, width = version.input_size
+    for batch_size in batch_sizes:
+        batch = rng.integers(0, 256, (batch_size, height, width, 3), dtype=np.uint8)
+        version.score_batch(batch)
+
+    version.warm = True
+    return time.perf_counter() - start
+
+
+def run_startup_warmup():
+    """Load and warm the active model version, then report readiness (not after a failure)"""
+    state["started_at"] = time.time()
+    start = time.perf_counter()
+    try:
+        from app.core.ml.model_registry import get_registry
+        get_registry()
+    except Exception as e:
+        state["duration"] = time.perf_counter() - start
+        state["error"] = str(e)
+        # Stay unready so the readiness probe keeps a broken model out of rotation
+        print(f"❌ Warm-up failed, not ready: {e}")
+        return
+
+    state["duration"] = time.perf_counter() - start
+    state["ready"] = True
+    sizes = ",".join(str(b) for b in settings.WARMUP_BATCH_SIZES)
+    print(f"🔥 Warm-up finished in {state['duration']:.2f}s (batch sizes {sizes})")
+
+
+def start_background_warmup():
+    """Warm up off the event loop so liveness checks answer immediately"""
+    thread = threading.Thread(target=run_startup_warmup, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def mark_ready():
+    """Report readiness without warming (the inference server warms itself)"""
+    state["duration"] = 0.0
+    state["ready"] = True
@@ -0,0 +1,292 @@
+"""
+Server-side sessions - the cookie only carries an opaque session ID
+
+``ServerSessionMiddleware`` replaces Starlette's ``SessionMiddleware``, which
+signs and base64-encodes the whole session (the prediction history) into the
+cookie on every response. Here the data stays in a store:
+
+- memory: in-process LRU (default; lost on restart, not shared by workers)
+- sqlite: one table at ``SESSION_DB_PATH``, shared by workers on one host
+- redis: ``REDIS_URL``, shared by every node
+
+``request.session`` is loaded from the store on first access, so routes that
+never touch it cost nothing; async routes ``await load_session(request)``
+first so SQLite or Redis reads run in the thread pool. The data is only
+written when it actually changed; a session that was read but not changed
+has its expiry refreshed (``touch``) and its cookie re-sent, so it lasts
+``SESSION_MAX_AGE`` after the last visit like Starlette's cookie sessions.
+"""
+
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import closing
+
+from app.config import settings
+
+
+class MemorySessionStore:
+    """Sessions in an in-process LRU with expiry"""
+
+    blocking = False
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            raw, expires = entry
+            if expires < time.time():
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return raw
+
+    def save(self, session_id, raw, ttl):
+        with self._lock:
+            self._entries[session_id] = (raw, time.time() + ttl)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, session_id, ttl):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries[session_id] = (entry[0], time.time() + ttl)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+
+class SQLiteSessionStore:
+    """
+    Sessions in one SQLite table; expired rows are purged every ``PURGE_EVERY`` saves
+
+    ``touch`` only writes once the stored expiry is ``TOUCH_INTERVAL`` seconds old.
+    """
+
+    PURGE_EVERY = 256
+    TOUCH_INTERVAL = 60.0
+    blocking = True
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._saves = 0
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT, expires REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def load(self, session_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT data FROM sessions WHERE id = ? AND expires >= ?",
+                               (session_id, time.time())).fetchone()
+        return row[0] if row else None
+
+    def save(self, session_id, raw, ttl):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)",
+                         (session_id, raw, now + ttl))
+            self._saves += 1
+            if self._saves % self.PURGE_EVERY == 0:
+                conn.execute("DELETE FROM sessions WHERE expires < ?", (now,))
+
+    def touch(self, session_id, ttl):
+        expires = time.time() + ttl
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE sessions SET expires = ? WHERE id = ? AND expires < ?",
+                         (expires, session_id, expires - self.TOUCH_INTERVAL))
+
+    def delete(self, session_id):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+class RedisSessionStore:
+    """Sessions as Redis strings expiring with the session"""
+
+    blocking = True
+
+    def __init__(self, url, prefix="plant_sessions:"):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def load(self, session_id):
+        return self.redis.get(self.prefix + session_id)
+
+    def save(self, session_id, raw, ttl):
+        self.redis.set(self.prefix + session_id, raw, ex=ttl)
+
+    def touch(self, session_id, ttl):
+        self.redis.expire(self.prefix + session_id, ttl)
+
+    def delete(self, session_id):
+        self.redis.delete(self.prefix + session_id)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if settings.SESSION_BACKEND == "redis":
+                if not settings.REDIS_URL:
+                    raise RuntimeError("SESSION_BACKEND=redis needs REDIS_URL")
+                _store = RedisSessionStore(settings.REDIS_URL)
+            elif settings.SESSION_BACKEND == "sqlite":
+                settings.SESSION_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+                _store = SQLiteSessionStore(settings.SESSION_DB_PATH)
+            else:
+                _store = MemorySessionStore(settings.SESSION_MAX_ENTRIES)
+        return _store
+
+
+class LazySession(MutableMapping):
+    """
+    ``request.session`` that loads from the store on first access
+
+    ``id`` is the session ID from the cookie, None for a new client. It is
+    not checked against the store until the session is loaded.
+    """
+
+    def __init__(self, store, session_id):
+        self.id = session_id
+        self._store = store
+        self._data = None
+        self._raw = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._raw = self._store.load(self.id) if self.id else None
+            if self._raw is None:
+                # Unknown or expired: never adopt a client-chosen ID
+                self.id = None
+            self._data = json.loads(self._raw) if self._raw else {}
+        return self._data
+
+    @property
+    def loaded(self):
+        """Check if reading the session no longer needs the store"""
+        return self._data is not None or not self.id
+
+    def load(self):
+        """Read the session from the store now (blocking)"""
+        return self.data
+
+    @property
+    def stored(self):
+        """Check if the session was loaded and exists in the store"""
+        return self._raw is not None and self.id is not None
+
+    def changes(self):
+        """
+        Serialized data to save, "" when the session was emptied, None when unchanged
+
+        Compares serialized data, so in-place changes (``session["history"].insert``) count too.
+        """
+        if self._data is None:
+            return None
+        raw = json.dumps(self._data, ensure_ascii=False) if self._data else ""
+        return None if raw == (self._raw or "") else raw
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+async def load_session(request):
+    """
+    ``request.session``, loaded without blocking the event loop
+
+    Call from async routes before reading or changing the session. Signed
+    cookie sessions (Starlette's dict) are returned as they are.
+    """
+    session = request.session
+    if isinstance(session, LazySession) and not session.loaded:
+        if getattr(session._store, "blocking", True):
+            from fastapi.concurrency import run_in_threadpool
+            await run_in_threadpool(session.load)
+        else:
+            session.load()
+    return session
+
+
+class ServerSessionMiddleware:
+    """Keep session data server-side behind an opaque ID cookie"""
+
+    def __init__(self, app, session_cookie="plant_disease_session", max_age=None,
+                 same_site="lax", https_only=False):
+        self.app = app
+        self.session_cookie = session_cookie
+        self.max_age = max_age or settings.SESSION_MAX_AGE
+        self.flags = f"path=/; httponly; samesite={same_site}" + ("; secure" if https_only else "")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        from fastapi.concurrency import run_in_threadpool
+        from starlette.datastructures import MutableHeaders
+        from starlette.requests import HTTPConnection
+
+        store = get_store()
+        session = LazySession(store, HTTPConnection(scope).cookies.get(self.session_cookie))
+        scope["session"] = session
+
+        def refresh(session_id):
+            # Refreshes the cookie expiry together with the stored session
+            return f"{self.session_cookie}={session_id}; Max-Age={self.max_age}; {self.flags}"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                raw = session.changes()
+                if raw:
+                    session_id = session.id or secrets.token_urlsafe(32)
+                    await run_in_threadpool(store.save, session_id, raw, self.max_age)
+                    MutableHeaders(scope=message).append("Set-Cookie", refresh(session_id))
+                elif raw is None and session.stored:
+                    # Read but unchanged: extend it from this visit
+                    if store.blocking:
+                        await run_in_threadpool(store.touch, session.id, self.max_age)
+                    else:
+                        store.touch(session.id, self.max_age)
+                    MutableHeaders(scope=message).append("Set-Cookie", refresh(session.id))
+                elif raw == "" and session.id:
+                    await run_in_threadpool(store.delete, session.id)
+                    MutableHeaders(scope=message).append(
+                        "Set-Cookie", f"{self.session_cookie}=null; Max-Age=0; {self.flags}"
+                    )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
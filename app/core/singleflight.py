@@ -0,0 +1,75 @@
+"""
+Single-flight - concurrent calls with the same key share one computation
+
+The first caller for a key (the leader) runs the function; callers arriving
+while it is in flight wait for the same result instead of repeating the work.
+Threads block on the shared future, asyncio tasks await it without holding a
+thread, and the leader of an async call runs in the threadpool.
+"""
+
+import asyncio
+import copy
+import threading
+from concurrent.futures import Future
+
+from app.core import metrics
+
+
+class SingleFlight:
+    """In-flight calls keyed by e.g. an image content hash"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """The in-flight future for ``key`` and whether this caller must run it"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                metrics.inc(f"{self.name}.coalesced")
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _run(self, key, future, fn, args, kwargs):
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key)
+            future.set_exception(e)
+        else:
+            self._finish(key)
+            future.set_result(result)
+
+    def _finish(self, key):
+        # Later callers start a fresh computation rather than reuse this one
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Call ``fn(*args, **kwargs)`` unless the same key is already in flight
+
+        Returns:
+            The result; waiting callers get a deep copy, so they can mutate it freely
+        """
+        future, leader = self._join(key)
+        if leader:
+            self._run(key, future, fn, args, kwargs)
+            return future.result()
+        return copy.deepcopy(future.result())
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """``do`` for asyncio code: the leader runs ``fn`` in the threadpool"""
+        from fastapi.concurrency import run_in_threadpool
+        future, leader = self._join(key)
+        if leader:
+            await run_in_threadpool(self._run, key, future, fn, args, kwargs)
+            return future.result()
+        return copy.deepcopy(await asyncio.wrap_future(future))
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,117 @@
+"""
+Uploaded images shared between workers and nodes
+
+Scoring, tiling and jobs work on file paths, so every upload is written to
+``UPLOAD_FOLDER`` first. The backend decides who else can see it:
+
+- local: the folder is the store (default; shared by the workers of one
+  host, or by nodes that mount the same volume)
+- redis: each upload is also published to ``REDIS_URL`` for
+  ``UPLOAD_TTL`` seconds; a node asked for a file it does not have (a job
+  picked up from the shared queue, ``/static/uploads/...`` through another
+  node) pulls it into its own folder first
+"""
+
+import threading
+from pathlib import Path
+
+from app.config import settings
+
+
+class LocalUploadStore:
+    """Nothing beyond ``UPLOAD_FOLDER``"""
+
+    shared = False
+
+    def publish(self, name, data):
+        pass
+
+    def fetch(self, name):
+        return None
+
+    def delete(self, name):
+        pass
+
+
+class RedisUploadStore:
+    """Upload bytes as Redis strings expiring after ``ttl`` seconds"""
+
+    shared = True
+
+    def __init__(self, url, ttl, prefix="plant_uploads:"):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def publish(self, name, data):
+        self.redis.set(self.prefix + name, data, ex=self.ttl)
+
+    def fetch(self, name):
+        return self.redis.get(self.prefix + name)
+
+    def delete(self, name):
+        self.redis.delete(self.prefix + name)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if settings.UPLOAD_BACKEND == "redis":
+                if not settings.REDIS_URL:
+                    raise RuntimeError("UPLOAD_BACKEND=redis needs REDIS_URL")
+                _store = RedisUploadStore(settings.REDIS_URL, settings.UPLOAD_TTL)
+            else:
+                _store = LocalUploadStore()
+        return _store
+
+
+def is_shared():
+    """Check if uploads made on another node can be fetched"""
+    return settings.UPLOAD_BACKEND == "redis"
+
+
+def save(name, data):
+    """
+    Store an upload under its unique ``name``
+
+    Returns:
+        Path: The local file to score
+    """
+    path = settings.UPLOAD_FOLDER / name
+    with open(path, 'wb') as f:
+        f.write(data)
+    get_store().publish(name, data)
+    return path
+
+
+def local_path(name):
+    """
+    Local file of an upload, fetched from the shared store when missing
+
+    Returns:
+        Path: The file path (may not exist if the upload is unknown or expired)
+    """
+    path = settings.UPLOAD_FOLDER / name
+    if Path(name).name != name or path.exists():
+        return path
+    data = get_store().fetch(name)
+    if data is not None:
+        # Write under a temporary name so concurrent readers never see a partial file
+        tmp_path = path.with_name(f".{name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+    return path
+
+
+def delete(name):
+    """Remove a rejected upload locally and from the shared store"""
+    path = settings.UPLOAD_FOLDER / name
+    if path.exists():
+        path.unlink()
+    get_store().delete(name)
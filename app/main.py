@@ -3,14 +3,23 @@ FastAPI Main Application
 Plant Disease Detection with AI
 """
 from fastapi import FastAPI, Request
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.responses import JSONResponse
 
 from app.config import settings
-from app.api.routes import pages, predict, history, health
+from app.core import memory
+
+# The memory budget (MEMORY_LIMIT_MB) lowers settings, so apply it before routes and stores read them
+memory.get_budget()
+
+from app.core.admission import AdmissionMiddleware
+from app.core.sessions import ServerSessionMiddleware
+from app.core.assets import APIGZipMiddleware, PrecompressedStaticFiles, UploadFiles, cached_page
+from app.api.routes import (
+    pages, predict, history, health, models, similar, metrics, feedback, jobs, config, treatments
+)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -20,13 +29,28 @@ app = FastAPI(
     debug=settings.DEBUG
 )
 
+# Admission control; added first so it runs inside the session middleware
+# and can key rate limits on the session
+app.add_middleware(AdmissionMiddleware)
+
 # Add session middleware (replaces Flask sessions)
-app.add_middleware(
-    SessionMiddleware,
-    secret_key=settings.SECRET_KEY,
-    max_age=settings.SESSION_MAX_AGE,
-    session_cookie="plant_disease_session"
-)
+if settings.SESSION_BACKEND == "cookie":
+    # Whole session signed into the cookie
+    app.add_middleware(
+        SessionMiddleware,
+        secret_key=settings.SECRET_KEY,
+        max_age=settings.SESSION_MAX_AGE,
+        session_cookie="plant_disease_session"
+    )
+else:
+    app.add_middleware(
+        ServerSessionMiddleware,
+        max_age=settings.SESSION_MAX_AGE,
+        session_cookie="plant_disease_session"
+    )
+
+# Compress API responses (static files are served pre-compressed)
+app.add_middleware(APIGZipMiddleware, minimum_size=settings.GZIP_MIN_SIZE)
 
 # Add CORS middleware (if needed for future SPA)
 app.add_middleware(
@@ -37,8 +61,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files
-app.mount("/static", StaticFiles(directory=str(settings.STATIC_DIR)), name="static")
+# Uploaded images; UPLOAD_FOLDER may live outside static/ (e.g. a shared volume)
+app.mount("/static/uploads", UploadFiles(directory=str(settings.UPLOAD_FOLDER)), name="uploads")
+
+# Mount static files (fingerprinted build in static/dist, see build_assets.py)
+app.mount("/static", PrecompressedStaticFiles(directory=str(settings.STATIC_DIR)), name="static")
 
 # Setup Jinja2 templates
 templates = Jinja2Templates(directory=str(settings.TEMPLATES_DIR))
@@ -48,6 +75,13 @@ app.include_router(pages.router, tags=["Pages"])
 app.include_router(predict.router, prefix="/api", tags=["Prediction"])
 app.include_router(history.router, prefix="/api", tags=["History"])
 app.include_router(health.router, prefix="/api", tags=["Health"])
+app.include_router(models.router, prefix="/api", tags=["Models"])
+app.include_router(similar.router, prefix="/api", tags=["Similar Cases"])
+app.include_router(metrics.router, prefix="/api", tags=["Metrics"])
+app.include_router(feedback.router, prefix="/api", tags=["Feedback"])
+app.include_router(jobs.router, prefix="/api", tags=["Jobs"])
+app.include_router(config.router, prefix="/api", tags=["Config"])
+app.include_router(treatments.router, prefix="/api", tags=["Treatments"])
 
 
 # Exception handlers
@@ -64,7 +98,7 @@ async def request_entity_too_large_handler(request: Request, exc: Exception):
 async def not_found_handler(request: Request, exc: Exception):
     """Handle 404 errors - serve homepage for HTML requests"""
     if "text/html" in request.headers.get("accept", ""):
-        return templates.TemplateResponse("index.html", {"request": request})
+        return cached_page(templates, "index.html").response(request.scope)
     return JSONResponse(status_code=404, content={"error": "Not found"})
 
 
@@ -88,12 +122,26 @@ async def startup_event():
     
     print("=" * 60)
     
-    # Pre-load ML model (optional optimization)
+    # Pre-load ML model and warm it up in the background; /api/health/ready
+    # reports 503 until it finishes
     try:
-        from app.core.ml import model_handler
+        from app.core.ml import model_handler, warmup
         print("✅ ML model handler loaded")
+        memory.record_imports()
+        if settings.INFERENCE_SERVER_ENABLED:
+            warmup.mark_ready()
+        else:
+            warmup.start_background_warmup()
     except Exception as e:
         print(f"⚠️  ML model loading warning: {e}")
+    
+    # Async job workers (queued jobs left by a crashed process are recovered)
+    if settings.JOBS_ENABLED:
+        try:
+            from app.core import jobs as job_queue
+            job_queue.start_workers()
+        except Exception as e:
+            print(f"⚠️  Job workers not started: {e}")
 
 
 # Shutdown event
@@ -101,6 +149,13 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown"""
     print("🛑 Shutting down Plant Disease Detection API...")
+    
+    from app.core.ml import embedding_index
+    from app.core import feedback
+    from app.core import jobs as job_queue
+    embedding_index.flush_all()
+    feedback.flush_all()
+    job_queue.stop_workers()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,30 @@
+"""
+Client identity for per-client limits
+"""
+
+import hashlib
+import hmac
+
+from app.config import settings
+
+
+def is_known_key(value):
+    """Check an ``X-API-Key`` value against ``API_KEYS``"""
+    # Compare with every key so the time taken does not reveal which one matched
+    matches = [hmac.compare_digest(value, known.encode()) for known in settings.API_KEY_LIST]
+    return any(matches)
+
+
+def client_id(scope):
+    """
+    Stable client key from an ASGI scope (``request.scope``)
+
+    An ``X-API-Key`` header listed in ``API_KEYS`` identifies the client
+    (hashed, so keys never end up in logs or the job store); otherwise, and
+    for unknown keys, the peer address does.
+    """
+    for name, value in scope.get("headers") or ():
+        if name == b"x-api-key" and value and is_known_key(value):
+            return "key:" + hashlib.sha256(value).hexdigest()[:16]
+    client = scope.get("client")
+    return f"ip:{client[0]}" if client else "ip:unknown"
@@ -0,0 +1,41 @@
+"""
+Content hashing for uploads and training images
+"""
+
+import hashlib
+
+CHUNK_SIZE = 1 << 20
+
+
+def content_hash(data):
+    """SHA-256 hex digest of raw image bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dhash(img, size=8):
+    """
+    Perceptual difference hash of a PIL image
+
+    The image is reduced to a (size + 1) x size grayscale grid and each bit
+    records whether a cell is brighter than its left neighbour, so re-encoded,
+    rescaled or slightly recolored copies get hashes a few bits apart.
+
+    Returns:
+        int: ``size * size``-bit hash
+    """
+    from PIL import Image
+    import numpy as np
+
+    img.draft('L', (size * 4, size * 4))
+    gray = np.asarray(img.convert('L').resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = (gray[:, 1:] > gray[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
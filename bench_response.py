@@ -0,0 +1,97 @@
+"""
+Benchmark per-request cost of building and encoding prediction responses
+Chạy lệnh: python bench_response.py [--iterations 5000]
+
+Compares the validated path (models built with validation, re-validated
+against ``response_model`` and encoded by ``JSONResponse``, as FastAPI does
+for a returned model) with the fast path in app/api/responses.py, for a
+plain prediction and one with an ``?explain=true`` mask overlay.
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+
+
+def sample_predictions():
+    from app.core.ml.model_handler import probs_to_predictions, scores_to_dict, NUM_CLASSES
+    rng = np.random.default_rng(0)
+    return probs_to_predictions(scores_to_dict(rng.dirichlet(np.ones(NUM_CLASSES))), 3, "v1")
+
+
+def sample_explanation(size=224):
+    rng = np.random.default_rng(1)
+    runs = lambda: rng.integers(1, 40, size=size * 4).tolist()
+    return {
+        "height": size, "width": size, "box": [0.0, 0.0, 1.0, 1.0], "encoding": "rle",
+        "layers": {"brown": runs(), "yellow": runs(), "spots": runs()},
+        "coverage": {"brown": 0.1, "yellow": 0.05, "spots": 0.02}
+    }
+
+
+def validated_response(predictions, explanation):
+    """The pre-optimization path: validate on build, re-validate and encode like FastAPI"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from app.api.models.prediction import PredictionResponse, PredictionItem, TreatmentInfo, Explanation
+    from app.core.data.treatment_data import get_treatment_info
+
+    result = PredictionResponse(
+        success=True,
+        timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        top_prediction=PredictionItem(**predictions[0]),
+        all_predictions=[PredictionItem(**p) for p in predictions],
+        treatment=TreatmentInfo(**get_treatment_info(predictions[0]['class'])),
+        image_url="/static/uploads/x.jpg",
+        model_version=predictions[0].get('model_version'),
+        explanation=Explanation(**explanation) if explanation else None,
+        image_hash="0" * 64
+    )
+    checked = PredictionResponse.model_validate(result.model_dump(by_alias=True))
+    return JSONResponse(jsonable_encoder(checked.model_dump(by_alias=True))).body
+
+
+def fast_response(predictions, explanation):
+    from app.api.routes.predict import build_prediction_response
+    from app.api.responses import prediction_response
+    result = build_prediction_response(predictions, "x.jpg", explanation, "0" * 64)
+    return prediction_response(result).body
+
+
+def time_calls(fn, iterations):
+    """Median and p95 cost of ``fn()`` in microseconds"""
+    fn()
+    samples = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples[i] = time.perf_counter() - start
+    return float(np.median(samples) * 1e6), float(np.percentile(samples, 95) * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    from app.api import responses
+    print(f"🧾 Encoder: {'orjson' if responses.orjson is not None else 'json (install orjson for the fast path)'}")
+
+    predictions = sample_predictions()
+    for label, explanation in (("plain", None), ("explain", sample_explanation())):
+        slow_body = validated_response(predictions, explanation)
+        fast_body = fast_response(predictions, explanation)
+        assert json.loads(slow_body) == json.loads(fast_body), "fast path changed the response"
+
+        slow = time_calls(lambda: validated_response(predictions, explanation), args.iterations)
+        fast = time_calls(lambda: fast_response(predictions, explanation), args.iterations)
+        print(f"\n{label} ({len(fast_body)} bytes)")
+        print(f"   validated: median {slow[0]:8.1f} µs  p95 {slow[1]:8.1f} µs")
+        print(f"   fast:      median {fast[0]:8.1f} µs  p95 {fast[1]:8.1f} µs  ({slow[0] / fast[0]:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark per-call inference overhead: Keras predict() vs the fast path
+Chạy lệnh: python benchmark_inference.py [--model models/disease_model.h5]
+
+Without a model file an untrained MobileNetV2 (no weight download) is built,
+which has the same per-call costs as the served network.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+
+def time_calls(fn, batch, iterations):
+    """Median and p95 latency of ``fn(batch)`` in milliseconds"""
+    fn(batch)  # exclude first-call setup
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(batch)
+        samples.append((time.perf_counter() - start) * 1000)
+    return float(np.median(samples)), float(np.percentile(samples, 95))
+
+
+def build_model(model_path, input_size):
+    """Load the given artifact or build an untrained MobileNetV2"""
+    try:
+        from keras.applications import MobileNetV2
+        from keras.models import load_model
+    except ImportError:
+        from tensorflow.keras.applications import MobileNetV2
+        from tensorflow.keras.models import load_model
+
+    if model_path:
+        return load_model(model_path, compile=False)
+    return MobileNetV2(input_shape=(input_size, input_size, 3), weights=None, classes=15)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", help="Keras model file (default: untrained MobileNetV2)")
+    parser.add_argument("--batch-sizes", default="1,4,16")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--input-size", type=int, default=224)
+    args = parser.parse_args()
+
+    try:
+        from app.core.ml.fast_path import configure_threads, forward
+        from app.core.ml.warmup import trace_model
+        configure_threads()
+        model = build_model(args.model, args.input_size)
+    except ImportError as e:
+        print(f"❌ TensorFlow/Keras required for this benchmark: {e}")
+        return
+
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    traced = trace_model(model, batch_sizes, (args.input_size, args.input_size))
+    rng = np.random.default_rng(0)
+
+    print("=" * 80)
+    print(f"{'batch':>5} | {'predict() ms':>18} | {'model(x) ms':>18} | {'fast path ms':>18} | speedup")
+    print("-" * 80)
+    for batch_size in batch_sizes:
+        batch = rng.integers(0, 256, (batch_size, args.input_size, args.input_size, 3), dtype=np.uint8)
+        as_float = batch.astype(np.float32) / 255.0
+
+        predict_ms = time_calls(lambda x: model.predict(x, verbose=0), as_float, args.iterations)
+        direct_ms = time_calls(lambda x: model(x, training=False), as_float, args.iterations)
+        traced_ms = time_calls(lambda x: forward(model, traced, x), batch, args.iterations)
+
+        speedup = predict_ms[0] / traced_ms[0]
+        print(f"{batch_size:>5} | {predict_ms[0]:7.2f} (p95 {predict_ms[1]:5.1f}) | "
+              f"{direct_ms[0]:7.2f} (p95 {direct_ms[1]:5.1f}) | "
+              f"{traced_ms[0]:7.2f} (p95 {traced_ms[1]:5.1f}) | {speedup:.1f}x")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    main()
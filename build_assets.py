@@ -0,0 +1,84 @@
+"""
+Build fingerprinted, pre-compressed static assets
+Chạy lệnh: python build_assets.py
+
+Copies every file under static/ (except uploads/) to static/dist/ with the
+first 10 hex digits of its SHA-256 in the name (css/style.css ->
+css/style.3f9a0c1e2b.css), writes .gz and, with the brotli package, .br
+variants of text assets when they are smaller, and a manifest.json that
+templates use through ``asset()``. Fingerprinted files are served with
+immutable cache headers, so run this on every deploy (see render.yaml).
+"""
+
+import argparse
+import hashlib
+import json
+import shutil
+from pathlib import Path
+
+COMPRESSIBLE = {".css", ".js", ".mjs", ".json", ".svg", ".html", ".txt", ".map", ".webmanifest"}
+SKIP_DIRS = {"uploads", "dist"}
+
+
+def fingerprint(path, data):
+    """``dir/name.<hash>.ext`` for a path relative to static/"""
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    return path.with_name(f"{path.stem}.{digest}{path.suffix}").as_posix()
+
+
+def write_variants(target, data):
+    """Write .gz/.br next to ``target`` when smaller than ``data``; returns their sizes"""
+    from app.core.assets import compress
+    sizes = {}
+    for encoding, blob in compress(data).items():
+        if len(blob) < len(data):
+            suffix = ".br" if encoding == "br" else ".gz"
+            target.with_name(target.name + suffix).write_bytes(blob)
+            sizes[encoding] = len(blob)
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--static-dir", default="static", help="Static folder")
+    args = parser.parse_args()
+
+    from app.core.assets import DIST_DIR, brotli
+
+    static_dir = Path(args.static_dir)
+    dist_dir = static_dir / DIST_DIR
+    if dist_dir.exists():
+        shutil.rmtree(dist_dir)
+
+    manifest = {}
+    totals = {"raw": 0, "gzip": 0, "br": 0}
+    for path in sorted(static_dir.rglob("*")):
+        relative = path.relative_to(static_dir)
+        if not path.is_file() or relative.parts[0] in SKIP_DIRS or path.name.startswith("."):
+            continue
+
+        data = path.read_bytes()
+        hashed = fingerprint(relative, data)
+        target = dist_dir / hashed
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        manifest[relative.as_posix()] = hashed
+
+        sizes = write_variants(target, data) if path.suffix in COMPRESSIBLE else {}
+        totals["raw"] += len(data)
+        for encoding in ("gzip", "br"):
+            totals[encoding] += sizes.get(encoding, len(data))
+        variants = ", ".join(f"{k} {v / 1024:.1f} KB" for k, v in sizes.items())
+        print(f"   {relative.as_posix()} -> {hashed} ({len(data) / 1024:.1f} KB{', ' + variants if variants else ''})")
+
+    with open(dist_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    print("=" * 60)
+    print(f"📦 {len(manifest)} assets: {totals['raw'] / 1024:.1f} KB, gzip {totals['gzip'] / 1024:.1f} KB"
+          + (f", brotli {totals['br'] / 1024:.1f} KB" if brotli is not None else " (pip install brotli for .br)"))
+    print(f"✅ Manifest written to {dist_dir / 'manifest.json'}")
+
+
+if __name__ == "__main__":
+    main()
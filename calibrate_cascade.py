@@ -0,0 +1,147 @@
+"""
+Calibrate the cascade early-exit threshold (CASCADE_MARGIN)
+Chạy lệnh: python calibrate_cascade.py data/validation --max-drop 0.01
+
+For every image the cheap stage (downsampled rules) and the full pipeline
+are both run and timed. Each candidate margin threshold is then evaluated
+offline: images whose stage 1 margin clears it keep the stage 1 answer, the
+rest take the full pipeline's. The cheapest threshold that keeps accuracy
+within the target is suggested.
+
+Class folders are used as labels, named by class key (khoe_manh,
+benh_dom_la, ...) or by Vietnamese class name like train.py's dataset. With --unlabeled, accuracy is measured as agreement with the full
+pipeline instead.
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+
+def collect_images(data_dir, unlabeled, class_keys):
+    """List (path, label index or None) pairs under ``data_dir``"""
+    data_dir = Path(data_dir)
+    images = []
+    if unlabeled:
+        for path in sorted(data_dir.rglob("*")):
+            if path.suffix.lower() in IMAGE_SUFFIXES:
+                images.append((path, None))
+        return images
+
+    from app.core.ml.model_handler import class_key
+
+    for folder in sorted(p for p in data_dir.iterdir() if p.is_dir()):
+        key = class_key(folder.name)
+        if key not in class_keys:
+            print(f"⚠️  Skipping folder '{folder.name}': not a disease class")
+            continue
+        label = class_keys.index(key)
+        for path in sorted(folder.iterdir()):
+            if path.suffix.lower() in IMAGE_SUFFIXES:
+                images.append((path, label))
+    return images
+
+
+def evaluate(images, thumb_size):
+    """Run and time both stages on every image"""
+    from app.config import settings
+    from app.core.ml.cascade import stage_one
+    from app.core.ml.model_handler import score_batch
+    from app.core.ml.preprocessing import preprocess_image
+
+    rows = []
+    for i, (path, label) in enumerate(images):
+        # The same input serving scores, leaf crop included (ROI_CROP_ENABLED)
+        img_array = preprocess_image(str(path), settings.IMG_SIZE, crop_leaf=settings.ROI_CROP_ENABLED)
+
+        start = time.perf_counter()
+        scores1, margin = stage_one(img_array, thumb_size)
+        t1 = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scores2, _ = score_batch(img_array)
+        t2 = time.perf_counter() - start
+
+        rows.append((label, int(scores1.argmax()), margin, int(scores2[0].argmax()), t1, t2))
+        if (i + 1) % 50 == 0:
+            print(f"   {i + 1}/{len(images)} images")
+
+    labels, pred1, margins, pred2, t1, t2 = (np.array(col) for col in zip(*rows))
+    return labels, pred1, margins, pred2, t1, t2
+
+
+def sweep(truth, pred1, margins, pred2, t1, t2, thresholds):
+    """Exit rate, accuracy and mean latency for each candidate threshold"""
+    results = []
+    for threshold in thresholds:
+        exits = margins >= threshold
+        pred = np.where(exits, pred1, pred2)
+        latency = t1 + np.where(exits, 0.0, t2)
+        results.append({
+            "threshold": float(threshold),
+            "exit_rate": float(exits.mean()),
+            "accuracy": float((pred == truth).mean()),
+            "mean_latency_ms": float(latency.mean() * 1000)
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("data_dir", help="Image folder (one subfolder per class unless --unlabeled)")
+    parser.add_argument("--unlabeled", action="store_true", help="Measure agreement with the full pipeline")
+    parser.add_argument("--thumb-size", type=int, default=None, help="Stage 1 input size (default: CASCADE_THUMB_SIZE)")
+    parser.add_argument("--target-accuracy", type=float, default=None, help="Minimum accuracy to keep")
+    parser.add_argument("--max-drop", type=float, default=0.01, help="Allowed accuracy drop vs full pipeline")
+    parser.add_argument("--output", help="Write the sweep table as JSON")
+    args = parser.parse_args()
+
+    from app.config import settings
+    from app.core.ml.model_handler import DISEASE_KEYS
+
+    images = collect_images(args.data_dir, args.unlabeled, list(DISEASE_KEYS))
+    if not images:
+        print("❌ No images found")
+        return
+
+    thumb_size = args.thumb_size or settings.CASCADE_THUMB_SIZE
+    print(f"🔍 Scoring {len(images)} images (stage 1 at {thumb_size}x{thumb_size})...")
+    labels, pred1, margins, pred2, t1, t2 = evaluate(images, thumb_size)
+    truth = pred2 if args.unlabeled else labels
+
+    full_accuracy = float((pred2 == truth).mean())
+    target = args.target_accuracy if args.target_accuracy is not None else full_accuracy - args.max_drop
+    thresholds = np.unique(np.round(np.concatenate([np.linspace(0.0, 1.0, 41), margins]), 3))
+    results = sweep(truth, pred1, margins, pred2, t1, t2, thresholds)
+
+    print("=" * 60)
+    print(f"Full pipeline: accuracy {full_accuracy:.3f}, {t2.mean() * 1000:.1f} ms/image")
+    print(f"Stage 1 only:  accuracy {(pred1 == truth).mean():.3f}, {t1.mean() * 1000:.1f} ms/image")
+    print("-" * 60)
+    print(f"{'margin':>8} | {'exit rate':>9} | {'accuracy':>8} | {'latency ms':>10}")
+    for row in results[::max(1, len(results) // 20)]:
+        print(f"{row['threshold']:8.3f} | {row['exit_rate']:9.2%} | {row['accuracy']:8.3f} | {row['mean_latency_ms']:10.2f}")
+    print("=" * 60)
+
+    eligible = [row for row in results if row["accuracy"] >= target]
+    if eligible:
+        best = min(eligible, key=lambda row: (row["mean_latency_ms"], -row["threshold"]))
+        print(f"✅ Suggested: CASCADE_MARGIN={best['threshold']:.3f} "
+              f"(exit rate {best['exit_rate']:.1%}, accuracy {best['accuracy']:.3f}, "
+              f"{best['mean_latency_ms']:.1f} ms/image)")
+    else:
+        print(f"⚠️  No threshold reaches accuracy {target:.3f}; keep the cascade disabled")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"target_accuracy": target, "full_accuracy": full_accuracy, "sweep": results}, f, indent=2)
+        print(f"📁 Sweep written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
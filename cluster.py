@@ -0,0 +1,303 @@
+"""
+Local multi-node harness: several app instances behind a round-robin proxy
+Chạy lệnh: python cluster.py --nodes 4 [--workers 1] [--redis-url redis://localhost:6379/0]
+
+Starts N production-mode instances (gunicorn.conf.py) on consecutive ports
+with shared state: sessions, jobs, uploads and feedback in one temporary
+directory (sqlite), or sessions, jobs and uploads in Redis with
+--redis-url (each node then has its own upload folder). A small TCP proxy
+hands out connections round-robin. The upload load test runs against 1, 2,
+..., N nodes with the same concurrency per node and prints throughput and
+latency per step, then checks that one client's history is the same
+whichever node answers.
+
+Throughput only scales linearly while every process has a CPU core of its
+own (nodes x workers <= CPU count); TensorFlow and BLAS are limited to one
+thread per process for that reason.
+"""
+
+import argparse
+import asyncio
+import http.client
+import io
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+BASE_DIR = Path(__file__).parent
+
+
+# === Proxy ===
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_proxy(port, backends):
+    """Forward each accepted connection to the next backend in turn"""
+    turn = itertools.cycle(backends)
+
+    async def handle(client_reader, client_writer):
+        host, backend_port = next(turn)
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(host, backend_port)
+        except OSError:
+            client_writer.close()
+            return
+        await asyncio.gather(pipe(client_reader, upstream_writer), pipe(upstream_reader, client_writer))
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    async with server:
+        await server.serve_forever()
+
+
+def start_proxy(port, ports):
+    """Run the proxy in its own process so it does not share the load generator's GIL"""
+    backends = ",".join(str(p) for p in ports)
+    process = subprocess.Popen([sys.executable, __file__, "--proxy", str(port), "--backends", backends])
+    wait_for(lambda: request(port, "GET", "/api/health")[0] == 200, 10, "proxy")
+    return process
+
+
+# === Nodes ===
+
+def request(port, method, path, body=None, headers=None, timeout=60):
+    """One request on a fresh connection: (status, body, headers), status 0 on connection errors"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        return response.status, response.read(), response.headers
+    except OSError:
+        return 0, b"", {}
+    finally:
+        conn.close()
+
+
+def wait_for(check, timeout, what):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if check():
+            return
+        time.sleep(0.5)
+    raise TimeoutError(f"{what} not ready after {timeout}s")
+
+
+def node_env(args, index, port, shared_dir):
+    env = dict(os.environ)
+    env.update({
+        "HOST": "127.0.0.1",
+        "PORT": str(port),
+        "DEBUG": "false",
+        "WEB_WORKERS": str(args.workers),
+        "ADMISSION_ENABLED": "false",  # every test request comes from 127.0.0.1
+        "FEEDBACK_DIR": str(shared_dir / "feedback"),
+        "TF_INTRA_OP_THREADS": "1",
+        "TF_INTER_OP_THREADS": "1",
+        "OMP_NUM_THREADS": "1",
+        "TF_CPP_MIN_LOG_LEVEL": "3"
+    })
+    if args.redis_url:
+        env.update({
+            "REDIS_URL": args.redis_url,
+            "SESSION_BACKEND": "redis",
+            "JOB_BACKEND": "redis",
+            "UPLOAD_BACKEND": "redis",
+            "UPLOAD_FOLDER": str(shared_dir / f"node{index}" / "uploads")
+        })
+    else:
+        env.update({
+            "SESSION_BACKEND": "sqlite",
+            "SESSION_DB_PATH": str(shared_dir / "sessions.sqlite3"),
+            "JOB_DB_PATH": str(shared_dir / "jobs.sqlite3"),
+            "UPLOAD_FOLDER": str(shared_dir / "uploads")
+        })
+    return env
+
+
+def start_nodes(args, shared_dir):
+    nodes = []
+    for index in range(args.nodes):
+        port = args.base_port + index
+        log_path = shared_dir / f"node{index}.log"
+        process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", str(BASE_DIR / "gunicorn.conf.py"), "app.main:app"],
+            cwd=str(BASE_DIR), env=node_env(args, index, port, shared_dir),
+            stdout=open(log_path, "wb"), stderr=subprocess.STDOUT
+        )
+        nodes.append((process, port, log_path))
+
+    for process, port, log_path in nodes:
+        try:
+            wait_for(lambda: request(port, "GET", "/api/health/ready")[0] == 200, args.startup_timeout, f"node :{port}")
+        except TimeoutError:
+            print(log_path.read_text(errors="replace")[-2000:])
+            raise
+        print(f"   ✅ node :{port} ready ({args.workers} worker{'s' if args.workers > 1 else ''})")
+    return nodes
+
+
+# === Load ===
+
+def test_image(path):
+    if path:
+        return Path(path).read_bytes()
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    leaf = np.clip(rng.normal((70, 140, 60), 25, (448, 448, 3)), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(leaf).save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def multipart(data):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="leaf.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def load_test(port, image, concurrency, duration):
+    """Upload from ``concurrency`` clients for ``duration`` seconds; returns stats and one client's cookie"""
+    latencies, errors, cookies = [], [0], [None] * concurrency
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(i):
+        while time.perf_counter() < deadline:
+            # Trailing bytes after the JPEG end marker make every upload unique,
+            # so single-flight does not merge concurrent requests
+            body, content_type = multipart(image + os.urandom(16))
+            headers = {"Content-Type": content_type}
+            if cookies[i]:
+                headers["Cookie"] = cookies[i]
+            start = time.perf_counter()
+            status, _, response_headers = request(port, "POST", "/api/predict/upload", body, headers)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+            set_cookie = response_headers.get("set-cookie") if status == 200 else None
+            if set_cookie:
+                cookies[i] = set_cookie.split(";")[0]
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ms = np.asarray(latencies or [0.0]) * 1000
+    return {
+        "throughput": len(latencies) / duration,
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "errors": errors[0]
+    }, cookies[0]
+
+
+def check_history(port, cookie, reads):
+    """Read one client's history on ``reads`` fresh connections; True if every node agrees"""
+    bodies = {request(port, "GET", "/api/history", headers={"Cookie": cookie})[1] for _ in range(reads)}
+    return len(bodies) == 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--nodes", type=int, default=2, help="Instances to start")
+    parser.add_argument("--workers", type=int, default=1, help="Gunicorn workers per instance")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent clients per node")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds of load per step")
+    parser.add_argument("--port", type=int, default=9100, help="Proxy port (nodes use the following ones)")
+    parser.add_argument("--redis-url", help="Share sessions, jobs and uploads through Redis")
+    parser.add_argument("--image", help="Image to upload (default: a synthetic leaf)")
+    parser.add_argument("--startup-timeout", type=float, default=180.0)
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary state directory and logs")
+    parser.add_argument("--proxy", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--backends", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.proxy:
+        backends = [("127.0.0.1", int(p)) for p in args.backends.split(",")]
+        try:
+            asyncio.run(serve_proxy(args.proxy, backends))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    args.base_port = args.port + 1
+    shared_dir = Path(tempfile.mkdtemp(prefix="plant-cluster-"))
+    cpus = os.cpu_count() or 1
+    print("=" * 60)
+    print(f"🌐 {args.nodes} nodes x {args.workers} worker(s), {cpus} CPUs, state in {shared_dir}"
+          f" ({'redis' if args.redis_url else 'sqlite'})")
+    if args.nodes * args.workers > cpus:
+        print("⚠️  More processes than CPUs: throughput cannot scale linearly")
+    print("=" * 60)
+
+    nodes, proxy = [], None
+    image = test_image(args.image)
+    try:
+        nodes = start_nodes(args, shared_dir)
+        ports = [port for _, port, _ in nodes]
+
+        rows, cookie = [], None
+        for count in range(1, len(ports) + 1):
+            proxy = start_proxy(args.port, ports[:count])
+            load_test(args.port, image, count, 2.0)  # warm connections and code paths
+            stats, cookie = load_test(args.port, image, args.concurrency * count, args.duration)
+            proxy.terminate()
+            proxy.wait()
+            proxy = None
+            rows.append((count, stats))
+            print(f"   {count} node{'s' if count > 1 else ' '}: {stats['throughput']:7.1f} req/s,"
+                  f" p50 {stats['p50']:6.0f} ms, p95 {stats['p95']:6.0f} ms, {stats['errors']} errors")
+
+        base = rows[0][1]["throughput"] or 1.0
+        print("=" * 60)
+        print(f"{'nodes':>5} {'req/s':>9} {'speedup':>8} {'efficiency':>11}")
+        for count, stats in rows:
+            speedup = stats["throughput"] / base
+            print(f"{count:>5} {stats['throughput']:>9.1f} {speedup:>7.2f}x {speedup / count:>10.0%}")
+
+        if cookie:
+            proxy = start_proxy(args.port, ports)
+            consistent = check_history(args.port, cookie, 2 * len(ports))
+            print("✅ History is the same on every node" if consistent
+                  else "❌ History differs between nodes")
+    finally:
+        if proxy is not None:
+            proxy.terminate()
+        for process, _, _ in nodes:
+            process.terminate()
+        for process, _, _ in nodes:
+            process.wait()
+        if args.keep:
+            print(f"📁 Logs and state kept in {shared_dir}")
+        else:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,92 @@ import pickle
 import json
 from pathlib import Path
 
+def build_mobilenet_model(num_classes=15, input_shape=(224, 224, 3), weights='imagenet', alpha=1.0):
+    """
+    Build MobileNetV2 with the classification head used by the app
+    
+    The model takes images in [0, 1] (what the serving fast path feeds it)
+    and rescales them to the [-1, 1] range MobileNetV2 was trained on.
+    
+    Args:
+        num_classes: Number of output classes
+        input_shape: (height, width, 3)
+        weights: 'imagenet' or None
+        alpha: Width multiplier (0.35 - 1.0, smaller is faster)
+    
+    Returns:
+        tuple: (model, base_model) - freeze/unfreeze ``base_model`` for fine-tuning
+    """
+    try:
+        from keras.applications import MobileNetV2
+        from keras.layers import Dense, GlobalAveragePooling2D, Dropout, Input, Rescaling
+        from keras.models import Model
+    except ImportError:
+        from tensorflow.keras.applications import MobileNetV2
+        from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, Input, Rescaling
+        from tensorflow.keras.models import Model
+    
+    base_model = MobileNetV2(
+        input_shape=tuple(input_shape),
+        include_top=False,
+        weights=weights,
+        alpha=alpha
+    )
+    
+    inputs = Input(shape=tuple(input_shape), name='image')
+    x = Rescaling(2.0, offset=-1.0, name='to_mobilenet_range')(inputs)
+    x = base_model(x)
+    x = GlobalAveragePooling2D()(x)
+    x = Dense(256, activation='relu', name='dense_1')(x)
+    x = Dropout(0.5, name='dropout_1')(x)
+    x = Dense(128, activation='relu', name='dense_2')(x)
+    x = Dropout(0.3, name='dropout_2')(x)
+    predictions = Dense(num_classes, activation='softmax', name='predictions')(x)
+    
+    return Model(inputs=inputs, outputs=predictions), base_model
+
+
+def build_tiny_cnn(num_classes=15, input_shape=(128, 128, 3), width=16):
+    """
+    Build a small separable-convolution network for distillation
+
+    Four stride-2 blocks of depthwise-separable convolutions with doubling
+    channels (``width`` ... ``8 * width``), meant to be trained from a
+    teacher's soft labels rather than from scratch on hard labels.
+
+    Args:
+        num_classes: Number of output classes
+        input_shape: (height, width, 3), images in [0, 1]
+        width: Channels of the first block
+
+    Returns:
+        keras Model with the same input/output contract as ``build_mobilenet_model``
+    """
+    try:
+        from keras.layers import (Activation, BatchNormalization, Conv2D, Dense, Dropout,
+                                  GlobalAveragePooling2D, Input, SeparableConv2D)
+        from keras.models import Model
+    except ImportError:
+        from tensorflow.keras.layers import (Activation, BatchNormalization, Conv2D, Dense, Dropout,
+                                             GlobalAveragePooling2D, Input, SeparableConv2D)
+        from tensorflow.keras.models import Model
+
+    inputs = Input(shape=tuple(input_shape), name='image')
+    x = Conv2D(width, 3, strides=2, padding='same', use_bias=False, name='stem')(inputs)
+    x = BatchNormalization(name='stem_bn')(x)
+    x = Activation('relu', name='stem_relu')(x)
+    for block, channels in enumerate((width * 2, width * 4, width * 8, width * 8), start=1):
+        x = SeparableConv2D(channels, 3, strides=2, padding='same', use_bias=False, name=f'block{block}_sep')(x)
+        x = BatchNormalization(name=f'block{block}_bn')(x)
+        x = Activation('relu', name=f'block{block}_relu')(x)
+    x = GlobalAveragePooling2D()(x)
+    x = Dense(128, activation='relu', name='dense_1')(x)
+    x = Dropout(0.3, name='dropout_1')(x)
+    predictions = Dense(num_classes, activation='softmax', name='predictions')(x)
+
+    return Model(inputs=inputs, outputs=predictions)
+
+
 def create_mobilenet_model():
     """Create MobileNetV2 model with Keras (no TensorFlow training needed)"""
     
@@ -18,41 +104,13 @@ def create_mobilenet_model():
     print("=" * 70)
     
     try:
-        # Try importing Keras standalone (works without full TensorFlow)
-        try:
-            from keras.applications import MobileNetV2
-            from keras.layers import Dense, GlobalAveragePooling2D, Dropout
-            from keras.models import Model
-            print("✅ Using Keras standalone")
-        except:
-            # Fallback to TensorFlow.Keras
-            from tensorflow.keras.applications import MobileNetV2
-            from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
-            from tensorflow.keras.models import Model
-            print("✅ Using TensorFlow.Keras")
-        
         print("\n📥 Loading MobileNetV2 with ImageNet weights...")
         
-        # Load pre-trained MobileNetV2
-        base_model = MobileNetV2(
-            input_shape=(224, 224, 3),
-            include_top=False,
-            weights='imagenet'  # Automatically downloads from Keras
-        )
+        # Pre-trained MobileNetV2 plus custom classification layers
+        model, base_model = build_mobilenet_model(num_classes=15, input_shape=(224, 224, 3))
         
         print("✅ Downloaded ImageNet weights (~14MB)")
         
-        # Add custom classification layers
-        x = base_model.output
-        x = GlobalAveragePooling2D()(x)
-        x = Dense(256, activation='relu', name='dense_1')(x)
-        x = Dropout(0.5, name='dropout_1')(x)
-        x = Dense(128, activation='relu', name='dense_2')(x)
-        x = Dropout(0.3, name='dropout_2')(x)
-        predictions = Dense(15, activation='softmax', name='predictions')(x)
-        
-        model = Model(inputs=base_model.input, outputs=predictions)
-        
         # Compile model
         model.compile(
             optimizer='adam',
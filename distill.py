@@ -0,0 +1,375 @@
+"""
+Distil small student models from a served teacher version for the CPU tier
+Chạy lệnh: python distill.py --teacher v2 --students mobilenet:0.35:128,tiny:16:128 --set-student
+
+1. The teacher (a registry version, default: the active one) scores the
+   training shards written by train.py once; its class probabilities are
+   cached next to the shards as soft labels.
+2. Every candidate student is trained on the shards (resized to its own
+   input size in tf.data) with the distillation loss
+       alpha * CE(label, p) + (1 - alpha) * T^2 * KL(teacher_T || student_T)
+   where ``_T`` are the probabilities softened by temperature T.
+3. Teacher and students are measured on the validation split (accuracy,
+   agreement with the teacher) and for single-image CPU latency, and the
+   latency/accuracy Pareto table is printed and saved as JSON.
+4. The most accurate student within --latency-budget is exported as a
+   registry version; --set-student makes it serve low-priority requests
+   (see STUDENT_PRIORITIES).
+
+Student specs are ``mobilenet:<alpha>:<size>`` (MobileNetV2 with a width
+multiplier) or ``tiny:<width>:<size>`` (create_tensorflow_model.build_tiny_cnn).
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from train import make_callbacks, read_shard_meta, shard_generator, export_version
+
+EPSILON = 1e-7
+
+
+# === Teacher soft labels ===
+
+def soft_label_file(shard, teacher):
+    return shard["labels"].replace("labels_", f"soft_{teacher}_")
+
+
+def teacher_probabilities(version, images, class_keys):
+    """
+    Teacher class probabilities for a uint8 batch, in shard class order
+
+    A version with a trained head is distilled from its raw outputs; a
+    rules-only version from its served scores.
+    """
+    from app.core.ml.model_handler import DISEASE_KEYS
+
+    if version.model is not None and version.config.get("classes"):
+        _, outputs = version.predict_features(images)
+        columns = [version.config["classes"].index(key) for key in class_keys]
+        probs = np.asarray(outputs)[:, columns]
+    else:
+        probs = version.score_batch(images)[:, [DISEASE_KEYS.index(key) for key in class_keys]]
+    return probs / np.clip(probs.sum(axis=1, keepdims=True), EPSILON, None)
+
+
+def cache_soft_labels(version, shard_dir, meta, class_keys, batch_size, rebuild=False):
+    """Score every shard with the teacher once and save ``soft_<teacher>_XXXXX.npy`` files"""
+    for split, info in meta["splits"].items():
+        split_dir = Path(shard_dir) / split
+        for shard in info["shards"]:
+            path = split_dir / soft_label_file(shard, version.name)
+            if path.exists() and not rebuild:
+                continue
+            images = np.load(split_dir / shard["images"], mmap_mode="r")
+            soft = np.empty((len(images), len(class_keys)), dtype=np.float32)
+            for start in range(0, len(images), batch_size):
+                chunk = np.ascontiguousarray(images[start:start + batch_size])
+                soft[start:start + len(chunk)] = teacher_probabilities(version, chunk, class_keys)
+            np.save(path, soft)
+            print(f"   🧑‍🏫 {split}/{path.name}: {len(soft)} soft labels")
+
+
+def load_soft_labels(shard_dir, meta, split, teacher):
+    split_dir = Path(shard_dir) / split
+    return [np.load(split_dir / soft_label_file(shard, teacher)) for shard in meta["splits"][split]["shards"]]
+
+
+# === Students ===
+
+def parse_student(spec):
+    """``mobilenet:0.35:128`` / ``tiny:16:128`` -> (spec, kind, width parameter, input size)"""
+    kind, width, size = spec.split(":")
+    if kind not in ("mobilenet", "tiny"):
+        raise ValueError(f"Unknown student kind '{kind}' in {spec}")
+    return {"spec": spec, "kind": kind, "width": float(width) if kind == "mobilenet" else int(width),
+            "size": int(size)}
+
+
+def build_student(student, num_classes, weights):
+    from create_tensorflow_model import build_mobilenet_model, build_tiny_cnn
+
+    input_shape = (student["size"], student["size"], 3)
+    if student["kind"] == "tiny":
+        return build_tiny_cnn(num_classes, input_shape, student["width"])
+    try:
+        model, base_model = build_mobilenet_model(num_classes, input_shape, weights, student["width"])
+    except Exception as e:
+        print(f"⚠️  Could not load {weights} weights for {student['spec']} ({e}); training from scratch")
+        model, base_model = build_mobilenet_model(num_classes, input_shape, None, student["width"])
+    base_model.trainable = True
+    return model
+
+
+def distillation_loss(num_classes, temperature, alpha):
+    """
+    Keras loss over ``y_true = [one-hot label | teacher probabilities]``
+
+    The student outputs probabilities (the serving contract), so both sides
+    are softened as softmax(log(p) / T).
+    """
+    import tensorflow as tf
+
+    def loss(y_true, y_pred):
+        labels, teacher = y_true[:, :num_classes], y_true[:, num_classes:]
+        log_student = tf.math.log(tf.clip_by_value(y_pred, EPSILON, 1.0))
+        hard = -tf.reduce_sum(labels * log_student, axis=1)
+
+        soft_teacher = tf.nn.softmax(tf.math.log(tf.clip_by_value(teacher, EPSILON, 1.0)) / temperature)
+        log_soft_student = tf.nn.log_softmax(log_student / temperature)
+        kl = tf.reduce_sum(soft_teacher * (tf.math.log(tf.clip_by_value(soft_teacher, EPSILON, 1.0))
+                                           - log_soft_student), axis=1)
+        return alpha * hard + (1.0 - alpha) * temperature ** 2 * kl
+    return loss
+
+
+def label_accuracy(num_classes):
+    import tensorflow as tf
+
+    def accuracy(y_true, y_pred):
+        return tf.cast(tf.equal(tf.argmax(y_true[:, :num_classes], axis=1), tf.argmax(y_pred, axis=1)), tf.float32)
+    return accuracy
+
+
+def make_distill_dataset(shard_dir, meta, split, soft_labels, size, batch_size, training, seed=0):
+    """
+    Stream ``(image resized to size, [one-hot | teacher probabilities])`` batches
+
+    Same shuffling/augmentation as train.make_dataset; the image is
+    area-resized to the student input like serving does.
+    """
+    import tensorflow as tf
+
+    info = meta["splits"][split]
+    height, width = meta["image_size"]
+    num_classes = len(meta["classes"])
+
+    dataset = tf.data.Dataset.from_generator(
+        shard_generator(Path(shard_dir) / split, info["shards"], training, seed, soft_labels),
+        output_signature=(
+            tf.TensorSpec((height, width, 3), tf.uint8),
+            tf.TensorSpec((), tf.int16),
+            tf.TensorSpec((num_classes,), tf.float32)
+        )
+    )
+
+    def prepare(image, label, soft):
+        image = tf.cast(image, tf.float32) / 255.0
+        if (height, width) != (size, size):
+            image = tf.image.resize(image, (size, size), method="area")
+        target = tf.concat([tf.one_hot(tf.cast(label, tf.int32), num_classes), soft], axis=0)
+        return image, target
+
+    def augment(image, target):
+        image = tf.image.random_flip_left_right(image)
+        image = tf.image.random_flip_up_down(image)
+        image = tf.image.random_brightness(image, 0.1)
+        return tf.clip_by_value(image, 0.0, 1.0), target
+
+    if training:
+        dataset = dataset.repeat().shuffle(min(4096, info["count"]), seed=seed)
+        dataset = dataset.map(prepare, num_parallel_calls=tf.data.AUTOTUNE)
+        dataset = dataset.map(augment, num_parallel_calls=tf.data.AUTOTUNE)
+    else:
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(info["count"]))
+        dataset = dataset.map(prepare, num_parallel_calls=tf.data.AUTOTUNE).cache()
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def train_student(student, meta, shard_dir, soft, checkpoint_dir, epochs, batch_size, learning_rate,
+                  temperature, alpha, weights, patience=3):
+    """Train one student with the distillation loss, returning the model"""
+    try:
+        from keras.optimizers import Adam
+    except ImportError:
+        from tensorflow.keras.optimizers import Adam
+
+    num_classes = len(meta["classes"])
+    model = build_student(student, num_classes, weights)
+    model.compile(optimizer=Adam(learning_rate), loss=distillation_loss(num_classes, temperature, alpha),
+                  metrics=[label_accuracy(num_classes)])
+
+    train_ds = make_distill_dataset(shard_dir, meta, "train", soft["train"], student["size"], batch_size, True)
+    val_ds = None
+    if "validation" in soft:
+        val_ds = make_distill_dataset(shard_dir, meta, "validation", soft["validation"], student["size"],
+                                      batch_size, False)
+    steps = max(1, meta["splits"]["train"]["count"] // batch_size)
+
+    print(f"🎓 Distilling {student['spec']} ({model.count_params():,} params): {epochs} epochs x {steps} steps")
+    model.fit(train_ds, validation_data=val_ds, epochs=epochs, steps_per_epoch=steps,
+              callbacks=make_callbacks(checkpoint_dir, "distill", patience) if val_ds is not None else [])
+    return model
+
+
+# === Measurement ===
+
+def evaluate(predict, meta, shard_dir, split, soft_labels, size, batch_size):
+    """
+    Accuracy against the labels and top-1 agreement with the teacher
+
+    Args:
+        predict: Callable mapping a float batch at ``size`` to probabilities
+    """
+    dataset = make_distill_dataset(shard_dir, meta, split, soft_labels, size, batch_size, False)
+    num_classes = len(meta["classes"])
+    correct = agree = total = 0
+    for images, targets in dataset:
+        targets = targets.numpy()
+        predicted = np.argmax(predict(images.numpy()), axis=1)
+        correct += int((predicted == targets[:, :num_classes].argmax(axis=1)).sum())
+        agree += int((predicted == targets[:, num_classes:].argmax(axis=1)).sum())
+        total += len(targets)
+    return correct / max(total, 1), agree / max(total, 1)
+
+
+def measure_latency(model, size, runs=50):
+    """Median single-image forward time in ms through a traced graph (the serving fast path)"""
+    from app.core.ml.fast_path import forward
+    from app.core.ml.warmup import trace_model
+
+    traced = trace_model(model, [1], (size, size))
+    image = np.random.default_rng(0).integers(0, 256, (1, size, size, 3), dtype=np.uint8)
+    for _ in range(5):
+        forward(model, traced, image)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        forward(model, traced, image)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+
+def pareto_front(rows):
+    """Mark rows no other row beats on both latency and accuracy"""
+    for row in rows:
+        row["pareto"] = not any(
+            other["latency_ms"] <= row["latency_ms"] and other["accuracy"] >= row["accuracy"]
+            and (other["latency_ms"] < row["latency_ms"] or other["accuracy"] > row["accuracy"])
+            for other in rows
+        )
+    return rows
+
+
+def print_table(rows):
+    print("=" * 86)
+    print(f"{'model':<24} | {'input':>5} | {'params':>10} | {'MB':>6} | {'ms':>7} | {'acc':>6} | {'agree':>6} | pareto")
+    print("-" * 86)
+    for row in sorted(rows, key=lambda r: r["latency_ms"]):
+        print(f"{row['model']:<24} | {row['input_size']:>5} | {row['params']:>10,} | {row['size_mb']:6.2f} | "
+              f"{row['latency_ms']:7.2f} | {row['accuracy']:6.3f} | {row['agreement']:6.3f} | "
+              f"{'*' if row['pareto'] else ''}")
+    print("=" * 86)
+
+
+def choose_student(rows, latency_budget):
+    """Most accurate student within the budget, else the fastest one"""
+    students = [row for row in rows if row["role"] == "student"]
+    within = [row for row in students if latency_budget is None or row["latency_ms"] <= latency_budget]
+    if within:
+        return max(within, key=lambda r: (r["accuracy"], -r["latency_ms"]))
+    print(f"⚠️  No student under {latency_budget} ms; using the fastest one")
+    return min(students, key=lambda r: r["latency_ms"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--shards", default="data/shards", help="Shard directory from train.py")
+    parser.add_argument("--teacher", default=None, help="Teacher version (default: the active one)")
+    parser.add_argument("--students", default="mobilenet:0.35:128,mobilenet:0.35:160,tiny:16:128",
+                        help="Comma-separated student specs")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--learning-rate", type=float, default=1e-3)
+    parser.add_argument("--temperature", type=float, default=4.0, help="Distillation temperature")
+    parser.add_argument("--alpha", type=float, default=0.3, help="Weight of the hard-label loss")
+    parser.add_argument("--weights", default="imagenet", help="MobileNet students: 'imagenet' or 'none'")
+    parser.add_argument("--rebuild-soft-labels", action="store_true")
+    parser.add_argument("--latency-budget", type=float, default=None, help="Max single-image ms for export")
+    parser.add_argument("--checkpoints", default="data/checkpoints", help="Checkpoint directory")
+    parser.add_argument("--report", default=None, help="Pareto table JSON (default: models/<version>/distill_report.json)")
+    parser.add_argument("--version", default=None, help="Registry version name (default: <teacher>-student)")
+    parser.add_argument("--set-student", action="store_true", help="Serve low-priority requests with it")
+    args = parser.parse_args()
+
+    from app.core.ml.fast_path import configure_threads
+    from app.core.ml.model_registry import ModelRegistry, DEFAULT_VERSION
+
+    configure_threads()
+    shard_dir = Path(args.shards)
+    meta = read_shard_meta(shard_dir)
+    if meta is None or "train" not in meta["splits"]:
+        print(f"❌ No shards in {shard_dir}; run train.py first")
+        return
+    class_keys = [key or name for key, name in zip(meta["keys"], meta["classes"])]
+
+    registry = ModelRegistry()
+    teacher_name = args.teacher or registry.read_manifest().get("active") or DEFAULT_VERSION
+    print(f"🧑‍🏫 Loading teacher '{teacher_name}'...")
+    teacher = registry.load_version(teacher_name)
+    cache_soft_labels(teacher, shard_dir, meta, class_keys, args.batch_size, args.rebuild_soft_labels)
+    soft = {split: load_soft_labels(shard_dir, meta, split, teacher_name) for split in meta["splits"]}
+    eval_split = "validation" if "validation" in soft else "train"
+
+    rows = []
+    teacher_size = teacher.input_size[0]
+    accuracy, agreement = evaluate(
+        lambda batch: teacher_probabilities(teacher, np.rint(batch * 255.0).astype(np.uint8), class_keys),
+        meta, shard_dir, eval_split, soft[eval_split], teacher_size, args.batch_size
+    )
+    teacher_path = registry._resolve_path(teacher.config)
+    rows.append({
+        "model": f"teacher:{teacher_name}", "role": "teacher", "input_size": teacher_size,
+        "params": teacher.model.count_params() if teacher.model is not None else 0,
+        "size_mb": teacher_path.stat().st_size / (1024 * 1024) if teacher_path.exists() else 0.0,
+        "latency_ms": measure_latency(teacher.model, teacher_size) if teacher.model is not None else 0.0,
+        "accuracy": accuracy, "agreement": agreement
+    })
+
+    version = args.version or f"{teacher_name}-student"
+    weights = None if args.weights.lower() == "none" else args.weights
+    models = {}
+    for spec in args.students.split(","):
+        student = parse_student(spec.strip())
+        start = time.perf_counter()
+        model = train_student(student, meta, shard_dir, soft, Path(args.checkpoints) / version / spec.replace(":", "_"),
+                              args.epochs, args.batch_size, args.learning_rate, args.temperature, args.alpha, weights)
+        print(f"⏱️  {spec} trained in {(time.perf_counter() - start) / 60:.1f} min")
+
+        accuracy, agreement = evaluate(lambda batch: model(batch, training=False).numpy(), meta, shard_dir,
+                                       eval_split, soft[eval_split], student["size"], args.batch_size)
+        models[student["spec"]] = (model, student)
+        rows.append({
+            "model": student["spec"], "role": "student", "input_size": student["size"],
+            "params": model.count_params(), "size_mb": model.count_params() * 4 / (1024 * 1024),
+            "latency_ms": measure_latency(model, student["size"]),
+            "accuracy": accuracy, "agreement": agreement
+        })
+
+    print_table(pareto_front(rows))
+
+    best = choose_student(rows, args.latency_budget)
+    model, student = models[best["model"]]
+    size = student["size"]
+    export_version(model, meta, version, best["accuracy"], input_size=(size, size), role="student",
+                   teacher=teacher_name, student_spec=best["model"], latency_ms=round(best["latency_ms"], 3),
+                   teacher_agreement=best["agreement"], distill_temperature=args.temperature)
+
+    report = Path(args.report) if args.report else registry.models_dir / version / "distill_report.json"
+    with open(report, "w", encoding="utf-8") as f:
+        json.dump({"teacher": teacher_name, "split": eval_split, "exported": best["model"],
+                   "version": version, "rows": rows}, f, indent=2)
+    print(f"📁 Pareto table written to {report}")
+
+    if args.set_student:
+        registry.write_manifest(student=version)
+        print(f"🎓 '{version}' now serves low-priority requests")
+    else:
+        print(f"   Serve it for low-priority requests with POST /api/models/{version}/student")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Fit per crop/region score calibration (temperature + class priors)
+Chạy lệnh: python fit_calibration.py labels.csv --scores-out scores.csv
+
+Input CSV columns:
+    image   - image path (relative to the CSV), not needed when scores are given
+    label   - class key (khoe_manh, benh_dom_la, ...) or Vietnamese class name
+    crop    - optional crop type
+    region  - optional growing region
+    <key>   - optional precomputed score per class key (from --scores-out)
+
+Images without score columns are bulk-scored with the active model version
+first. A temperature and per-class bias are fitted for every crop/region
+group (and the crop/*, */region and */* fallbacks) with at least
+--min-samples rows, and saved to models/calibration.npz for serving.
+"""
+
+import argparse
+import csv
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+
+def read_rows(csv_path):
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def label_index(label, disease_keys):
+    """Class index for a key or Vietnamese name, None when unknown"""
+    from app.core.ml.model_handler import class_key
+    key = class_key(label or "")
+    return None if key is None else disease_keys.index(key)
+
+
+def bulk_score(rows, base_dir, disease_keys, batch_size):
+    """Score rows without precomputed scores, in batches"""
+    from app.config import settings
+    from app.core.ml.model_handler import score_batch
+    from app.core.ml.preprocessing import preprocess_image
+
+    scores = np.zeros((len(rows), len(disease_keys)))
+    todo = [i for i, row in enumerate(rows) if not all(row.get(k) for k in disease_keys)]
+    for i in set(range(len(rows))) - set(todo):
+        scores[i] = [float(rows[i][k]) for k in disease_keys]
+
+    if todo:
+        print(f"🔍 Scoring {len(todo)} images...")
+    for start in range(0, len(todo), batch_size):
+        chunk = todo[start:start + batch_size]
+        batch = np.concatenate([
+            preprocess_image(str(base_dir / rows[i]["image"]), settings.IMG_SIZE,
+                             crop_leaf=settings.ROI_CROP_ENABLED)
+            for i in chunk
+        ])
+        chunk_scores, _ = score_batch(batch)
+        scores[chunk] = chunk_scores
+        print(f"   {min(start + batch_size, len(todo))}/{len(todo)} images")
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("csv", help="Labeled CSV")
+    parser.add_argument("--output", default=None, help="Output .npz (default: CALIBRATION_PATH)")
+    parser.add_argument("--scores-out", help="Write the CSV with per-class scores for reuse")
+    parser.add_argument("--min-samples", type=int, default=50, help="Minimum rows to fit a group")
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    from app.config import settings
+    from app.core.ml import calibration
+    from app.core.ml.model_handler import DISEASE_KEYS
+
+    disease_keys = list(DISEASE_KEYS)
+    csv_path = Path(args.csv)
+    rows = read_rows(csv_path)
+
+    indices = [label_index(row.get("label"), disease_keys) for row in rows]
+    labels = np.array([-1 if idx is None else idx for idx in indices])
+    unknown = int((labels < 0).sum())
+    if unknown:
+        print(f"⚠️  Skipping {unknown} rows with unknown labels")
+    rows = [row for row, label in zip(rows, labels) if label >= 0]
+    labels = labels[labels >= 0]
+    if not rows:
+        print("❌ No labeled rows")
+        return
+
+    scores = bulk_score(rows, csv_path.parent, disease_keys, args.batch_size)
+
+    if args.scores_out:
+        fields = list(dict.fromkeys(list(rows[0].keys()) + disease_keys))
+        with open(args.scores_out, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for row, row_scores in zip(rows, scores):
+                writer.writerow({**row, **{k: f"{v:.6g}" for k, v in zip(disease_keys, row_scores)}})
+        print(f"📁 Scores written to {args.scores_out}")
+
+    # Every row counts towards its exact group and the three fallbacks
+    members = defaultdict(list)
+    for i, row in enumerate(rows):
+        crop, region = calibration.group_parts(row.get("crop"), row.get("region"))
+        for key in {f"{crop}/{region}", f"{crop}/*", f"*/{region}", "*/*"}:
+            members[key].append(i)
+
+    groups, temperatures, biases, counts = [], [], [], []
+    print("=" * 60)
+    print(f"{'group':<28} | {'n':>6} | {'T':>6} | {'NLL before':>10} | {'after':>6}")
+    for key in sorted(members, key=lambda k: (k.count("*"), k)):
+        idx = np.array(members[key])
+        if len(idx) < args.min_samples:
+            continue
+        temperature, bias, nll = calibration.fit_group(scores[idx], labels[idx], len(disease_keys))
+        before = calibration.negative_log_likelihood(
+            np.log(np.clip(scores[idx], calibration.EPSILON, None)), labels[idx], 1.0, 0.0)
+        groups.append(key)
+        temperatures.append(temperature)
+        biases.append(bias)
+        counts.append(len(idx))
+        print(f"{key:<28} | {len(idx):>6} | {temperature:6.2f} | {before:10.3f} | {nll:6.3f}")
+    print("=" * 60)
+
+    if not groups:
+        print(f"❌ No group has {args.min_samples} samples; nothing saved")
+        return
+
+    output = Path(args.output or settings.CALIBRATION_PATH)
+    calibration.save_table(output, groups, temperatures, np.array(biases), counts=np.array(counts))
+    print(f"✅ Calibration for {len(groups)} groups saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Gunicorn configuration - production run mode with several Uvicorn workers
+Chạy lệnh: gunicorn -c gunicorn.conf.py app.main:app   (hoặc: python run.py --prod)
+
+With WEB_PRELOAD the app and the ML modules (NumPy, Pillow, Keras) are
+imported once in the master and the workers share those pages copy-on-write.
+The garbage collector is off while preloading and the heap is frozen before
+every fork, so collections in the workers do not write to (and copy) the
+shared objects. WEB_PRELOAD_MODEL also loads the active model version in the
+master; that is only done without Keras, because TensorFlow's thread pools
+do not survive fork. To share one Keras model between workers, run the
+inference server (INFERENCE_SERVER_ENABLED).
+
+Every worker must see the same sessions/history, jobs and uploads, so those
+live behind SESSION_BACKEND, JOB_BACKEND and UPLOAD_BACKEND (sqlite/local
+for the workers of one host, redis across nodes). Rate limits and
+single-flight stay per worker; the embedding index is turned off, since
+its files take a single writer.
+"""
+
+import gc
+
+from app.config import settings
+from app.core import memory
+
+gc.disable()
+
+# MEMORY_LIMIT_MB may lower the worker count
+memory.get_budget()
+
+workers = settings.WEB_WORKER_COUNT
+worker_class = "uvicorn_worker.UvicornWorker"
+bind = f"{settings.HOST}:{settings.PORT}"
+preload_app = settings.WEB_PRELOAD
+timeout = settings.WEB_TIMEOUT
+graceful_timeout = 30
+max_requests = settings.WEB_MAX_REQUESTS
+max_requests_jitter = settings.WEB_MAX_REQUESTS // 10
+# Only these peers may set the client address through X-Forwarded-For;
+# trusting everyone would let a client pick the IP its limits are keyed on
+forwarded_allow_ips = settings.WEB_FORWARDED_ALLOW_IPS
+
+if workers > 1 and settings.SESSION_BACKEND == "memory":
+    # An in-process store would give every worker its own history
+    settings.SESSION_BACKEND = "sqlite"
+    print("ℹ️  SESSION_BACKEND=memory is per process, using sqlite for the workers")
+
+if workers > 1 and settings.EMBEDDING_INDEX_ENABLED:
+    # Every worker would append to the same meta.json and memmap rows
+    settings.EMBEDDING_INDEX_ENABLED = False
+    print("⚠️  The embedding index has one writer per process, disabled for several workers")
+
+
+def when_ready(server):
+    """Runs in the master after the app is preloaded, before the first fork"""
+    if not settings.WEB_PRELOAD:
+        return
+    from app.core.ml import model_handler
+    if settings.WEB_PRELOAD_MODEL and not model_handler.HAS_KERAS and not settings.INFERENCE_SERVER_ENABLED:
+        from app.core.ml.model_registry import get_registry
+        get_registry()
+        print("✅ Model preloaded in the master")
+    gc.collect()
+    print(f"🚀 Starting {workers} workers on {bind}")
+
+
+def pre_fork(server, worker):
+    # Objects of the master move to the permanent generation the workers never scan
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
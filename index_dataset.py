@@ -0,0 +1,240 @@
+"""
+Index training images: validate, hash and cluster near-duplicates
+Chạy lệnh: python index_dataset.py data/train data/validation
+
+Every image under the given folders is checked in a process pool with the
+upload validation (``validate_image``) plus a full decode, and gets a
+SHA-256 content hash and a 64-bit perceptual dHash. Near-duplicates are
+found with a banded LSH index over the dHash bits (hashes sharing any
+band become candidates, confirmed by Hamming distance) and merged with
+exact content duplicates into clusters.
+
+The result is written to data/dataset_index.json. Re-runs only process
+files whose size or modification time changed. train.py reads the index
+(--index) to skip invalid files, keep one image per cluster and keep
+clusters from straddling the train/validation split.
+"""
+
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+HASH_BITS = 64
+INDEX_VERSION = 1
+
+
+def list_files(folders):
+    """Resolved paths of every image under ``folders``, with (size, mtime)"""
+    files = {}
+    for folder in folders:
+        for path in sorted(Path(folder).rglob("*")):
+            if path.suffix.lower() in IMAGE_SUFFIXES and path.is_file():
+                stat = path.stat()
+                files[str(path.resolve())] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def inspect_image(path):
+    """
+    Validate and hash one image (runs in a worker process)
+
+    Returns:
+        dict: ``valid``, ``error``, ``sha256`` and hex ``dhash`` (None when invalid)
+    """
+    from PIL import Image
+    from app.core.ml.preprocessing import validate_image
+    from app.utils.hashing import file_hash, dhash
+
+    entry = {"valid": False, "error": None, "sha256": None, "dhash": None}
+    try:
+        entry["sha256"] = file_hash(path)
+        if not validate_image(path):
+            entry["error"] = "validation failed"
+            return entry
+        # verify() does not decode pixel data; truncated files only fail here
+        with Image.open(path) as img:
+            entry["dhash"] = f"{dhash(img):016x}"
+        entry["valid"] = True
+    except Exception as e:
+        entry["error"] = str(e)
+    return entry
+
+
+def _inspect(path):
+    return path, inspect_image(path)
+
+
+def load_index(path):
+    """Read an index file, None when missing or from another format version"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    return index if index.get("version") == INDEX_VERSION else None
+
+
+def popcount(values):
+    """Set bits per uint64"""
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class UnionFind:
+    def __init__(self, n):
+        self.parent = np.arange(n)
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def candidate_pairs(hashes, bands, max_bucket):
+    """
+    Banded LSH: pairs of hashes equal on at least one band of bits
+
+    Args:
+        hashes: uint64 array
+        bands: Number of bands the 64 bits are split into
+        max_bucket: Buckets larger than this (e.g. flat images) are skipped
+
+    Returns:
+        numpy array: (P, 2) unique index pairs, i < j
+    """
+    width = HASH_BITS // bands
+    mask = np.uint64((1 << width) - 1)
+    pairs = []
+    for band in range(bands):
+        keys = (hashes >> np.uint64(band * width)) & mask
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(keys)])
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            if size > max_bucket:
+                continue
+            members = order[start:start + size]
+            i, j = np.triu_indices(size, k=1)
+            pairs.append(np.stack([members[i], members[j]], axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.intp)
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def cluster(paths, entries, bands, max_distance, max_bucket):
+    """
+    Group valid images into exact and near-duplicate clusters
+
+    Returns:
+        tuple: ({path: representative path}, number of LSH candidate pairs)
+    """
+    valid = [p for p in paths if entries[p]["valid"]]
+    uf = UnionFind(len(valid))
+
+    first_by_sha = {}
+    for i, path in enumerate(valid):
+        j = first_by_sha.setdefault(entries[path]["sha256"], i)
+        if j != i:
+            uf.union(i, j)
+
+    hashes = np.array([int(entries[p]["dhash"], 16) for p in valid], dtype=np.uint64)
+    pairs = candidate_pairs(hashes, bands, max_bucket)
+    if len(pairs):
+        distance = popcount(hashes[pairs[:, 0]] ^ hashes[pairs[:, 1]])
+        for a, b in pairs[distance <= max_distance]:
+            uf.union(int(a), int(b))
+
+    # Sorted paths, so the root (smallest index) is the first path of its cluster
+    return {path: valid[uf.find(i)] for i, path in enumerate(valid)}, len(pairs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("folders", nargs="+", help="Image folders (e.g. data/train data/validation)")
+    parser.add_argument("--output", default="data/dataset_index.json", help="Index file")
+    parser.add_argument("--bands", type=int, default=8,
+                        help="LSH bands over the 64 dHash bits; pairs under --bands differing bits are always found")
+    parser.add_argument("--max-distance", type=int, default=6, help="Max differing bits for near-duplicates")
+    parser.add_argument("--max-bucket", type=int, default=256, help="Skip LSH buckets larger than this")
+    parser.add_argument("--workers", type=int, default=None, help="Processes (default: CPU count)")
+    parser.add_argument("--full", action="store_true", help="Re-process every file")
+    args = parser.parse_args()
+
+    if HASH_BITS % args.bands:
+        parser.error(f"--bands must divide {HASH_BITS}")
+    if args.max_distance >= args.bands:
+        print(f"⚠️  Some pairs within {args.max_distance} bits may be missed; use --bands above it")
+
+    output = Path(args.output)
+    previous = None if args.full else load_index(output)
+    old_images = previous["images"] if previous else {}
+
+    files = list_files(args.folders)
+    entries = {}
+    todo = []
+    for path, (size, mtime) in files.items():
+        old = old_images.get(path)
+        if old and old["size"] == size and old["mtime"] == mtime:
+            entries[path] = old
+        else:
+            todo.append(path)
+    print(f"🗂️  {len(files)} images: {len(files) - len(todo)} unchanged, {len(todo)} to process")
+
+    start = time.perf_counter()
+    if todo:
+        with Pool(args.workers or os.cpu_count() or 1) as pool:
+            for done, (path, entry) in enumerate(pool.imap_unordered(_inspect, todo, chunksize=16), start=1):
+                entry["size"], entry["mtime"] = files[path]
+                entries[path] = entry
+                if done % 1000 == 0:
+                    print(f"   {done}/{len(todo)} images")
+    print(f"⏱️  Hashed in {time.perf_counter() - start:.1f}s")
+
+    paths = sorted(entries)
+    representatives, candidates = cluster(paths, entries, args.bands, args.max_distance, args.max_bucket)
+    for path in paths:
+        rep = representatives.get(path)
+        entries[path]["duplicate_of"] = rep if rep is not None and rep != path else None
+
+    invalid = [p for p in paths if not entries[p]["valid"]]
+    duplicates = [p for p in paths if entries[p]["duplicate_of"]]
+    clusters = len({representatives[p] for p in duplicates})
+
+    index = {
+        "version": INDEX_VERSION,
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "folders": [str(Path(f).resolve()) for f in args.folders],
+        "params": {"bands": args.bands, "max_distance": args.max_distance},
+        "images": {p: entries[p] for p in paths}
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    tmp_path.replace(output)
+
+    print("=" * 60)
+    print(f"❌ Invalid: {len(invalid)}")
+    for path in invalid[:10]:
+        print(f"   {path}: {entries[path]['error']}")
+    print(f"♻️  Duplicates: {len(duplicates)} images in {clusters} clusters ({candidates} LSH candidate pairs)")
+    print(f"✅ Index written to {output}")
+
+
+if __name__ == "__main__":
+    main()
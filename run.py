@@ -1,10 +1,27 @@
 """
 FastAPI Application Runner
-Chạy lệnh: python run.py
+Chạy lệnh: python run.py                       (development, auto-reload)
+           python run.py --prod [--workers N]  (production, Gunicorn + Uvicorn workers)
 """
+import argparse
+import os
+import sys
+from pathlib import Path
+
 import uvicorn
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Plant Disease Detection API")
+    parser.add_argument("--prod", action="store_true", help="Production mode with gunicorn.conf.py")
+    parser.add_argument("--workers", type=int, help="Worker processes in production mode (overrides WEB_WORKERS)")
+    args = parser.parse_args()
+
+    if args.prod:
+        if args.workers:
+            os.environ["WEB_WORKERS"] = str(args.workers)
+        config = str(Path(__file__).parent / "gunicorn.conf.py")
+        os.execv(sys.executable, [sys.executable, "-m", "gunicorn", "-c", config, "app.main:app"])
+
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
@@ -24,6 +24,91 @@ const stopWebcamBtn = document.getElementById('stopWebcamBtn');
 const historyList = document.getElementById('historyList');
 const clearHistoryBtn = document.getElementById('clearHistoryBtn');
 
+// ===== CLIENT CONFIG & RESIZING =====
+
+// Upload parameters from /api/config; the defaults match the server's
+const DEFAULT_CONFIG = {
+    max_side: 448,
+    formats: ['image/jpeg', 'image/png'],
+    quality: 0.85,
+    max_file_size: 16 * 1024 * 1024
+};
+let clientConfigPromise = null;
+
+function getClientConfig() {
+    if (!clientConfigPromise) {
+        clientConfigPromise = fetch('/api/config')
+            .then(response => response.ok ? response.json() : DEFAULT_CONFIG)
+            .catch(() => DEFAULT_CONFIG);
+    }
+    return clientConfigPromise;
+}
+
+// First accepted lossy format this browser can encode (Safari cannot encode WebP)
+function pickOutputFormat(config) {
+    const probe = document.createElement('canvas');
+    probe.width = probe.height = 1;
+    for (const type of config.formats) {
+        if (type === 'image/png') continue;
+        if (probe.toDataURL(type).startsWith(`data:${type}`)) return type;
+    }
+    return 'image/jpeg';
+}
+
+// Draw a source (image, bitmap, video) scaled so its longest side is at most maxSide
+function drawScaled(source, width, height, maxSide) {
+    const scale = Math.min(1, maxSide / Math.max(width, height));
+    const target = document.createElement('canvas');
+    target.width = Math.round(width * scale);
+    target.height = Math.round(height * scale);
+    const ctx = target.getContext('2d');
+    ctx.imageSmoothingQuality = 'high';
+    ctx.drawImage(source, 0, 0, target.width, target.height);
+    return target;
+}
+
+async function decodeImage(file) {
+    if (window.createImageBitmap) {
+        try {
+            return await createImageBitmap(file, { imageOrientation: 'from-image' });
+        } catch (error) {
+            // Fall through to <img> decoding
+        }
+    }
+    const url = URL.createObjectURL(file);
+    try {
+        const img = new Image();
+        img.src = url;
+        await img.decode();
+        return img;
+    } finally {
+        URL.revokeObjectURL(url);
+    }
+}
+
+// Downscale and re-encode a picked file; keeps the original when that is smaller
+async function prepareUpload(file) {
+    const config = await getClientConfig();
+    try {
+        const image = await decodeImage(file);
+        const width = image.naturalWidth || image.width;
+        const height = image.naturalHeight || image.height;
+        const scaled = drawScaled(image, width, height, config.max_side);
+        if (image.close) image.close();
+        
+        const type = pickOutputFormat(config);
+        const blob = await new Promise(resolve => scaled.toBlob(resolve, type, config.quality));
+        if (!blob || blob.size >= file.size) return file;
+        
+        const extension = type === 'image/webp' ? 'webp' : 'jpg';
+        const name = file.name.replace(/\.[^.]*$/, '') + '.' + extension;
+        return new File([blob], name, { type });
+    } catch (error) {
+        console.warn('Resize failed, uploading original:', error);
+        return file;
+    }
+}
+
 // ===== FILE UPLOAD =====
 
 // Drag and drop handlers
@@ -53,31 +138,31 @@ fileInput.addEventListener('change', (e) => {
     }
 });
 
-function handleFileSelect(file) {
+async function handleFileSelect(file) {
     // Validate file type
-    const validTypes = ['image/png', 'image/jpeg', 'image/jpg'];
+    const validTypes = ['image/png', 'image/jpeg', 'image/jpg', 'image/webp'];
     if (!validTypes.includes(file.type)) {
-        alert('Vui lòng chọn file ảnh (PNG, JPG, JPEG)');
+        alert('Vui lòng chọn file ảnh (PNG, JPG, JPEG, WEBP)');
         return;
     }
     
+    // Downscale in the browser; the model only needs a small image
+    const upload = await prepareUpload(file);
+    
     // Validate file size (16MB)
-    if (file.size > 16 * 1024 * 1024) {
+    if (upload.size > 16 * 1024 * 1024) {
         alert('File quá lớn. Kích thước tối đa là 16MB');
         return;
     }
     
     // Store file for upload
-    currentImageData = file;
+    currentImageData = upload;
     
     // Show preview
-    const reader = new FileReader();
-    reader.onload = (e) => {
-        previewImage.src = e.target.result;
-        previewSection.hidden = false;
-        resultsSection.hidden = true;
-    };
-    reader.readAsDataURL(file);
+    if (previewImage.src.startsWith('blob:')) URL.revokeObjectURL(previewImage.src);
+    previewImage.src = URL.createObjectURL(upload);
+    previewSection.hidden = false;
+    resultsSection.hidden = true;
 }
 
 // ===== WEBCAM =====
@@ -99,17 +184,17 @@ startWebcamBtn.addEventListener('click', async () => {
     }
 });
 
-captureBtn.addEventListener('click', () => {
-    // Set canvas size to match video
-    canvas.width = webcam.videoWidth;
-    canvas.height = webcam.videoHeight;
+captureBtn.addEventListener('click', async () => {
+    const config = await getClientConfig();
     
-    // Draw current frame to canvas
-    const ctx = canvas.getContext('2d');
-    ctx.drawImage(webcam, 0, 0);
+    // Draw the current frame, downscaled to what the server uses
+    const scaled = drawScaled(webcam, webcam.videoWidth, webcam.videoHeight, config.max_side);
+    canvas.width = scaled.width;
+    canvas.height = scaled.height;
+    canvas.getContext('2d').drawImage(scaled, 0, 0);
     
     // Get image as base64
-    const imageDataUrl = canvas.toDataURL('image/jpeg');
+    const imageDataUrl = canvas.toDataURL(pickOutputFormat(config), config.quality);
     currentImageData = imageDataUrl;
     
     // Show preview
@@ -136,6 +221,82 @@ function stopWebcam() {
     }
 }
 
+// ===== ON-DEVICE FALLBACK =====
+
+const provisionalNotice = document.getElementById('provisionalNotice');
+const syncStatus = document.getElementById('syncStatus');
+let treatmentsPromise = null;
+
+// Class labels and treatments keyed by class key, from /api/treatments (cached by the service worker)
+function getTreatments() {
+    if (!treatmentsPromise) {
+        treatmentsPromise = fetch('/api/treatments')
+            .then(response => response.ok ? response.json() : { classes: [] })
+            .catch(() => ({ classes: [] }))
+            .then(data => Object.fromEntries(data.classes.map(item => [item.key, item])));
+    }
+    return treatmentsPromise;
+}
+
+// Result shaped like the API's, scored in the browser by the color/texture rules
+async function provisionalResult() {
+    try {
+        const [config, treatments] = await Promise.all([getClientConfig(), getTreatments()]);
+        const scores = PlantRules.scoreImage(previewImage, config.input_size);
+        const labels = Object.fromEntries(Object.entries(treatments).map(([key, item]) => [key, item.label]));
+        const predictions = PlantRules.toPredictions(scores, labels, 3);
+        const entry = treatments[predictions[0].class_index];
+        return {
+            image_url: previewImage.src,
+            top_prediction: predictions[0],
+            all_predictions: predictions,
+            treatment: entry ? entry.treatment : {
+                diagnosis: '-', treatment: '-', prevention: '', severity: 'unknown'
+            }
+        };
+    } catch (error) {
+        console.warn('On-device analysis failed:', error);
+        return null;
+    }
+}
+
+function showNotice(message) {
+    provisionalNotice.textContent = message;
+    provisionalNotice.hidden = !message;
+}
+
+// Current image as a Blob for the offline queue (webcam captures are data URLs)
+async function currentImageBlob() {
+    if (typeof currentImageData !== 'string') {
+        return { blob: currentImageData, name: currentImageData.name || 'image.jpg' };
+    }
+    const blob = await (await fetch(currentImageData)).blob();
+    return { blob, name: blob.type === 'image/webp' ? 'webcam.webp' : 'webcam.jpg' };
+}
+
+async function updateSyncStatus() {
+    try {
+        const pending = await OfflineQueue.count();
+        syncStatus.textContent = `⏳ ${pending} ảnh đang chờ gửi lên máy chủ khi có mạng`;
+        syncStatus.hidden = pending === 0;
+    } catch (error) {
+        syncStatus.hidden = true;
+    }
+}
+
+// Upload images analyzed while offline, then refresh the history
+async function syncPending() {
+    try {
+        const sent = await OfflineQueue.sync();
+        if (sent > 0) loadHistory();
+    } catch (error) {
+        console.warn('Offline sync failed:', error);
+    }
+    updateSyncStatus();
+}
+
+window.addEventListener('online', syncPending);
+
 // ===== ANALYZE IMAGE =====
 
 analyzeBtn.addEventListener('click', async () => {
@@ -149,27 +310,45 @@ analyzeBtn.addEventListener('click', async () => {
     previewSection.hidden = true;
     resultsSection.hidden = true;
     
+    // Provisional diagnosis from the on-device rules while the server works
+    const provisional = await provisionalResult();
+    if (provisional) {
+        loadingIndicator.hidden = true;
+        showNotice('⚡ Kết quả sơ bộ trên thiết bị – đang chờ máy chủ xác nhận...');
+        displayResults(provisional);
+    }
+    
     try {
         let response;
         
-        if (typeof currentImageData === 'string') {
-            // Webcam base64 data
-            response = await fetch('/api/predict/webcam', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ image: currentImageData })
-            });
-        } else {
-            // File upload
-            const formData = new FormData();
-            formData.append('file', currentImageData);
-            
-            response = await fetch('/api/predict/upload', {
-                method: 'POST',
-                body: formData
-            });
+        try {
+            if (typeof currentImageData === 'string') {
+                // Webcam base64 data
+                response = await fetch('/api/predict/webcam?explain=true', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({ image: currentImageData })
+                });
+            } else {
+                // File upload
+                const formData = new FormData();
+                formData.append('file', currentImageData);
+                
+                response = await fetch('/api/predict/upload?explain=true', {
+                    method: 'POST',
+                    body: formData
+                });
+            }
+        } catch (networkError) {
+            // Offline: keep the provisional result and send the image later
+            const { blob, name } = await currentImageBlob();
+            await OfflineQueue.add(blob, name);
+            updateSyncStatus();
+            if (!provisional) throw networkError;
+            showNotice('📴 Không có mạng – đây là kết quả sơ bộ trên thiết bị. Ảnh sẽ được gửi lên máy chủ khi có mạng.');
+            return;
         }
         
         if (!response.ok) {
@@ -178,12 +357,17 @@ analyzeBtn.addEventListener('click', async () => {
         }
         
         const result = await response.json();
+        showNotice('');
         displayResults(result);
         loadHistory();
         
     } catch (error) {
         console.error('Error:', error);
-        alert('Lỗi khi phân tích ảnh: ' + error.message);
+        if (provisional) {
+            showNotice('⚠️ Máy chủ lỗi (' + error.message + ') – đây là kết quả sơ bộ trên thiết bị.');
+        } else {
+            alert('Lỗi khi phân tích ảnh: ' + error.message);
+        }
     } finally {
         loadingIndicator.hidden = true;
     }
@@ -200,6 +384,7 @@ function displayResults(result) {
     
     // Display image
     document.getElementById('resultImage').src = result.image_url;
+    displayExplanation(result.explanation);
     
     // Main prediction
     const topPrediction = result.top_prediction;
@@ -236,6 +421,60 @@ function displayResults(result) {
     displayTreatment(result.treatment);
 }
 
+// ===== EXPLANATION OVERLAY =====
+
+// Disease layers from the rules masks (the healthy "green" layer is not drawn)
+const EXPLAIN_COLORS = {
+    pale: [255, 255, 255, 150],
+    yellow: [245, 158, 11, 150],
+    brown: [180, 83, 9, 160],
+    dark: [127, 29, 29, 170],
+    spots: [239, 68, 68, 200]
+};
+
+const explainOverlay = document.getElementById('explainOverlay');
+const explainToggle = document.getElementById('explainToggle');
+const explainToggleLabel = document.getElementById('explainToggleLabel');
+
+function displayExplanation(explanation) {
+    explainOverlay.hidden = true;
+    explainToggleLabel.hidden = !explanation;
+    if (!explanation) return;
+    
+    // Decode run lengths (background first) straight into RGBA pixels
+    const { width, height, layers, box } = explanation;
+    explainOverlay.width = width;
+    explainOverlay.height = height;
+    const ctx = explainOverlay.getContext('2d');
+    const image = ctx.createImageData(width, height);
+    
+    for (const [name, color] of Object.entries(EXPLAIN_COLORS)) {
+        const counts = layers[name] || [];
+        let pos = 0;
+        for (let i = 0; i < counts.length; i++) {
+            if (i % 2 === 1) {
+                for (let p = pos; p < pos + counts[i]; p++) {
+                    image.data.set(color, p * 4);
+                }
+            }
+            pos += counts[i];
+        }
+    }
+    ctx.putImageData(image, 0, 0);
+    
+    // Place the overlay over the region the masks cover
+    const [left, top, right, bottom] = box;
+    explainOverlay.style.left = `${left * 100}%`;
+    explainOverlay.style.top = `${top * 100}%`;
+    explainOverlay.style.width = `${(right - left) * 100}%`;
+    explainOverlay.style.height = `${(bottom - top) * 100}%`;
+    explainOverlay.hidden = !explainToggle.checked;
+}
+
+explainToggle.addEventListener('change', () => {
+    explainOverlay.hidden = !explainToggle.checked;
+});
+
 function displayTop3Predictions(predictions) {
     const container = document.getElementById('top3Predictions');
     container.innerHTML = '';
@@ -281,6 +520,7 @@ newAnalysisBtn.addEventListener('click', () => {
     currentImageData = null;
     previewSection.hidden = true;
     resultsSection.hidden = true;
+    showNotice('');
     previewImage.src = '';
     fileInput.value = '';
 });
@@ -334,7 +574,10 @@ clearHistoryBtn.addEventListener('click', async () => {
     }
 });
 
-// Load history on page load
+// Load history and upload settings on page load, and send anything queued offline
 document.addEventListener('DOMContentLoaded', () => {
     loadHistory();
+    getClientConfig();
+    syncPending();
+    OfflineQueue.registerServiceWorker();
 });
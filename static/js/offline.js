@@ -0,0 +1,88 @@
+// Offline support: service worker registration and a queue of uploads made without a connection
+//
+// Images analyzed offline are kept in IndexedDB and posted to /api/predict/upload
+// once the browser is back online, so they end up in the server-side history.
+
+const OfflineQueue = (() => {
+    const DB_NAME = 'plant-disease';
+    const STORE = 'pending-uploads';
+    let dbPromise = null;
+    let syncing = false;
+
+    function openDb() {
+        if (!dbPromise) {
+            dbPromise = new Promise((resolve, reject) => {
+                const request = indexedDB.open(DB_NAME, 1);
+                request.onupgradeneeded = () => {
+                    request.result.createObjectStore(STORE, { keyPath: 'id', autoIncrement: true });
+                };
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => reject(request.error);
+            });
+        }
+        return dbPromise;
+    }
+
+    async function withStore(mode, fn) {
+        const db = await openDb();
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction(STORE, mode);
+            const request = fn(tx.objectStore(STORE));
+            tx.oncomplete = () => resolve(request && request.result);
+            tx.onerror = () => reject(tx.error);
+        });
+    }
+
+    // Queue an image (Blob) with its file name for upload when online
+    function add(blob, name) {
+        return withStore('readwrite', store => store.add({ blob, name, createdAt: Date.now() }));
+    }
+
+    function all() {
+        return withStore('readonly', store => store.getAll());
+    }
+
+    function remove(id) {
+        return withStore('readwrite', store => store.delete(id));
+    }
+
+    async function count() {
+        return (await all()).length;
+    }
+
+    // Upload queued images in order; stops at the first network failure
+    async function sync() {
+        if (syncing || !navigator.onLine) return 0;
+        syncing = true;
+        let sent = 0;
+        try {
+            for (const item of await all()) {
+                const formData = new FormData();
+                formData.append('file', item.blob, item.name);
+                let response;
+                try {
+                    response = await fetch('/api/predict/upload', { method: 'POST', body: formData });
+                } catch (error) {
+                    break;
+                }
+                if (response.status === 429 || response.status >= 500) break;
+                // Accepted, or rejected for good (4xx): either way it leaves the queue
+                await remove(item.id);
+                sent++;
+            }
+        } finally {
+            syncing = false;
+        }
+        return sent;
+    }
+
+    function registerServiceWorker() {
+        if ('serviceWorker' in navigator) {
+            navigator.serviceWorker.register('/sw.js').catch(error => {
+                console.warn('Service worker registration failed:', error);
+            });
+        }
+    }
+
+    return { add, all, count, sync, registerServiceWorker };
+})();
@@ -0,0 +1,141 @@
+// On-device port of the color/texture rules (model_handler.advanced_disease_detection_batch)
+//
+// Gives a provisional diagnosis before the server answers, or while offline.
+// HSV quantization follows Pillow like rgb_to_hsv_batch; the scores of the
+// classes without rules use the mean of the server's random jitter, so the
+// result is deterministic.
+
+const PlantRules = (() => {
+    // Same order as DISEASE_KEYS in app/core/ml/model_handler.py
+    const DISEASE_KEYS = [
+        'khoe_manh', 'benh_dom_la', 'benh_vang_la', 'benh_phan_trang',
+        'benh_dao_on', 'benh_gia_phan', 'benh_heo_xanh', 'benh_xoan_la',
+        'benh_kham_virus', 'benh_than_thu', 'benh_thoi_re', 'benh_dom_vong',
+        'benh_kham_la', 'benh_thoi_qua', 'benh_heo_ru'
+    ];
+    const NUM_RULED = 8;
+    const JITTER_MEAN = 0.75;  // mean of uniform(0.3, 1.2)
+
+    const f32 = Math.fround;
+    const clip = (x, lo, hi) => Math.min(hi, Math.max(lo, x));
+
+    // Pillow's RGB -> HSV, each channel quantized to 0-255 (float32 steps as in numpy)
+    function rgbToHsv(r, g, b) {
+        const maxc = Math.max(r, g, b);
+        const cr = maxc - Math.min(r, g, b);
+        if (cr === 0) return [0, 0, maxc];
+        const s = f32(cr / maxc);
+        const rc = f32((maxc - r) / cr);
+        const gc = f32((maxc - g) / cr);
+        const bc = f32((maxc - b) / cr);
+        let h;
+        if (r === maxc) h = f32(bc - gc);
+        else if (g === maxc) h = f32(2.0 + rc - bc);
+        else h = f32(4.0 + gc - rc);
+        h = f32((h / 6.0 + 1.0) % 1.0);
+        return [clip(Math.trunc(h * 255.0), 0, 255), clip(Math.trunc(s * 255.0), 0, 255), maxc];
+    }
+
+    // Scores in DISEASE_KEYS order for RGBA pixels (ImageData.data) of a width x height image
+    function score(pixels, width, height) {
+        const n = width * height;
+        const gray = new Float64Array(n);
+        let green = 0, yellow = 0, brown = 0, pale = 0, dark = 0;
+        let sSum = 0, vSum = 0, sum = 0, sumSq = 0;
+
+        for (let i = 0; i < n; i++) {
+            const r = pixels[i * 4], g = pixels[i * 4 + 1], b = pixels[i * 4 + 2];
+            const [h8, s8, v8] = rgbToHsv(r, g, b);
+            const h = h8 / 255, s = s8 / 255, v = v8 / 255;
+
+            if (h > 0.15 && h < 0.4 && s > 0.2) green++;
+            if (h > 0.08 && h < 0.18 && s > 0.3) yellow++;
+            if (h < 0.12 && v < 0.6) brown++;
+            if (s < 0.2 && v > 0.6) pale++;
+            if (v < 0.3 && s > 0.2) dark++;
+            sSum += s;
+            vSum += v;
+
+            const rf = r / 255, gf = g / 255, bf = b / 255;
+            sum += rf + gf + bf;
+            sumSq += rf * rf + gf * gf + bf * bf;
+            gray[i] = (rf + gf + bf) / 3;
+        }
+
+        // np.gradient (one-sided at the borders) and scipy's laplace with reflected borders
+        const at = (y, x) => gray[y * width + x];
+        let edgeCount = 0, spotCount = 0;
+        for (let y = 0; y < height; y++) {
+            const up = Math.max(y - 1, 0), down = Math.min(y + 1, height - 1);
+            for (let x = 0; x < width; x++) {
+                const left = Math.max(x - 1, 0), right = Math.min(x + 1, width - 1);
+                const c = at(y, x);
+                const gy = (at(down, x) - at(up, x)) / (y === 0 || y === height - 1 ? 1 : 2);
+                const gx = (at(y, right) - at(y, left)) / (x === 0 || x === width - 1 ? 1 : 2);
+                if (Math.abs(gy) + Math.abs(gx) > 0.1) edgeCount++;
+                const lap = at(up, x) + at(down, x) + at(y, left) + at(y, right) - 4 * c;
+                if (Math.abs(lap) > 0.3) spotCount++;
+            }
+        }
+
+        const greenRatio = green / n, yellowRatio = yellow / n, brownRatio = brown / n;
+        const paleRatio = pale / n, darkSpotRatio = dark / n;
+        const edgeDensity = edgeCount / n, spotRatio = spotCount / n;
+        const mean = sum / (3 * n);
+        const variance = sumSq / (3 * n) - mean * mean;
+        const sMean = sSum / n, vMean = vSum / n;
+
+        const scores = new Float64Array(DISEASE_KEYS.length);
+        scores[0] = clip(greenRatio * 0.6 +
+            (variance < 0.02 && yellowRatio < 0.2 && brownRatio < 0.1 ? 0.3 : 0), 0.05, 0.95);
+        scores[1] = clip(spotRatio * 0.4 + darkSpotRatio * 0.3 + yellowRatio * 0.2 +
+            (spotRatio > 0.1 || darkSpotRatio > 0.05 ? 0.2 : 0), 0.05, 0.85);
+        scores[2] = clip(yellowRatio * 0.6 +
+            (yellowRatio > 0.3 && greenRatio < 0.4 ? 0.25 : 0), 0.05, 0.85);
+        scores[3] = clip(paleRatio * 0.5 +
+            (paleRatio > 0.2 && sMean < 0.3 ? 0.3 : 0), 0.05, 0.80);
+        scores[4] = clip(brownRatio * 0.4 + edgeDensity * 0.3 +
+            (brownRatio > 0.3 || (variance > 0.03 && vMean < 0.5) ? 0.2 : 0), 0.05, 0.80);
+        scores[5] = clip(yellowRatio * 0.3 + paleRatio * 0.2 + variance * 2 +
+            (yellowRatio > 0.2 && variance > 0.025 ? 0.2 : 0), 0.05, 0.75);
+        scores[6] = clip(0.1 + (greenRatio > 0.4 && vMean < 0.5 ? 0.3 : 0), 0.05, 0.70);
+        scores[7] = clip(edgeDensity * 0.4 + (edgeDensity > 0.3 ? 0.2 : 0), 0.05, 0.70);
+
+        let assigned = 0;
+        for (let k = 0; k < NUM_RULED; k++) assigned += scores[k];
+        const remaining = Math.max(0.1, 1.0 - assigned) / (DISEASE_KEYS.length - NUM_RULED);
+        for (let k = NUM_RULED; k < DISEASE_KEYS.length; k++) scores[k] = remaining * JITTER_MEAN;
+
+        const total = scores.reduce((a, b) => a + b, 0);
+        return scores.map(x => x / total);
+    }
+
+    // Score an <img>, bitmap or canvas resized to the model input like preprocess_image
+    function scoreImage(source, inputSize) {
+        const [height, width] = inputSize || [224, 224];
+        const canvas = document.createElement('canvas');
+        canvas.width = width;
+        canvas.height = height;
+        const ctx = canvas.getContext('2d', { willReadFrequently: true });
+        ctx.imageSmoothingQuality = 'high';
+        ctx.drawImage(source, 0, 0, width, height);
+        return score(ctx.getImageData(0, 0, width, height).data, width, height);
+    }
+
+    // Top-k prediction dicts shaped like the API's (class, class_index, confidence 0-100)
+    function toPredictions(scores, labels, topK = 3) {
+        return DISEASE_KEYS
+            .map((key, i) => ({
+                class: (labels && labels[key]) || key,
+                class_index: key,
+                confidence: scores[i] * 100,
+                model_version: 'on-device'
+            }))
+            .sort((a, b) => b.confidence - a.confidence)
+            .slice(0, topK);
+    }
+
+    return { DISEASE_KEYS, score, scoreImage, toPredictions };
+})();
+
+if (typeof module !== 'undefined') module.exports = PlantRules;
@@ -0,0 +1,63 @@
+// Service worker: caches the app shell and treatment data for offline use
+// Rendered by pages.service_worker; the cache name changes with every asset build.
+
+const CACHE = 'plant-disease-{{ version }}';
+const SHELL = {{ shell | tojson }};
+const DATA = ['/api/treatments', '/api/config'];
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE)
+            .then(cache => cache.addAll([...SHELL, ...DATA]))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys.filter(key => key !== CACHE).map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+// Network first, cached copy when offline
+async function networkFirst(request, cacheKey) {
+    const cache = await caches.open(CACHE);
+    try {
+        const response = await fetch(request);
+        if (response.ok) cache.put(cacheKey || request, response.clone());
+        return response;
+    } catch (error) {
+        const cached = await cache.match(cacheKey || request);
+        if (cached) return cached;
+        throw error;
+    }
+}
+
+// Cache first: fingerprinted assets never change under the same URL
+async function cacheFirst(request) {
+    const cached = await caches.match(request);
+    if (cached) return cached;
+    const response = await fetch(request);
+    if (response.ok) {
+        const cache = await caches.open(CACHE);
+        cache.put(request, response.clone());
+    }
+    return response;
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    if (request.mode === 'navigate') {
+        event.respondWith(networkFirst(request, '/'));
+    } else if (DATA.includes(url.pathname)) {
+        event.respondWith(networkFirst(request));
+    } else if (url.pathname.startsWith('/static/') && !url.pathname.startsWith('/static/uploads/')) {
+        event.respondWith(cacheFirst(request));
+    }
+});
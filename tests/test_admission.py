@@ -0,0 +1,140 @@
+"""
+Token buckets, the AIMD concurrency limit and bucket selection
+"""
+
+import threading
+
+import pytest
+
+from app.config import settings
+from app.core.admission import AIMDLimiter, BACKOFF, TokenBuckets, bucket_keys
+
+
+# === TokenBuckets ===
+
+def test_take_admits_burst_then_reports_wait():
+    buckets = TokenBuckets(max_clients=10)
+    keys = [("ip:1", 2.0, 3)]
+    assert [buckets.take(keys, now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Empty: one token takes 1 / rate seconds
+    assert buckets.take(keys, now=0.0) == pytest.approx(0.5)
+
+
+def test_take_refills_at_rate_up_to_burst():
+    buckets = TokenBuckets(max_clients=10)
+    keys = [("ip:1", 2.0, 3)]
+    for _ in range(3):
+        buckets.take(keys, now=0.0)
+    assert buckets.take(keys, now=0.5) == 0.0
+    assert buckets.take(keys, now=0.5) > 0
+    # A long pause refills only up to the burst
+    assert [buckets.take(keys, now=100.0) for _ in range(4)][-1] > 0
+
+
+def test_take_is_all_or_nothing_across_buckets():
+    buckets = TokenBuckets(max_clients=10)
+    ip, session = ("ip:1", 10.0, 5), ("session:a", 1.0, 1)
+    assert buckets.take([ip, session], now=0.0) == 0.0
+    # The session bucket is empty, so the IP bucket must not be charged either
+    for _ in range(10):
+        assert buckets.take([ip, session], now=0.0) > 0
+    assert [buckets.take([ip], now=0.0) for _ in range(4)] == [0.0] * 4
+
+
+def test_take_evicts_least_recently_used_clients():
+    buckets = TokenBuckets(max_clients=2)
+    buckets.take([("a", 1.0, 1)], now=0.0)
+    buckets.take([("b", 1.0, 1)], now=0.0)
+    buckets.take([("c", 1.0, 1)], now=0.0)
+    # "a" was evicted and starts with a full bucket again
+    assert buckets.take([("a", 1.0, 1)], now=0.0) == 0.0
+    assert buckets.take([("c", 1.0, 1)], now=0.0) > 0
+
+
+def test_take_never_admits_more_than_burst_under_contention():
+    buckets = TokenBuckets(max_clients=10)
+    keys = [("ip:1", 1e-9, 50)]
+    admitted = []
+
+    def client():
+        for _ in range(20):
+            if buckets.take(keys, now=0.0) == 0.0:
+                admitted.append(1)
+
+    threads = [threading.Thread(target=client) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(admitted) == 50
+
+
+# === AIMDLimiter ===
+
+def test_acquire_stops_at_limit():
+    limiter = AIMDLimiter(initial=2, minimum=1, maximum=8, target_seconds=1.0)
+    assert limiter.acquire() and limiter.acquire()
+    assert not limiter.acquire()
+    limiter.release(0.1, now=0.0)
+    assert limiter.acquire()
+
+
+def test_fast_completions_at_the_limit_grow_it_additively():
+    limiter = AIMDLimiter(initial=2, minimum=1, maximum=8, target_seconds=1.0)
+    limiter.acquire()
+    limiter.acquire()
+    limiter.release(0.1, now=0.0)
+    assert limiter.limit == pytest.approx(2.5)
+
+
+def test_fast_completions_below_the_limit_do_not_grow_it():
+    limiter = AIMDLimiter(initial=4, minimum=1, maximum=8, target_seconds=1.0)
+    limiter.acquire()
+    limiter.release(0.1, now=0.0)
+    assert limiter.limit == 4.0
+
+
+def test_slow_completions_back_off_once_per_target_interval():
+    limiter = AIMDLimiter(initial=10, minimum=1, maximum=16, target_seconds=1.0)
+    for _ in range(3):
+        limiter.acquire()
+    limiter.release(2.0, now=10.0)
+    limiter.release(2.0, now=10.5)
+    assert limiter.limit == pytest.approx(10 * BACKOFF)
+    limiter.release(2.0, now=11.0)
+    assert limiter.limit == pytest.approx(10 * BACKOFF * BACKOFF)
+
+
+def test_limit_stays_within_bounds():
+    limiter = AIMDLimiter(initial=2, minimum=2, maximum=3, target_seconds=1.0)
+    for step in range(20):
+        limiter.acquire()
+        limiter.release(5.0, now=float(step * 2))
+    assert limiter.limit == 2
+    for _ in range(50):
+        while limiter.acquire():
+            pass
+        for _ in range(limiter.in_flight):
+            limiter.release(0.1, now=100.0)
+    assert limiter.limit == 3
+
+
+# === bucket_keys ===
+
+def scope(headers=(), client=("10.0.0.1", 1234)):
+    return {"headers": list(headers), "client": client}
+
+
+def test_unknown_api_key_is_limited_by_ip(monkeypatch):
+    monkeypatch.setattr(settings, "API_KEYS", "good-key")
+    keys = bucket_keys(scope([(b"x-api-key", b"random")]))
+    assert keys[0][0] == "ip:10.0.0.1"
+    assert keys[0][1:] == (settings.ADMISSION_IP_RATE, settings.ADMISSION_IP_BURST)
+
+
+def test_configured_api_key_has_its_own_bucket(monkeypatch):
+    monkeypatch.setattr(settings, "API_KEYS", "other, good-key")
+    keys = bucket_keys(scope([(b"x-api-key", b"good-key")]))
+    assert len(keys) == 1
+    assert keys[0][0].startswith("key:")
+    assert keys[0][1:] == (settings.ADMISSION_RATE, settings.ADMISSION_BURST)
@@ -0,0 +1,36 @@
+"""
+Calibration group keys and lookup
+"""
+
+import numpy as np
+
+from app.core.ml.calibration import CalibrationTable, calibrate, group_key, group_parts
+
+
+def table(groups):
+    return CalibrationTable(groups, [2.0] * len(groups), np.zeros((len(groups), 3)))
+
+
+def test_group_key_normalizes_missing_and_case():
+    assert group_key(None, " ") == "*/*"
+    assert group_key(" Rice ", "Mekong") == "rice/mekong"
+
+
+def test_slash_in_crop_or_region_is_escaped():
+    assert group_parts("rice/japonica", "a/b") == ("rice%2Fjaponica", "a%2Fb")
+    assert group_key("rice/japonica").count("/") == 1
+
+
+def test_lookup_falls_back_from_most_specific():
+    calibration = table(["rice/mekong", "rice/*", "*/*"])
+    assert calibration.lookup("rice", "mekong") == 0
+    assert calibration.lookup("rice", "delta") == 1
+    assert calibration.lookup("corn", None) == 2
+
+
+def test_lookup_with_slash_in_crop():
+    calibration = table(["rice%2Fjaponica/*", "*/*"])
+    assert calibration.lookup("rice/japonica", "mekong") == 0
+    assert calibration.lookup("rice/japonica/x", None) == 1
+    scores = calibrate(np.array([0.7, 0.2, 0.1]), crop="rice/japonica", table=calibration)
+    assert scores.shape == (3,) and np.isclose(scores.sum(), 1.0)
@@ -0,0 +1,163 @@
+"""
+SQLite job store: atomic claims, per-client concurrency and crash recovery
+"""
+
+import threading
+
+import pytest
+
+from app.core.jobs import SQLiteJobStore, new_job
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteJobStore(tmp_path / "jobs.sqlite3")
+
+
+def submit(store, client="ip:1", priority="normal", created_at=None):
+    job = new_job(client, "predict", {"images": []}, 1, priority)
+    if created_at is not None:
+        job["created_at"] = created_at
+    store.submit(job)
+    return job["id"]
+
+
+def test_claim_takes_highest_priority_then_oldest(store):
+    old = submit(store, client="a", created_at=1.0)
+    new = submit(store, client="b", created_at=2.0)
+    high = submit(store, client="c", priority="high", created_at=3.0)
+    claimed = [store.claim(client_limit=5)["id"] for _ in range(3)]
+    assert claimed == [high, old, new]
+    assert store.claim(client_limit=5) is None
+
+
+def test_claim_marks_running_and_counts_attempts(store):
+    job_id = submit(store)
+    job = store.claim(client_limit=1)
+    assert job["id"] == job_id
+    assert job["status"] == "running"
+    assert job["attempts"] == 1
+    assert job["heartbeat"] is not None
+
+
+def test_claim_respects_per_client_concurrency(store):
+    first = submit(store, client="a", created_at=1.0)
+    submit(store, client="a", created_at=2.0)
+    other = submit(store, client="b", created_at=3.0)
+    assert store.claim(client_limit=1)["id"] == first
+    # Client "a" is at its limit, so its second job waits behind "b"
+    assert store.claim(client_limit=1)["id"] == other
+    assert store.claim(client_limit=1) is None
+    store.finish(first, 1, [])
+    assert store.claim(client_limit=1)["client"] == "a"
+
+
+def test_concurrent_claims_hand_out_each_job_once(store):
+    ids = {submit(store, client=f"c{i}") for i in range(40)}
+    claimed, lock = [], threading.Lock()
+
+    def worker():
+        while True:
+            job = store.claim(client_limit=1)
+            if job is None:
+                return
+            with lock:
+                claimed.append(job["id"])
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(ids)
+
+
+def test_recover_requeues_stale_jobs(store):
+    job_id = submit(store)
+    store.claim(client_limit=1)
+    assert store.recover(stale_seconds=60, max_attempts=3) == (0, 0)
+    assert store.recover(stale_seconds=-1, max_attempts=3) == (1, 0)
+    job = store.get(job_id)
+    assert job["status"] == "queued"
+    assert job["heartbeat"] is None
+    assert store.claim(client_limit=1)["attempts"] == 2
+
+
+def test_recover_fails_jobs_out_of_attempts(store):
+    job_id = submit(store)
+    store.claim(client_limit=1)
+    assert store.recover(stale_seconds=-1, max_attempts=1) == (0, 1)
+    job = store.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "worker lost too many times"
+
+
+def test_late_finish_after_recover_is_ignored(store):
+    job_id = submit(store)
+    store.claim(client_limit=1)
+    store.recover(stale_seconds=-1, max_attempts=3)
+    # The lost worker reports back after its job was requeued
+    store.progress(job_id, 1, 1, [{"late": True}])
+    store.finish(job_id, 1, [{"late": True}])
+    store.fail(job_id, 1, "late")
+    job = store.get(job_id)
+    assert job["status"] == "queued"
+    assert job["results"] == []
+    assert store.unfinished("ip:1") == 1
+
+
+def test_late_finish_after_reclaim_is_ignored(store):
+    job_id = submit(store)
+    lost = store.claim(client_limit=1)
+    store.recover(stale_seconds=-1, max_attempts=3)
+    current = store.claim(client_limit=1)
+    assert current["attempts"] == lost["attempts"] + 1
+
+    # The job is running again, but under the new claim
+    store.progress(job_id, lost["attempts"], 1, [{"late": "A"}])
+    store.finish(job_id, lost["attempts"], [{"late": "A"}])
+    store.fail(job_id, lost["attempts"], "late")
+    assert store.get(job_id)["status"] == "running"
+    assert store.get(job_id)["results"] == []
+
+    store.finish(job_id, current["attempts"], [{"ok": "B"}])
+    job = store.get(job_id)
+    assert (job["status"], job["results"]) == ("done", [{"ok": "B"}])
+
+
+# === Redis store (needs fakeredis with Lua support) ===
+
+@pytest.fixture
+def redis_store(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    import redis
+    from app.core.jobs import RedisJobStore
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url",
+                        classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs)))
+    return RedisJobStore("redis://test")
+
+
+def test_redis_late_finish_after_recover_keeps_counts(redis_store):
+    job_id = submit(redis_store)
+    redis_store.claim(client_limit=1)
+    redis_store.redis.hset(redis_store._key(job_id), "heartbeat", 0)
+    assert redis_store.recover(stale_seconds=60, max_attempts=3) == (1, 0)
+
+    redis_store.fail(job_id, 1, "late")
+    assert redis_store.get(job_id)["status"] == "queued"
+    assert int(redis_store.redis.hget(redis_store.counts_key, "ip:1")) == 0
+
+    redis_store.claim(client_limit=1)
+    # Reclaimed: the lost worker's claim no longer matches
+    redis_store.progress(job_id, 1, 1, [{"late": True}])
+    redis_store.finish(job_id, 1, [{"late": True}])
+    assert redis_store.get(job_id)["status"] == "running"
+    assert redis_store.get(job_id)["results"] == []
+    assert int(redis_store.redis.hget(redis_store.counts_key, "ip:1")) == 1
+
+    redis_store.finish(job_id, 2, [{"ok": True}])
+    job = redis_store.get(job_id)
+    assert (job["status"], job["results"]) == ("done", [{"ok": True}])
+    assert int(redis_store.redis.hget(redis_store.counts_key, "ip:1")) == 0
@@ -0,0 +1,125 @@
+"""
+Server-side session change detection and loading
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from types import SimpleNamespace
+
+from app.core.sessions import (LazySession, MemorySessionStore, SQLiteSessionStore, ServerSessionMiddleware,
+                               load_session)
+
+
+def stored(data):
+    store = MemorySessionStore(max_entries=10)
+    store.save("sid", json.dumps(data, ensure_ascii=False), ttl=60)
+    return store
+
+
+def test_changes_is_none_until_loaded():
+    store = stored({"history": []})
+    session = LazySession(store, "sid")
+    assert session.changes() is None
+    assert session.id == "sid"
+
+
+def test_changes_is_none_when_only_read():
+    session = LazySession(stored({"history": [{"disease": "khoe_manh"}]}), "sid")
+    assert session["history"][0]["disease"] == "khoe_manh"
+    assert session.changes() is None
+
+
+def test_changes_detects_in_place_mutation():
+    session = LazySession(stored({"history": []}), "sid")
+    session["history"].insert(0, {"disease": "benh_dom_la"})
+    assert json.loads(session.changes()) == {"history": [{"disease": "benh_dom_la"}]}
+
+
+def test_changes_is_empty_string_when_session_emptied():
+    session = LazySession(stored({"history": []}), "sid")
+    del session["history"]
+    assert session.changes() == ""
+
+
+def test_new_session_with_data_is_saved():
+    session = LazySession(MemorySessionStore(max_entries=10), None)
+    assert session.changes() is None
+    session["history"] = []
+    assert session.changes() == '{"history": []}'
+
+
+def test_unknown_cookie_id_is_not_adopted():
+    session = LazySession(MemorySessionStore(max_entries=10), "client-chosen")
+    assert len(session) == 0
+    assert session.id is None
+    # Nothing to save or delete for an empty unknown session
+    assert session.changes() is None
+
+
+def test_load_session_reads_blocking_stores_once(tmp_path):
+    store = SQLiteSessionStore(tmp_path / "sessions.sqlite3")
+    store.save("sid", '{"history": [1]}', ttl=60)
+    session = LazySession(store, "sid")
+    request = SimpleNamespace(session=session)
+
+    assert not session.loaded
+    loaded = asyncio.run(load_session(request))
+    assert loaded is session and session.loaded
+    store.delete("sid")
+    # Already loaded: reading no longer touches the store
+    assert session["history"] == [1]
+
+
+def test_sqlite_touch_extends_expiry_at_most_once_per_interval(tmp_path):
+    store = SQLiteSessionStore(tmp_path / "sessions.sqlite3")
+    store.save("sid", "{}", ttl=10)
+
+    def expires():
+        with sqlite3.connect(store.path) as conn:
+            return conn.execute("SELECT expires FROM sessions WHERE id = 'sid'").fetchone()[0]
+
+    before = expires()
+    store.touch("sid", ttl=1000)
+    touched = expires()
+    assert touched > before + 900
+    store.touch("sid", ttl=1000)
+    assert expires() == touched
+
+
+def session_app(store, monkeypatch):
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+    from starlette.testclient import TestClient
+    from app.core import sessions
+
+    monkeypatch.setattr(sessions, "_store", store)
+
+    async def history(request):
+        session = await load_session(request)
+        return JSONResponse(session.get("history", []))
+
+    async def add(request):
+        session = await load_session(request)
+        session["history"] = session.get("history", []) + [1]
+        return JSONResponse(session["history"])
+
+    app = Starlette(routes=[Route("/history", history), Route("/add", add, methods=["POST"])])
+    return TestClient(ServerSessionMiddleware(app, max_age=100))
+
+
+def test_reading_an_unchanged_session_refreshes_it(monkeypatch):
+    store = MemorySessionStore(max_entries=10)
+    client = session_app(store, monkeypatch)
+    assert "set-cookie" not in client.get("/history").headers
+
+    assert client.post("/add").json() == [1]
+    session_id = client.cookies.get("plant_disease_session")
+    store.save(session_id, '{"history": [1]}', ttl=1)
+
+    response = client.get("/history")
+    assert response.json() == [1]
+    assert "Max-Age=100" in response.headers["set-cookie"]
+    assert store._entries[session_id][1] > time.time() + 50
@@ -0,0 +1,130 @@
+"""
+Single-flight coalescing of concurrent calls
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.core import metrics
+from app.core.singleflight import SingleFlight
+
+
+def wait_for_coalesced(name, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while metrics.get(f"{name}.coalesced") < count:
+        assert time.monotonic() < deadline, "callers did not join the in-flight call"
+        time.sleep(0.001)
+
+
+def test_do_runs_once_for_concurrent_callers():
+    metrics.reset()
+    flight = SingleFlight("sf_do")
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {"scores": [1, 2, 3]}
+
+    results = [None] * 5
+
+    def caller(i):
+        results[i] = flight.do("image", compute)
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    wait_for_coalesced("sf_do", 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(r == {"scores": [1, 2, 3]} for r in results)
+    # Followers get copies: one caller mutating its result does not affect the others
+    results[0]["scores"].append(4)
+    assert sum(r["scores"] == [1, 2, 3] for r in results) == 4
+    assert flight.in_flight() == 0
+
+
+def test_do_does_not_coalesce_different_keys_or_later_calls():
+    flight = SingleFlight("sf_keys")
+    calls = []
+
+    def compute(key):
+        calls.append(key)
+        return key
+
+    assert flight.do("a", compute, "a") == "a"
+    assert flight.do("b", compute, "b") == "b"
+    assert flight.do("a", compute, "a") == "a"
+    assert calls == ["a", "b", "a"]
+
+
+def test_do_raises_for_every_waiter_and_forgets_the_call():
+    metrics.reset()
+    flight = SingleFlight("sf_error")
+    release = threading.Event()
+    errors = []
+
+    def compute():
+        release.wait(5)
+        raise ValueError("bad image")
+
+    def caller():
+        try:
+            flight.do("image", compute)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=caller) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_for_coalesced("sf_error", 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == ["bad image"] * 3
+    assert flight.in_flight() == 0
+    assert flight.do("image", lambda: "retried") == "retried"
+
+
+def test_do_async_coalesces_coroutines():
+    metrics.reset()
+    flight = SingleFlight("sf_async")
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return [0.5, 0.5]
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("image", compute) for _ in range(4)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert results == [[0.5, 0.5]] * 4
+    assert metrics.get("sf_async.coalesced") == 3
+
+
+def test_do_async_propagates_errors():
+    flight = SingleFlight("sf_async_error")
+
+    def compute():
+        time.sleep(0.05)
+        raise RuntimeError("model failed")
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("image", compute) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    with pytest.raises(RuntimeError):
+        asyncio.run(flight.do_async("image", compute))
@@ -0,0 +1,475 @@
+"""
+Train the disease classifier and export it as a model registry version
+Chạy lệnh: python train.py data/train --val-dir data/validation --version v2
+
+1. Class folders are converted once into uint8 NumPy shards (decoded and
+   resized in a process pool, with the same preprocessing as serving).
+   With an index from index_dataset.py, invalid files are skipped, one
+   image per near-duplicate cluster is kept and validation images that
+   duplicate training ones are dropped. Later runs reuse the shards unless
+   --rebuild-shards is given or the index, image size, ROI crop setting,
+   dataset folders or validation split changed.
+2. Shards are memory-mapped and streamed through tf.data with shuffling,
+   parallel augmentation and prefetch; the validation split is cached.
+3. MobileNetV2 (create_tensorflow_model.build_mobilenet_model) trains its
+   head with a frozen base, then optionally fine-tunes the top of the base,
+   in float32 on CPU. Checkpoints are keyed on the shards and training
+   options (or --version), so rerunning an interrupted command resumes it.
+4. The best model is exported to models/<version>/disease_model.h5 and
+   registered in models/manifest.json (activated with --activate).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+SHARD_META = "meta.json"
+
+
+# === Shards ===
+
+def list_images(data_dir):
+    """(path, class folder name) pairs for every image under ``data_dir``"""
+    data_dir = Path(data_dir)
+    items = []
+    for folder in sorted(p for p in data_dir.iterdir() if p.is_dir()):
+        for path in sorted(folder.rglob("*")):
+            if path.suffix.lower() in IMAGE_SUFFIXES:
+                items.append((str(path), folder.name))
+    return items
+
+
+def load_dataset_index(path):
+    """Per-image entries of an index_dataset.py index keyed by resolved path, None without one"""
+    if not path or not Path(path).exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["images"]
+
+
+def dedupe_items(items, images, exclude=()):
+    """
+    Drop invalid images and all but the first image of each duplicate cluster
+
+    Args:
+        items: (path, class folder name) pairs
+        images: Index entries from ``load_dataset_index``
+        exclude: Cluster keys already used by another split
+
+    Returns:
+        tuple: (kept items, cluster keys of the kept items, skip counts)
+    """
+    kept, clusters = [], set()
+    skipped = {"invalid": 0, "duplicate": 0, "unindexed": 0}
+    exclude = set(exclude)
+    for path, name in items:
+        resolved = str(Path(path).resolve())
+        entry = images.get(resolved)
+        if entry is None:
+            skipped["unindexed"] += 1
+            key = resolved
+        elif not entry["valid"]:
+            skipped["invalid"] += 1
+            continue
+        else:
+            key = entry["duplicate_of"] or resolved
+        if key in clusters or key in exclude:
+            skipped["duplicate"] += 1
+            continue
+        clusters.add(key)
+        kept.append((path, name))
+    return kept, clusters, skipped
+
+
+def load_uint8(args):
+    """Preprocess one image exactly like serving, as uint8 (None if unreadable)"""
+    path, image_size, crop_leaf = args
+    from app.core.ml.preprocessing import preprocess_image
+    try:
+        img = preprocess_image(path, tuple(image_size), crop_leaf=crop_leaf)[0]
+    except Exception as e:
+        print(f"⚠️  Skipping {path}: {e}")
+        return None
+    return np.rint(img * 255.0).astype(np.uint8)
+
+
+def write_shards(items, labels, out_dir, image_size, shard_size, workers, crop_leaf):
+    """
+    Decode ``items`` in parallel into ``shard_XXXXX.npy`` / ``labels_XXXXX.npy`` files
+
+    Returns:
+        list: Shard descriptors {"images", "labels", "count"}
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    height, width = image_size
+    shards = []
+    jobs = ((path, image_size, crop_leaf) for path, _ in items)
+
+    with Pool(workers) as pool:
+        results = pool.imap(load_uint8, jobs, chunksize=8)
+        for index, start in enumerate(range(0, len(items), shard_size)):
+            count = min(shard_size, len(items) - start)
+            image_file = f"shard_{index:05d}.npy"
+            label_file = f"labels_{index:05d}.npy"
+            images = np.lib.format.open_memmap(out_dir / image_file, mode="w+", dtype=np.uint8,
+                                               shape=(count, height, width, 3))
+            shard_labels = np.empty(count, dtype=np.int16)
+
+            kept = 0
+            for offset in range(count):
+                img = next(results)
+                if img is None:
+                    continue
+                images[kept] = img
+                shard_labels[kept] = labels[start + offset]
+                kept += 1
+            images.flush()
+            del images
+
+            if kept < count:
+                # Drop the rows of unreadable images
+                full = np.load(out_dir / image_file, mmap_mode="r")[:kept].copy()
+                np.save(out_dir / image_file, full)
+            np.save(out_dir / label_file, shard_labels[:kept])
+            shards.append({"images": image_file, "labels": label_file, "count": kept})
+            print(f"   📦 {out_dir.name}/{image_file}: {kept} images")
+    return shards
+
+
+def build_shards(train_dir, val_dir, shard_dir, image_size, shard_size=1024, val_split=0.1,
+                 workers=None, crop_leaf=False, seed=0, index_path=None):
+    """
+    Convert the image folders into shards and write ``meta.json``
+
+    Without ``val_dir`` a random ``val_split`` of the training images is held
+    out. ``index_path`` points at an index_dataset.py index to filter with.
+    """
+    from app.core.ml.model_handler import class_key
+
+    images = load_dataset_index(index_path)
+    train_items = list_images(train_dir)
+    if images is not None:
+        train_items, train_clusters, skipped = dedupe_items(train_items, images)
+        print(f"🧹 Train: skipped {skipped['invalid']} invalid, {skipped['duplicate']} duplicates"
+              + (f" ({skipped['unindexed']} images not in the index)" if skipped["unindexed"] else ""))
+    classes = sorted({name for _, name in train_items})
+    if not classes:
+        raise ValueError(f"No class folders with images in {train_dir}")
+    class_index = {name: i for i, name in enumerate(classes)}
+
+    if val_dir and Path(val_dir).exists():
+        val_items = [item for item in list_images(val_dir) if item[1] in class_index]
+        if images is not None:
+            val_items, _, skipped = dedupe_items(val_items, images, exclude=train_clusters)
+            print(f"🧹 Validation: skipped {skipped['invalid']} invalid, "
+                  f"{skipped['duplicate']} duplicates (of each other or of training images)")
+    else:
+        rng = np.random.default_rng(seed)
+        order = rng.permutation(len(train_items))
+        cut = int(len(train_items) * val_split)
+        val_items = [train_items[i] for i in order[:cut]]
+        train_items = [train_items[i] for i in order[cut:]]
+
+    workers = workers or os.cpu_count() or 1
+    meta = {
+        "classes": classes,
+        "keys": [class_key(name) for name in classes],
+        **shard_source(train_dir, val_dir, val_split, image_size, crop_leaf, index_path if images is not None else None),
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "splits": {}
+    }
+    for split, items in (("train", train_items), ("validation", val_items)):
+        if not items:
+            continue
+        print(f"🗂️  Writing {split} shards ({len(items)} images, {workers} workers)...")
+        labels = np.array([class_index[name] for _, name in items], dtype=np.int16)
+        shards = write_shards(items, labels, shard_dir / split, image_size, shard_size, workers, crop_leaf)
+        meta["splits"][split] = {"shards": shards, "count": sum(s["count"] for s in shards)}
+
+    with open(shard_dir / SHARD_META, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    return meta
+
+
+def shard_source(train_dir, val_dir, val_split, image_size, crop_leaf, index_path):
+    """Inputs that determine the shard contents; shards are rebuilt when any of them differs"""
+    has_val = bool(val_dir) and Path(val_dir).exists()
+    return {
+        "train_dir": str(Path(train_dir).resolve()),
+        "val_dir": str(Path(val_dir).resolve()) if has_val else None,
+        "val_split": None if has_val else val_split,
+        "image_size": list(image_size),
+        "crop_leaf": bool(crop_leaf),
+        "index_mtime": Path(index_path).stat().st_mtime if index_path else None,
+    }
+
+
+def stale_fields(meta, source):
+    """Names of the ``shard_source`` fields that differ from the stored shard meta"""
+    return [field for field, value in source.items() if meta.get(field) != value]
+
+
+def read_shard_meta(shard_dir):
+    path = Path(shard_dir) / SHARD_META
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# === tf.data ===
+
+def shard_generator(split_dir, shards, shuffle, seed, extra=None):
+    """
+    Yield (image, label) rows from memory-mapped shards, shuffled shard by shard
+
+    ``extra`` optionally gives one array per shard (e.g. teacher soft labels)
+    whose rows are yielded as a third element.
+    """
+    epoch = [0]
+
+    def generate():
+        # A new order on every pass (the dataset repeats by re-calling this)
+        rng = np.random.default_rng([seed, epoch[0]])
+        epoch[0] += 1
+        order = rng.permutation(len(shards)) if shuffle else range(len(shards))
+        for i in order:
+            shard = shards[i]
+            images = np.load(split_dir / shard["images"], mmap_mode="r")
+            labels = np.load(split_dir / shard["labels"])
+            rows = rng.permutation(len(labels)) if shuffle else range(len(labels))
+            if extra is None:
+                for row in rows:
+                    yield images[row], labels[row]
+            else:
+                for row in rows:
+                    yield images[row], labels[row], extra[i][row]
+    return generate
+
+
+def make_dataset(shard_dir, meta, split, batch_size, training, seed=0):
+    """
+    Stream one split as batches of float32 images in [0, 1] and one-hot labels
+
+    The training split is reshuffled every epoch and augmented (flips,
+    brightness/contrast jitter) in parallel; the validation split is cached
+    in memory after the first pass.
+    """
+    import tensorflow as tf
+
+    info = meta["splits"][split]
+    height, width = meta["image_size"]
+    num_classes = len(meta["classes"])
+    split_dir = Path(shard_dir) / split
+
+    dataset = tf.data.Dataset.from_generator(
+        shard_generator(split_dir, info["shards"], training, seed),
+        output_signature=(
+            tf.TensorSpec((height, width, 3), tf.uint8),
+            tf.TensorSpec((), tf.int16)
+        )
+    )
+
+    def to_float(image, label):
+        return tf.cast(image, tf.float32) / 255.0, tf.one_hot(tf.cast(label, tf.int32), num_classes)
+
+    def augment(image, label):
+        image = tf.image.random_flip_left_right(image)
+        image = tf.image.random_flip_up_down(image)
+        image = tf.image.random_brightness(image, 0.1)
+        image = tf.image.random_contrast(image, 0.9, 1.1)
+        return tf.clip_by_value(image, 0.0, 1.0), label
+
+    if training:
+        dataset = dataset.repeat().shuffle(min(4096, info["count"]), seed=seed)
+        dataset = dataset.map(to_float, num_parallel_calls=tf.data.AUTOTUNE)
+        dataset = dataset.map(augment, num_parallel_calls=tf.data.AUTOTUNE)
+    else:
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(info["count"]))
+        dataset = dataset.map(to_float, num_parallel_calls=tf.data.AUTOTUNE).cache()
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+# === Training ===
+
+def compile_model(model, learning_rate):
+    try:
+        from keras.optimizers import Adam
+    except ImportError:
+        from tensorflow.keras.optimizers import Adam
+    model.compile(optimizer=Adam(learning_rate), loss="categorical_crossentropy", metrics=["accuracy"])
+
+
+def make_callbacks(checkpoint_dir, phase, patience):
+    try:
+        from keras import callbacks
+    except ImportError:
+        from tensorflow.keras import callbacks
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    return [
+        callbacks.ModelCheckpoint(str(checkpoint_dir / f"{phase}_best.weights.h5"), monitor="val_accuracy", mode="max",
+                                  save_best_only=True, save_weights_only=True),
+        callbacks.BackupAndRestore(str(checkpoint_dir / f"{phase}_backup")),
+        callbacks.EarlyStopping(monitor="val_accuracy", mode="max", patience=patience, restore_best_weights=True)
+    ]
+
+
+def train(meta, shard_dir, checkpoint_dir, epochs=10, fine_tune_epochs=0, fine_tune_layers=30,
+          batch_size=32, learning_rate=1e-3, weights="imagenet", alpha=1.0, patience=3):
+    """
+    Train head, then optionally fine-tune the top of the base
+
+    Returns:
+        tuple: (model, validation accuracy or None)
+    """
+    from create_tensorflow_model import build_mobilenet_model
+
+    height, width = meta["image_size"]
+    try:
+        model, base_model = build_mobilenet_model(len(meta["classes"]), (height, width, 3), weights, alpha)
+    except Exception as e:
+        # ImageNet weights need a download (and exist only for some sizes)
+        print(f"⚠️  Could not load {weights} weights ({e}); training from scratch")
+        model, base_model = build_mobilenet_model(len(meta["classes"]), (height, width, 3), None, alpha)
+        base_model.trainable = True
+    else:
+        base_model.trainable = weights is None
+
+    train_ds = make_dataset(shard_dir, meta, "train", batch_size, training=True)
+    has_val = "validation" in meta["splits"]
+    val_ds = make_dataset(shard_dir, meta, "validation", batch_size, training=False) if has_val else None
+    steps = max(1, meta["splits"]["train"]["count"] // batch_size)
+
+    print(f"🏋️  Training head: {epochs} epochs x {steps} steps")
+    compile_model(model, learning_rate)
+    model.fit(train_ds, validation_data=val_ds, epochs=epochs, steps_per_epoch=steps,
+              callbacks=make_callbacks(checkpoint_dir, "head", patience) if has_val else [])
+
+    if fine_tune_epochs > 0 and not base_model.trainable:
+        base_model.trainable = True
+        for layer in base_model.layers[:-fine_tune_layers]:
+            layer.trainable = False
+        # BatchNorm statistics stay frozen while fine-tuning small datasets
+        for layer in base_model.layers:
+            if layer.__class__.__name__ == "BatchNormalization":
+                layer.trainable = False
+        print(f"🎯 Fine-tuning top {fine_tune_layers} base layers: {fine_tune_epochs} epochs")
+        compile_model(model, learning_rate / 10)
+        model.fit(train_ds, validation_data=val_ds, epochs=fine_tune_epochs, steps_per_epoch=steps,
+                  callbacks=make_callbacks(checkpoint_dir, "fine_tune", patience) if has_val else [])
+
+    accuracy = None
+    if has_val:
+        _, accuracy = model.evaluate(val_ds, verbose=0)
+        print(f"📊 Validation accuracy: {accuracy:.3f}")
+    return model, accuracy
+
+
+def export_version(model, meta, version, accuracy=None, activate=False, input_size=None, **extra):
+    """
+    Save the model as a registry version and add it to the manifest
+
+    ``input_size`` defaults to the shard size; ``extra`` fields are stored in the entry.
+    """
+    from app.config import settings
+    from app.core.ml.model_registry import ModelRegistry
+
+    registry = ModelRegistry()
+    version_dir = registry.models_dir / version
+    version_dir.mkdir(parents=True, exist_ok=True)
+    model_path = version_dir / "disease_model.h5"
+    model.save(model_path)
+
+    height, width = input_size or meta["image_size"]
+    entry = {
+        "path": f"{version}/disease_model.h5",
+        # Columns that map onto rule classes are blended with the rule scores
+        "classes": [key or name for key, name in zip(meta["keys"], meta["classes"])],
+        "input_shape": [height, width, 3],
+        "trained_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "val_accuracy": accuracy,
+        **extra
+    }
+    registry.register_version(version, entry)
+    action = "student" if extra.get("role") == "student" else "activate"
+    if activate:
+        registry.write_manifest(active=version)
+
+    print(f"✅ Exported {model_path} ({model_path.stat().st_size / (1024 * 1024):.1f} MB)")
+    print(f"📝 Registered version '{version}' in {settings.MODEL_MANIFEST_PATH.name}"
+          + (" (active)" if activate else f" - serve it with POST /api/models/{version}/{action}"))
+    return model_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("train_dir", help="Folder with one subfolder per class")
+    parser.add_argument("--val-dir", help="Validation folder (default: hold out --val-split)")
+    parser.add_argument("--val-split", type=float, default=0.1)
+    parser.add_argument("--shards", default="data/shards", help="Shard directory")
+    parser.add_argument("--rebuild-shards", action="store_true")
+    parser.add_argument("--index", default="data/dataset_index.json",
+                        help="index_dataset.py index used to skip bad files and duplicates (if present)")
+    parser.add_argument("--shard-size", type=int, default=1024, help="Images per shard")
+    parser.add_argument("--workers", type=int, default=None, help="Decode processes (default: CPU count)")
+    parser.add_argument("--image-size", type=int, default=None, help="Square input size (default: IMG_HEIGHT)")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--fine-tune-epochs", type=int, default=0)
+    parser.add_argument("--fine-tune-layers", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--learning-rate", type=float, default=1e-3)
+    parser.add_argument("--alpha", type=float, default=1.0, help="MobileNetV2 width (0.35 trains fastest on CPU)")
+    parser.add_argument("--weights", default="imagenet", help="'imagenet' or 'none'")
+    parser.add_argument("--checkpoints", default="data/checkpoints",
+                        help="Checkpoint directory (an interrupted run resumes when rerun with the same options)")
+    parser.add_argument("--version", default=None, help="Registry version name (default: timestamp)")
+    parser.add_argument("--activate", action="store_true", help="Make the new version active")
+    args = parser.parse_args()
+
+    from app.config import settings
+    from app.core.ml.fast_path import configure_threads
+
+    configure_threads()
+    image_size = [args.image_size, args.image_size] if args.image_size else list(settings.IMG_SIZE)
+    shard_dir = Path(args.shards)
+
+    index_path = Path(args.index) if args.index and Path(args.index).exists() else None
+    source = shard_source(args.train_dir, args.val_dir, args.val_split, image_size,
+                          settings.ROI_CROP_ENABLED, index_path)
+    meta = None if args.rebuild_shards else read_shard_meta(shard_dir)
+    stale = stale_fields(meta, source) if meta is not None else []
+    if stale:
+        print(f"⚠️  Shards were built with a different {', '.join(stale)}, rebuilding")
+        meta = None
+    if meta is None:
+        meta = build_shards(Path(args.train_dir), args.val_dir, shard_dir, image_size,
+                            args.shard_size, args.val_split, args.workers, settings.ROI_CROP_ENABLED,
+                            index_path=index_path)
+    else:
+        print(f"♻️  Reusing shards in {shard_dir} ({meta['splits']['train']['count']} training images)")
+
+    version = args.version or time.strftime("v%Y%m%d-%H%M%S")
+    weights = None if args.weights.lower() == "none" else args.weights
+    # Same shards and options -> same checkpoint dir, so a rerun resumes from BackupAndRestore
+    options = [meta["created_at"], args.epochs, args.fine_tune_epochs, args.fine_tune_layers,
+               args.batch_size, args.learning_rate, args.alpha, weights]
+    run_name = args.version or "run-" + hashlib.sha1(json.dumps(options).encode()).hexdigest()[:12]
+    start = time.perf_counter()
+    model, accuracy = train(
+        meta, shard_dir, Path(args.checkpoints) / run_name,
+        epochs=args.epochs, fine_tune_epochs=args.fine_tune_epochs, fine_tune_layers=args.fine_tune_layers,
+        batch_size=args.batch_size, learning_rate=args.learning_rate, weights=weights, alpha=args.alpha
+    )
+    print(f"⏱️  Training took {(time.perf_counter() - start) / 60:.1f} min")
+    export_version(model, meta, version, accuracy, args.activate)
+
+
+if __name__ == "__main__":
+    main()